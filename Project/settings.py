@@ -79,7 +79,8 @@ WSGI_APPLICATION = 'Project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLITE_PATH — другая база (например, временная у benchmark_import)
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -113,6 +114,22 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Кэш общий для всех процессов на сервере: воркеры сайта, импорт, снятие
+# резервов. Сброс версий фрагментов (catalog_cache.bump) и сводки корзины
+# из одного процесса должны видеть все остальные, а LocMemCache у каждого
+# процесса свой. С SQLite всё и так живёт на одной машине, поэтому хватает
+# файлового кэша; при переезде на несколько серверов — Redis или Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', BASE_DIR / '.cache'),
+        'OPTIONS': {
+            # Фрагменты витрины, версии областей и сводки корзин
+            'MAX_ENTRIES': 20000,
+        },
+    }
+}
+
 # Кастомная модель пользователя
 AUTH_USER_MODEL = 'shop.Customer'
 
@@ -126,6 +143,8 @@ SITE_URL = 'https://tulasad71.ru' if not DEBUG else 'http://localhost:8000'
 # Telegram
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID', '')
+# Адрес Bot API; в тестах подменяется локальной заглушкой
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
 
 # Безопасные настройки для production
 if not DEBUG:
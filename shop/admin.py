@@ -1,7 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
-from django.utils.html import format_html
+from django.db.models import Count, DecimalField, ExpressionWrapper, F
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
 from .models import *
+from . import reservations
+from .orders import bulk_cancel, bulk_confirm
 
 
 class CustomerAdmin(UserAdmin):
@@ -24,10 +29,14 @@ class CustomerAdmin(UserAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(order_count=Count('orders'))
+
     def order_count(self, obj):
-        return obj.orders.count()
+        return obj.order_count
 
     order_count.short_description = 'Количество заказов'
+    order_count.admin_order_field = 'order_count'
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -36,10 +45,14 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ['name']
     prepopulated_fields = {'slug': ('name',)}
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(product_count=Count('products'))
+
     def product_count(self, obj):
-        return obj.products.count()
+        return obj.product_count
 
     product_count.short_description = 'Количество товаров'
+    product_count.admin_order_field = 'product_count'
 
 
 class ProductImageInline(admin.TabularInline):
@@ -49,18 +62,20 @@ class ProductImageInline(admin.TabularInline):
 
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'old_price', 'quantity', 'available', 'is_featured', 'created_at']
+    list_display = ['name', 'sku', 'category', 'price', 'old_price', 'quantity', 'reserved', 'available',
+                    'is_featured', 'created_at']
     list_filter = ['category', 'is_active', 'is_featured', 'created_at']
-    search_fields = ['name', 'description']
+    search_fields = ['name', 'sku', 'description']
     list_editable = ['price', 'quantity', 'is_featured']
-    readonly_fields = ['created_at', 'updated_at', 'discount_percent_display']
+    list_select_related = ['category']
+    readonly_fields = ['created_at', 'updated_at', 'discount_percent_display', 'reserved']
     inlines = [ProductImageInline]
     fieldsets = (
         ('Основная информация', {
-            'fields': ('name', 'category', 'description', 'short_description')
+            'fields': ('name', 'sku', 'category', 'description', 'short_description')
         }),
         ('Цены и количество', {
-            'fields': ('price', 'old_price', 'discount_percent_display', 'quantity')
+            'fields': ('price', 'old_price', 'discount_percent_display', 'quantity', 'reserved')
         }),
         ('Изображения', {
             'fields': ('image',)
@@ -87,80 +102,28 @@ class ProductAdmin(admin.ModelAdmin):
         """Представление для импорта Excel"""
         from django.shortcuts import render, redirect
         from django.contrib import messages
-        import pandas as pd
-        import requests
-        from io import BytesIO
-        from django.core.files.base import ContentFile
-        from django.core.files import File
+        from .import_readers import SUPPORTED_EXTENSIONS
 
         if request.method == 'POST' and request.FILES.get('excel_file'):
-            try:
-                excel_file = request.FILES['excel_file']
-
-                # Проверяем расширение
-                if not excel_file.name.endswith(('.xlsx', '.xls')):
-                    messages.error(request, 'Поддерживаются только файлы Excel (.xlsx, .xls)')
-                    return redirect('admin:shop_product_changelist')
-
-                # Читаем Excel
-                df = pd.read_excel(excel_file)
-
-                created_count = 0
-                error_count = 0
-
-                for index, row in df.iterrows():
-                    try:
-                        # Получаем или создаем категорию
-                        category_name = row.get('Категория', 'Разное')
-                        category, _ = Category.objects.get_or_create(
-                            name=category_name,
-                            defaults={'slug': category_name.lower().replace(' ', '-'), 'is_active': True}
-                        )
-
-                        # Создаем товар
-                        product = Product(
-                            name=row['Название'],
-                            description=str(row.get('Описание', '')),
-                            short_description=str(row.get('Краткое описание', '')),
-                            price=float(row['Цена']),
-                            old_price=float(row.get('Старая цена', 0)) if pd.notna(row.get('Старая цена')) else None,
-                            quantity=int(row.get('Количество', 0)),
-                            category=category,
-                            is_active=True
-                        )
-
-                        # Загружаем изображение если есть URL
-                        image_url = row.get('Изображение')
-                        if pd.notna(image_url) and str(image_url).startswith('http'):
-                            try:
-                                response = requests.get(str(image_url), timeout=10)
-                                if response.status_code == 200:
-                                    # Генерируем имя файла
-                                    file_extension = str(image_url).split('.')[-1].lower()
-                                    if file_extension not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                                        file_extension = 'jpg'
-
-                                    filename = f"{product.name.lower().replace(' ', '_')}_{index}.{file_extension}"
-                                    image_content = ContentFile(response.content)
-                                    product.image.save(filename, File(image_content))
-                            except:
-                                pass
-
-                        product.save()
-                        created_count += 1
-
-                    except Exception as e:
-                        error_count += 1
-                        print(f"Ошибка в строке {index}: {e}")
-
-                messages.success(request, f'✅ Импорт завершен! Создано товаров: {created_count}, Ошибок: {error_count}')
-
-            except Exception as e:
-                messages.error(request, f'❌ Ошибка при обработке файла: {str(e)}')
-
-            return redirect('admin:shop_product_changelist')
-
-        return render(request, 'admin/shop/import_form.html')
+            excel_file = request.FILES['excel_file']
+
+            # Проверяем расширение
+            if not excel_file.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                messages.error(request, 'Поддерживаются только файлы Excel (.xlsx, .xls) и CSV')
+                return redirect('admin:shop_product_changelist')
+
+            # Ставим импорт в очередь, обработает его run_import_worker
+            mode = request.POST.get('mode')
+            import_task = ProductImport.objects.create(
+                file=excel_file,
+                created_by=request.user,
+                mode=mode if mode in dict(ProductImport.MODE_CHOICES) else 'create',
+                deactivate_missing=bool(request.POST.get('deactivate_missing')),
+            )
+            messages.success(request, f'📥 Импорт #{import_task.id} поставлен в очередь')
+            return redirect('admin:shop_productimport_progress', import_task.id)
+
+        return render(request, 'admin/shop/import_form.html', {'mode_choices': ProductImport.MODE_CHOICES})
 
     def discount_percent_display(self, obj):
         if obj.has_discount:
@@ -194,6 +157,7 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['id', 'customer__email', 'customer__first_name', 'customer__last_name']
     readonly_fields = ['id', 'customer', 'created_at', 'updated_at', 'total_amount', 'contact_phone',
                        'delivery_address']
+    list_select_related = ['customer']
     inlines = [OrderItemInline]
     actions = ['confirm_orders', 'cancel_orders']
 
@@ -218,6 +182,7 @@ class OrderAdmin(admin.ModelAdmin):
         return f"{obj.total_amount} руб."
 
     total_amount_display.short_description = 'Сумма'
+    total_amount_display.admin_order_field = 'total_amount'
 
     def status_display(self, obj):
         status_colors = {
@@ -250,21 +215,25 @@ class OrderAdmin(admin.ModelAdmin):
     action_buttons.allow_tags = True
 
     def confirm_orders(self, request, queryset):
-        for order in queryset:
-            if order.status == 'new':
-                order.update_status('confirmed', 'Подтверждено массово через админку')
-        self.message_user(request, f"{queryset.count()} заказов подтверждено")
+        result = bulk_confirm(list(queryset.values_list('pk', flat=True)), 'Подтверждено массово через админку')
+        self.report_bulk_result(request, result, 'подтверждено')
 
     confirm_orders.short_description = '✅ Подтвердить выбранные заказы'
 
     def cancel_orders(self, request, queryset):
-        for order in queryset:
-            if order.status == 'new':
-                order.update_status('cancelled', 'Отменено массово через админку')
-        self.message_user(request, f"{queryset.count()} заказов отменено")
+        result = bulk_cancel(list(queryset.values_list('pk', flat=True)), 'Отменено массово через админку')
+        self.report_bulk_result(request, result, 'отменено')
 
     cancel_orders.short_description = '❌ Отменить выбранные заказы'
 
+    def report_bulk_result(self, request, result, verb):
+        self.message_user(request, f"{len(result.changed)} заказов {verb}")
+        if result.skipped:
+            self.message_user(request, format_html(
+                'Пропущено заказов: {}<ul>{}</ul>', len(result.skipped),
+                format_html_join('', '<li>#{}: {}</li>', result.skipped.items()),
+            ), messages.WARNING)
+
     def get_urls(self):
         from django.urls import path
         urls = super().get_urls()
@@ -293,9 +262,10 @@ class OrderAdmin(admin.ModelAdmin):
 
 
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user_display', 'total_quantity', 'total_amount_display', 'created_at']
+    list_display = ['id', 'user_display', 'item_count', 'total_amount_display', 'created_at']
     list_filter = ['created_at']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['item_count', 'subtotal', 'created_at', 'updated_at']
+    list_select_related = ['user']
 
     def user_display(self, obj):
         if obj.user:
@@ -305,34 +275,73 @@ class CartAdmin(admin.ModelAdmin):
     user_display.short_description = 'Пользователь'
 
     def total_amount_display(self, obj):
-        return f"{obj.total_amount} руб."
+        return f"{obj.subtotal} руб."
 
     total_amount_display.short_description = 'Сумма'
+    total_amount_display.admin_order_field = 'subtotal'
+
+
+def line_total(price):
+    """Сумма позиции в запросе — для сортировки по столбцу «Сумма»"""
+    return ExpressionWrapper(F(price) * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2))
 
 
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['cart', 'product', 'quantity', 'total_price_display']
     list_filter = ['cart__user']
+    list_select_related = ['cart__user', 'product']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(line_total=line_total('product__price'))
 
     def total_price_display(self, obj):
         return f"{obj.total_price} руб."
 
     total_price_display.short_description = 'Сумма'
+    total_price_display.admin_order_field = 'line_total'
+
+    # Правки из админки не проходят через change_cart — пересчитываем итоги целиком
+    # и доводим резерв корзины до новых позиций (хватит ли товара, проверил CartItem.clean)
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'product' in form.changed_data:
+            reservations.hold(obj.cart, Product(pk=form.initial['product']), 0)
+        reservations.hold(obj.cart, obj.product, obj.quantity)
+        obj.cart.recalculate()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        reservations.hold(obj.cart, obj.product, 0)
+        obj.cart.recalculate()
+
+    def delete_queryset(self, request, queryset):
+        items = list(queryset.select_related('cart', 'product'))
+        super().delete_queryset(request, queryset)
+        for item in items:
+            reservations.hold(item.cart, item.product, 0)
+        for cart in {item.cart_id: item.cart for item in items}.values():
+            cart.recalculate()
 
 
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'price', 'total_price_display']
     list_filter = ['order__status']
+    list_select_related = ['order__customer', 'product']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(line_total=line_total('price'))
 
     def total_price_display(self, obj):
         return f"{obj.total_price} руб."
 
     total_price_display.short_description = 'Сумма'
+    total_price_display.admin_order_field = 'line_total'
 
 
 class ProductImageAdmin(admin.ModelAdmin):
     list_display = ['product', 'image_preview', 'alt_text', 'order']
     list_editable = ['order']
+    list_select_related = ['product']
 
     def image_preview(self, obj):
         if obj.image:
@@ -345,6 +354,7 @@ class ProductImageAdmin(admin.ModelAdmin):
         list_display = ['user', 'message_short', 'created_at', 'is_read']
         list_filter = ['created_at', 'is_read']
         search_fields = ['user__first_name', 'user__last_name', 'message']
+        list_select_related = ['user']
 
         def message_short(self, obj):
             return obj.message[:50] + '...' if len(obj.message) > 50 else obj.message
@@ -355,6 +365,136 @@ class ProductImageAdmin(admin.ModelAdmin):
 
 
 
+class ProductImportAdmin(admin.ModelAdmin):
+    list_display = ['id', 'file', 'mode', 'status', 'progress_display', 'imported_count', 'updated_count',
+                    'unchanged_count', 'deactivated_count', 'error_count', 'created_by', 'created_at']
+    list_filter = ['status', 'mode', 'created_at']
+    readonly_fields = ['file', 'mode', 'deactivate_missing', 'status', 'progress_display', 'total_rows',
+                       'processed_rows', 'rows_per_second', 'imported_count', 'updated_count', 'unchanged_count',
+                       'deactivated_count', 'error_count', 'errors', 'stats_display', 'created_by', 'created_at',
+                       'started_at', 'finished_at', 'heartbeat_at']
+    exclude = ['updated_at', 'stats']
+    list_select_related = ['created_by']
+    actions = ['restart_imports']
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress_display(self, obj):
+        url = reverse('admin:shop_productimport_progress', args=[obj.pk])
+        return format_html('<a href="{}">{}% ({} / {})</a>', url, obj.progress_percent,
+                           obj.processed_rows, obj.total_rows)
+
+    progress_display.short_description = 'Прогресс'
+
+    STAGE_LABELS = {
+        'read': 'Чтение файла',
+        'validate': 'Проверка строк',
+        'categories': 'Категории',
+        'diff': 'Сравнение с каталогом',
+        'images': 'Картинки',
+        'write': 'Запись в базу',
+        'deactivate': 'Скрытие отсутствующих',
+    }
+
+    def stats_display(self, obj):
+        """Разбивка времени и SQL-запросов по этапам импорта"""
+        timings = obj.stats.get('timings', {})
+        if not timings:
+            return '—'
+        queries = obj.stats.get('queries', {})
+        total = sum(timings.values()) or 1
+        rows = format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}%</td><td>{}</td></tr>', (
+            (self.STAGE_LABELS.get(stage, stage), f"{seconds:.2f}", round(seconds * 100 / total),
+             queries.get(stage, 0))
+            for stage, seconds in sorted(timings.items(), key=lambda item: -item[1])
+        ))
+        images = obj.stats.get('images', {})
+        return format_html(
+            '<table><tr><th>Этап</th><th>Секунд</th><th>Доля</th><th>SQL-запросов</th></tr>{}'
+            '<tr><th>Итого</th><th>{}</th><th></th><th>{}</th></tr></table>'
+            '<p>Картинки: из кэша {}, скачано {} ({} КБ), не скачалось {}</p>',
+            rows, f"{sum(timings.values()):.2f}", sum(queries.values()),
+            images.get('cache_hits', 0), images.get('downloaded', 0),
+            round(images.get('bytes', 0) / 1024), images.get('failed', 0),
+        )
+
+    stats_display.short_description = 'Статистика по этапам'
+
+    def restart_imports(self, request, queryset):
+        count = queryset.filter(status='error').update(status='pending')
+        self.message_user(request, f"{count} импортов снова поставлено в очередь")
+
+    restart_imports.short_description = '🔁 Продолжить упавшие импорты'
+
+    def get_urls(self):
+        from django.urls import path
+        urls = super().get_urls()
+        custom_urls = [
+            path('<path:object_id>/progress/', self.admin_site.admin_view(self.progress_view),
+                 name='shop_productimport_progress'),
+            path('<path:object_id>/progress.json', self.admin_site.admin_view(self.progress_json),
+                 name='shop_productimport_progress_json'),
+        ]
+        return custom_urls + urls
+
+    def progress_data(self, obj):
+        return {
+            'status': obj.status,
+            'status_display': obj.get_status_display(),
+            'finished': obj.is_finished,
+            'total_rows': obj.total_rows,
+            'processed_rows': obj.processed_rows,
+            'percent': obj.progress_percent,
+            'rows_per_second': round(obj.rows_per_second, 1),
+            'eta_seconds': obj.eta_seconds,
+            'imported_count': obj.imported_count,
+            'updated_count': obj.updated_count,
+            'unchanged_count': obj.unchanged_count,
+            'deactivated_count': obj.deactivated_count,
+            'error_count': obj.error_count,
+        }
+
+    def progress_view(self, request, object_id):
+        from django.shortcuts import get_object_or_404, render
+        obj = get_object_or_404(ProductImport, pk=object_id)
+        return render(request, 'admin/shop/productimport/progress.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': obj,
+            'title': f'Импорт #{obj.pk}',
+            'progress': self.progress_data(obj),
+        })
+
+    def progress_json(self, request, object_id):
+        from django.http import JsonResponse
+        from django.shortcuts import get_object_or_404
+        obj = get_object_or_404(ProductImport, pk=object_id)
+        return JsonResponse(self.progress_data(obj))
+
+
+class TelegramMessageAdmin(admin.ModelAdmin):
+    list_display = ['id', 'chat_id', 'short_text', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['chat_id', 'text', 'status', 'attempts', 'next_attempt_at', 'claim', 'claimed_at',
+                       'last_error', 'created_at', 'sent_at']
+    actions = ['retry_messages']
+
+    def has_add_permission(self, request):
+        return False
+
+    def short_text(self, obj):
+        return obj.text[:80]
+
+    short_text.short_description = 'Текст'
+
+    def retry_messages(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} уведомлений снова в очереди')
+
+    retry_messages.short_description = 'Отправить недоставленные ещё раз'
+
+
 admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Product, ProductAdmin)
@@ -363,6 +503,8 @@ admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Cart, CartAdmin)
 admin.site.register(CartItem, CartItemAdmin)
 admin.site.register(ProductImage, ProductImageAdmin)
+admin.site.register(ProductImport, ProductImportAdmin)
+admin.site.register(TelegramMessage, TelegramMessageAdmin)
 
 
 admin.site.site_header = 'Панель управления магазином'
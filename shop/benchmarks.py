@@ -0,0 +1,292 @@
+"""Замеры скорости и памяти импорта товаров.
+
+Генерирует синтетические прайс-листы (с картинками и без), прогоняет их
+через ``process_excel_import`` напрямую и через загрузку в админке и
+записывает строк/сек, число SQL-запросов, пиковый RSS и время этапов
+в JSON. Результаты двух версий сравниваются через ``--compare``.
+
+Каждый сценарий выполняется в отдельном процессе на своей временной базе
+и своём MEDIA_ROOT — так пиковый RSS не копится между сценариями, а
+рабочая база и медиа не трогаются. Запуск: ``manage.py benchmark_import``.
+"""
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openpyxl import Workbook
+from PIL import Image
+
+from .importer import (COL_CATEGORY, COL_DESCRIPTION, COL_IMAGE, COL_NAME, COL_OLD_PRICE, COL_PRICE,
+                       COL_QUANTITY, COL_SKU)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+PATHS = ('job', 'admin')
+
+# Метрика -> True, если больше — лучше
+METRICS = {
+    'rows_per_second': True,
+    'queries': False,
+    'peak_rss_mb': False,
+}
+
+# Этап -> наибольшая доля времени импорта, которую он может занимать
+STAGE_SHARES = {
+    'index': 0.3,
+}
+DESCRIPTION_WORDS = (
+    'ранний', 'сорт', 'томатов', 'для', 'открытого', 'грунта', 'и', 'теплиц', 'урожайный', 'плоды',
+    'красные', 'сладкие', 'устойчив', 'к', 'болезням', 'посев', 'на', 'рассаду', 'в', 'марте',
+    'семена', 'огурцов', 'пчелоопыляемый', 'гибрид', 'кусты', 'компактные', 'созревание', 'дружное',
+    'подходит', 'консервирования', 'салатов', 'лопата', 'штыковая', 'закалённая', 'сталь', 'черенок',
+)
+
+
+def write_workbook(path, rows, image_base_url=None, images_every=10):
+    """Пишет прайс-лист на ``rows`` строк в режиме write-only.
+
+    С ``image_base_url`` у каждой строки есть картинка; одна и та же
+    картинка повторяется у ``images_every`` товаров, как у реальных
+    поставщиков.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header = [COL_SKU, COL_NAME, COL_DESCRIPTION, COL_PRICE, COL_OLD_PRICE, COL_QUANTITY, COL_CATEGORY]
+    if image_base_url:
+        header.append(COL_IMAGE)
+    sheet.append(header)
+    for i in range(rows):
+        # Описание из настоящих слов, чтобы замер включал стемминг для поискового индекса
+        words = [DESCRIPTION_WORDS[(i * 7 + j * 3) % len(DESCRIPTION_WORDS)] for j in range(12)]
+        row = [f"SKU-{i:07d}", f"Товар {i} {words[0]}", ' '.join(words).capitalize(),
+               100 + i % 900, (200 + i % 900) if i % 3 == 0 else None, i % 50, f"Категория {i % 20}"]
+        if image_base_url:
+            row.append(f"{image_base_url}/img/{i // images_every}.jpg")
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    """Поставщик картинок для замеров: свой маленький JPEG на каждый путь"""
+    latency = 0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        buffer = io.BytesIO()
+        color = hash(self.path) & 0xFFFFFF
+        Image.new('RGB', (64, 64), (color >> 16, (color >> 8) & 0xFF, color & 0xFF)).save(buffer, 'JPEG')
+        body = buffer.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(latency=0):
+    """Запускает заглушку в фоновом потоке; возвращает (сервер, базовый URL)"""
+    handler = type('Handler', (StubImageHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def scenario_name(rows, images, path):
+    return f"{rows}-{'images' if images else 'plain'}-{path}"
+
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса в МБ (None, где нет модуля resource)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_scenario(workbook, path='job'):
+    """Импортирует ``workbook`` во временную базу и возвращает метрики.
+
+    Выполняется в дочернем процессе: создаёт тестовую базу и подменяет
+    MEDIA_ROOT, поэтому в обычном процессе сайта не вызывается.
+    """
+    from django.contrib.auth import get_user_model
+    from django.core.files import File
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+
+    from .import_jobs import claim_next_import, process_excel_import
+    from .models import ImageSource, Product, ProductImport
+    from .thumbnails import wait_pending
+
+    workdir = tempfile.mkdtemp(prefix='ogorod-bench-')
+    connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    setup_test_environment()
+
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    with override_settings(MEDIA_ROOT=os.path.join(workdir, 'media')):
+        user = get_user_model().objects.create_superuser(
+            'bench@example.com', '+70000000000', 'Bench', 'Bench', 'bench')
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            if path == 'admin':
+                client = Client()
+                client.force_login(user)
+                with open(workbook, 'rb') as f:
+                    client.post(reverse('admin:product_import_excel'), {'excel_file': f, 'mode': 'create'})
+                import_task = claim_next_import()
+            else:
+                with open(workbook, 'rb') as f:
+                    import_task = ProductImport.objects.create(
+                        file=File(f, os.path.basename(workbook)), created_by=user)
+            result = process_excel_import(import_task)
+        elapsed = time.perf_counter() - started
+
+        thumbnails_started = time.perf_counter()
+        wait_pending()
+        thumbnails = time.perf_counter() - thumbnails_started
+
+        import_task.refresh_from_db()
+        if result is None:
+            raise RuntimeError(f"Импорт упал: {import_task.errors}")
+        rows = import_task.processed_rows
+        return {
+            'rows': rows,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed, 1) if elapsed else 0,
+            'queries': queries,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': {stage: round(seconds, 3) for stage, seconds in sorted(result.timings.items())},
+            'stage_queries': dict(sorted(result.queries.items())),
+            'images_stats': result.images,
+            'thumbnails_seconds': round(thumbnails, 3),
+            'created': Product.objects.count(),
+            'images_downloaded': ImageSource.objects.count(),
+            'errors': import_task.error_count,
+        }
+
+
+def run_in_subprocess(workbook, path):
+    """Запускает ``run_scenario`` в отдельном процессе ``manage.py``"""
+    from django.conf import settings
+
+    command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_import',
+               '--single', workbook, '--path', path]
+    # Рабочая база дочернему процессу не нужна: всё, что откроет соединение
+    # до создания тестовой базы, попадёт во временный каталог
+    workdir = tempfile.mkdtemp(prefix='ogorod-bench-db-')
+    env = {**os.environ, 'SQLITE_PATH': os.path.join(workdir, 'db.sqlite3')}
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, env=env)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if completed.returncode:
+        raise RuntimeError(f"{os.path.basename(workbook)} ({path}):\n{completed.stderr}")
+    # Последняя строка вывода — JSON с метриками
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_suite(sizes=DEFAULT_SIZES, paths=PATHS, images=(False, True), latency=0, log=None):
+    """Прогоняет все сценарии; возвращает словарь для JSON-отчёта"""
+    server, base_url = start_stub_server(latency)
+    workdir = tempfile.mkdtemp(prefix='ogorod-bench-files-')
+    results = []
+    try:
+        for rows in sizes:
+            for with_images in images:
+                workbook = write_workbook(
+                    os.path.join(workdir, f"{rows}-{int(with_images)}.xlsx"),
+                    rows, base_url if with_images else None,
+                )
+                for path in paths:
+                    name = scenario_name(rows, with_images, path)
+                    if log:
+                        log(f"{name}…")
+                    metrics = run_in_subprocess(workbook, path)
+                    results.append({'scenario': name, 'images': with_images, 'path': path, **metrics})
+                    if log:
+                        log(f"{name}: {metrics['rows_per_second']} строк/сек, "
+                            f"{metrics['queries']} запросов, {metrics['peak_rss_mb']} МБ")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {'meta': environment(latency), 'results': results}
+
+
+def environment(latency=0):
+    """Версии и коммит, к которым относятся замеры"""
+    import django
+    import pandas
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pandas': pandas.__version__,
+        'platform': platform.platform(),
+        'stub_latency': latency,
+    }
+
+
+def stage_share_violations(report, shares=STAGE_SHARES):
+    """Этапы, которые заняли большую долю времени импорта, чем разрешено в ``shares``"""
+    violations = []
+    for result in report['results']:
+        total = sum(result['stages'].values())
+        for stage, limit in shares.items():
+            spent = result['stages'].get(stage, 0)
+            if total and spent / total > limit:
+                violations.append(f"{result['scenario']}: этап {stage} — {spent / total:.0%} времени "
+                                  f"(допустимо {limit:.0%})")
+    return violations
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """Сравнивает два отчёта по сценариям с одинаковым именем.
+
+    Возвращает список строк-регрессий: метрика ухудшилась больше, чем на
+    ``tolerance`` (доля).
+    """
+    before = {result['scenario']: result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = before.get(result['scenario'])
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            was, now = old.get(metric), result.get(metric)
+            if not was or now is None:
+                continue
+            change = (now - was) / was
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{result['scenario']}: {metric} {was} -> {now} ({change:+.0%})")
+    return regressions
@@ -0,0 +1,157 @@
+"""Итоги корзины: число товаров и сумма.
+
+Итоги хранятся в самой корзине (``Cart.item_count`` и ``Cart.subtotal``)
+и меняются атомарными F()-обновлениями вместе с позициями —
+``change_cart``. Сводка для шапки читается одной строкой корзины,
+запоминается на время запроса и кладётся в кэш по владельцу корзины
+(пользователь или ключ сессии).
+Пока корзина не меняется, страницы не делают ни одного запроса к
+корзине. Изменения позиций сбрасывают кэш через сигналы (``signals.py``),
+поэтому правки из админки тоже видны сразу. Смена цены товара в кэше
+не отслеживается — сумма догонит её после ``SUMMARY_TIMEOUT``.
+
+Кэш — ``default`` из CACHES; он должен быть общим для всех процессов
+сайта (см. ``catalog_cache.check_shared_cache``), иначе сброс увидит
+только один процесс.
+"""
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+SUMMARY_TIMEOUT = 15 * 60
+
+
+class CartSummary(NamedTuple):
+    count: int = 0
+    total: Decimal = Decimal('0')
+
+    @property
+    def is_empty(self):
+        return not self.count
+
+
+EMPTY = CartSummary()
+
+
+def summary_key(user_id=None, session_key=None):
+    if user_id:
+        return f'cart-summary:user:{user_id}'
+    if session_key:
+        return f'cart-summary:session:{session_key}'
+    return None
+
+
+def _request_key(request):
+    if request.user.is_authenticated:
+        return summary_key(user_id=request.user.pk)
+    return summary_key(session_key=request.session.session_key)
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(Decimal('0.01'))
+
+
+def compute_summary(user_id=None, session_key=None):
+    """Сводка по сохранённым итогам корзины — одна строка из базы"""
+    if user_id:
+        carts = Cart.objects.filter(user_id=user_id)
+    else:
+        carts = Cart.objects.filter(session_key=session_key, user=None)
+    row = carts.values_list('item_count', 'subtotal').first()
+    return CartSummary(row[0], _money(row[1])) if row else EMPTY
+
+
+def get_cart_summary(request):
+    """Сводка корзины текущего посетителя (из памяти запроса, кэша или базы)"""
+    if hasattr(request, '_cart_summary'):
+        return request._cart_summary
+
+    key = _request_key(request)
+    if key is None:
+        # Сессии ещё нет — значит, нет и корзины
+        summary = EMPTY
+    else:
+        summary = cache.get(key)
+        if summary is None:
+            if request.user.is_authenticated:
+                summary = compute_summary(user_id=request.user.pk)
+            else:
+                summary = compute_summary(session_key=request.session.session_key)
+            cache.set(key, summary, SUMMARY_TIMEOUT)
+    request._cart_summary = summary
+    return summary
+
+
+def cart_lines(cart):
+    """Позиции корзины вместе с товарами одним запросом и сводка по ним.
+
+    Итоги считаются по уже загруженным строкам, отдельного запроса за
+    суммой не нужно.
+    """
+    lines = list(cart.items.select_related('product').order_by('id'))
+    summary = CartSummary(sum(line.quantity for line in lines),
+                          _money(sum(line.total_price for line in lines)))
+    if summary != (cart.item_count, cart.subtotal):
+        # Цены товаров поменялись или итоги разошлись — поправляем заодно
+        cart.item_count, cart.subtotal = summary
+        Cart.objects.filter(pk=cart.pk).update(item_count=cart.item_count, subtotal=cart.subtotal)
+    return lines, summary
+
+
+def remember_summary(request, summary):
+    """Кладёт уже посчитанную сводку в память запроса и в кэш"""
+    request._cart_summary = summary
+    key = _request_key(request)
+    if key:
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+
+
+def change_cart(cart, quantity, amount):
+    """Меняет сохранённые итоги корзины на ``quantity`` штук и ``amount`` рублей.
+
+    Обновление атомарное (F-выражения), поэтому параллельные запросы к одной
+    корзине не затирают друг друга.
+    """
+    Cart.objects.filter(pk=cart.pk).update(
+        item_count=F('item_count') + quantity,
+        subtotal=F('subtotal') + amount,
+        updated_at=timezone.now(),
+    )
+    invalidate_cart_summary(cart)
+
+
+def reconcile_carts(dry_run=False, batch_size=500):
+    """Сверяет сохранённые итоги корзин с позициями; возвращает исправленные корзины"""
+    real = {
+        row['cart']: (row['count'] or 0, _money(row['subtotal']))
+        for row in CartItem.objects.order_by().values('cart').annotate(
+            count=Sum('quantity'), subtotal=Sum(F('quantity') * F('product__price')),
+        )
+    }
+    drifted = []
+    carts = Cart.objects.only('item_count', 'subtotal', 'user', 'session_key')
+    for cart in carts.iterator(chunk_size=batch_size):
+        totals = real.get(cart.pk, (0, Decimal('0.00')))
+        if (cart.item_count, cart.subtotal) != totals:
+            cart.item_count, cart.subtotal = totals
+            drifted.append(cart)
+    if not dry_run:
+        Cart.objects.bulk_update(drifted, ['item_count', 'subtotal'], batch_size=batch_size)
+        for cart in drifted:
+            invalidate_cart_summary(cart)
+    return drifted
+
+
+def invalidate_cart_summary(cart):
+    """Сбрасывает кэш сводки после изменения корзины ``cart``"""
+    key = summary_key(user_id=cart.user_id, session_key=cart.session_key)
+    if key:
+        # После коммита: иначе параллельный запрос успеет положить в кэш
+        # ещё не изменённые итоги, и они проживут до SUMMARY_TIMEOUT
+        transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,124 @@
+"""Кэш фрагментов витрины: главная, сетка категории, карточка товара.
+
+Ключ фрагмента включает версии «областей», от которых он зависит:
+общую версию каталога и версии ``home``, ``category:<id>``,
+``product:<id>``. Изменение товара повышает версии его товара, категории
+и главной (сигналы в ``signals.py``), импорт и правка категорий —
+общую версию. Старые фрагменты не удаляются, а просто перестают
+запрашиваться и вытесняются по таймауту.
+
+Счётчики попаданий и промахов по каждому фрагменту лежат в том же
+кэше; посмотреть долю попаданий — ``manage.py catalog_cache_stats``.
+
+Версии повышают и другие процессы (воркер импорта, снятие резервов),
+поэтому кэш должен быть общим: с LocMemCache их изменения не дошли бы
+до воркеров сайта. Такая настройка — ошибка ``check_shared_cache``.
+"""
+import hashlib
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+FRAGMENT_TIMEOUT = 60 * 60
+FRAGMENTS = ('catalog', 'category_grid', 'product_info', 'related_products')
+GLOBAL_SCOPE = 'catalog'
+
+
+class FragmentKey(NamedTuple):
+    name: str
+    key: str
+
+
+LOCMEM_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs=None, **kwargs):
+    """LocMemCache у каждого процесса свой — версии фрагментов на нём не работают"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', LOCMEM_BACKEND)
+    if backend == LOCMEM_BACKEND:
+        return [checks.Error(
+            f'Кэш витрины на {backend.rsplit(".", 1)[-1]}: сброс из воркеров и команд не дойдёт до сайта',
+            hint='Настройте в CACHES общий бэкенд: FileBasedCache, Redis или Memcached.',
+            id='shop.E001',
+        )]
+    return []
+
+
+def _version_key(scope):
+    return f'catalog:version:{scope}'
+
+
+def _new_version():
+    # Начальная версия от времени: если ключ версии вытеснят из кэша,
+    # новая не совпадёт со старой и не оживит устаревшие фрагменты
+    return time.time_ns()
+
+
+def versions(*scopes):
+    """Текущие версии общей области и ``scopes`` одним обращением к кэшу"""
+    keys = [_version_key(scope) for scope in (GLOBAL_SCOPE, *scopes)]
+    found = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """Повышает версии областей: зависящие от них фрагменты перестроятся"""
+    for scope in scopes or (GLOBAL_SCOPE,):
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def bump_product(product_id, category_id=None):
+    bump('home', f'product:{product_id}', *([f'category:{category_id}'] if category_id else []))
+
+
+def fragment_key(name, scopes=(), *vary_on):
+    """Ключ фрагмента ``name``, зависящего от ``scopes``; ``vary_on`` — прочие параметры (страница и т.п.)"""
+    parts = ':'.join(str(part) for part in (*versions(*scopes), *vary_on))
+    digest = hashlib.md5(parts.encode(), usedforsecurity=False).hexdigest()
+    return FragmentKey(name, f'catalog:fragment:{name}:{digest}')
+
+
+def _stats_key(name, kind):
+    return f'catalog:stats:{name}:{kind}'
+
+
+def record(name, hit):
+    key = _stats_key(name, 'hits' if hit else 'misses')
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключ успели вытеснить между add и incr — этот замер не важен
+        pass
+
+
+def stats():
+    """{фрагмент: {'hits': …, 'misses': …, 'ratio': …}}"""
+    keys = {(name, kind): _stats_key(name, kind) for name in FRAGMENTS for kind in ('hits', 'misses')}
+    values = cache.get_many(keys.values())
+    result = {}
+    for name in FRAGMENTS:
+        hits = values.get(_stats_key(name, 'hits'), 0)
+        misses = values.get(_stats_key(name, 'misses'), 0)
+        result[name] = {
+            'hits': hits,
+            'misses': misses,
+            'ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return result
+
+
+def reset_stats():
+    cache.delete_many([_stats_key(name, kind) for name in FRAGMENTS for kind in ('hits', 'misses')])
@@ -1,17 +1,24 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart_summary import get_cart_summary
 from .models import Cart
 
 
 def cart_context(request):
-    """Добавляет корзину в контекст всех шаблонов"""
-    cart = None
+    """Добавляет корзину и её сводку в контекст всех шаблонов.
 
-    if request.user.is_authenticated:
-        cart = Cart.objects.filter(user=request.user).first()
-    else:
+    Оба значения ленивые: страница, которая их не выводит, не делает
+    запросов, а шапка берёт сводку из кэша (см. cart_summary.py).
+    """
+    def get_cart():
+        if request.user.is_authenticated:
+            return Cart.objects.filter(user=request.user).first()
         session_key = request.session.session_key
         if session_key:
-            cart = Cart.objects.filter(session_key=session_key, user=None).first()
+            return Cart.objects.filter(session_key=session_key, user=None).first()
+        return None
 
     return {
-        'cart': cart
-    }
\ No newline at end of file
+        'cart': SimpleLazyObject(get_cart),
+        'cart_summary': SimpleLazyObject(lambda: get_cart_summary(request)),
+    }
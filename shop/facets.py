@@ -0,0 +1,171 @@
+"""Фильтры на странице категории и число товаров для каждого значения.
+
+Значения фильтров: ценовой диапазон, скидка (``old_price > price``),
+наличие (свободный остаток ``quantity - reserved``) и «рекомендуемый». Счётчики не считаются по товарам на каждом
+показе: в ``ProductFacet`` лежит число активных товаров категории для
+каждого сочетания значений (не больше нескольких десятков строк), и
+страница читает их одним запросом, а счётчики под выбранные фильтры
+складывает в Python.
+
+Таблица пересчитывается по категориям одним сгруппированным запросом
+(``refresh_facets``): сигналы — при сохранении и удалении товара,
+импорт — для категорий пачки, резервы — когда свободный остаток товара
+кончился или появился. Полный пересчёт —
+``manage.py rebuild_facets``.
+"""
+from collections import Counter
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, IntegerField, Q, Value, When
+
+from .models import Product, ProductFacet
+
+# (от, до) — нижняя граница включается, верхняя нет
+PRICE_BUCKETS = [
+    (None, Decimal('100')),
+    (Decimal('100'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), Decimal('5000')),
+    (Decimal('5000'), None),
+]
+
+# Фильтр -> (параметр URL, подпись, значения {значение в URL: (значение в таблице, подпись)})
+FACETS = {
+    'price_bucket': ('price', 'Цена', {
+        str(i): (i, f'до {high:.0f} руб.' if low is None else
+                 f'от {low:.0f} руб.' if high is None else f'{low:.0f}–{high:.0f} руб.')
+        for i, (low, high) in enumerate(PRICE_BUCKETS)
+    }),
+    'on_sale': ('sale', 'Скидка', {'1': (True, 'Со скидкой')}),
+    'is_featured': ('featured', 'Подборка', {'1': (True, 'Рекомендуемые')}),
+    'in_stock': ('stock', 'Наличие', {'in': (True, 'В наличии'), 'out': (False, 'Нет в наличии')}),
+}
+# Без явного выбора показываются только товары в наличии, как и раньше
+DEFAULTS = {'in_stock': True}
+
+
+def price_bucket_expression():
+    return Case(
+        *[When(Q(price__lt=high) if low is None else Q(price__gte=low, price__lt=high), then=Value(i))
+          for i, (low, high) in enumerate(PRICE_BUCKETS[:-1])],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+
+
+# «В наличии» — есть свободный остаток: зарезервированное в корзинах купить нельзя
+IN_STOCK = Q(quantity__gt=F('reserved'))
+
+
+def grouped_counts(products, in_stock=IN_STOCK):
+    """Сочетания значений фильтров и число товаров — один GROUP BY"""
+    return (
+        products.order_by()
+        .annotate(
+            price_bucket=price_bucket_expression(),
+            # Case, а не голое сравнение: при old_price = NULL нужно False, а не NULL
+            on_sale=Case(When(old_price__gt=F('price'), then=Value(True)), default=Value(False),
+                         output_field=BooleanField()),
+            in_stock=ExpressionWrapper(in_stock, output_field=BooleanField()),
+        )
+        .values('category', 'price_bucket', 'on_sale', 'is_featured', 'in_stock')
+        .annotate(count=Count('id'))
+    )
+
+
+def refresh_facets(category_ids=None):
+    """Пересчитывает строки ``ProductFacet`` категорий (всех, если ``None``)"""
+    products = Product.objects.filter(is_active=True)
+    facets = ProductFacet.objects.all()
+    if category_ids is not None:
+        category_ids = {pk for pk in category_ids if pk is not None}
+        if not category_ids:
+            return
+        products = products.filter(category__in=category_ids)
+        facets = facets.filter(category__in=category_ids)
+    rows = [ProductFacet(category_id=row.pop('category'), **row) for row in grouped_counts(products)]
+    facets.delete()
+    ProductFacet.objects.bulk_create(rows, batch_size=500)
+
+
+def parse_selection(params):
+    """Параметры URL -> {фильтр: значение в таблице}; неизвестные значения игнорируются"""
+    selection = dict(DEFAULTS)
+    for facet, (param, _, values) in FACETS.items():
+        if params.get(param) in values:
+            selection[facet] = values[params[param]][0]
+    return selection
+
+
+def selection_query(selection):
+    """Выбранные фильтры обратно в строку URL (без значений по умолчанию)"""
+    params = {}
+    for facet, (param, _, values) in FACETS.items():
+        if facet in selection and selection[facet] != DEFAULTS.get(facet):
+            params[param] = next(key for key, (value, _) in values.items() if value == selection[facet])
+    return urlencode(params)
+
+
+def filter_products(products, selection):
+    """Применяет выбранные фильтры к товарам"""
+    if 'price_bucket' in selection:
+        low, high = PRICE_BUCKETS[selection['price_bucket']]
+        if low is not None:
+            products = products.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+    if selection.get('on_sale'):
+        products = products.filter(old_price__gt=F('price'))
+    if selection.get('is_featured'):
+        products = products.filter(is_featured=True)
+    if 'in_stock' in selection:
+        if selection['in_stock']:
+            # quantity > 0 остаётся ради частичного индекса витрины (reserved не бывает меньше нуля)
+            products = products.filter(IN_STOCK, quantity__gt=0)
+        else:
+            products = products.exclude(IN_STOCK)
+    return products
+
+
+def facet_counts(category, selection):
+    """Панель фильтров и число товаров под выбранными фильтрами — одним запросом.
+
+    Счётчик значения учитывает остальные выбранные фильтры, но не выбор
+    в своей группе — видно, сколько станет товаров, если выбрать его.
+    Повторный выбор значения снимает его (наличие возвращается к
+    значению по умолчанию).
+    """
+    names = list(FACETS)
+    rows = [
+        (dict(zip(names, values)), count)
+        for *values, count in ProductFacet.objects.filter(category=category)
+        .values_list(*names, 'count')
+    ]
+
+    def matching(conditions):
+        return [(values, count) for values, count in rows
+                if all(values[name] == value for name, value in conditions.items())]
+
+    groups = []
+    for facet, (_, title, options) in FACETS.items():
+        others = {name: value for name, value in selection.items() if name != facet}
+        counts = Counter()
+        for values, count in matching(others):
+            counts[values[facet]] += count
+        group = {'title': title, 'options': []}
+        for value, label in options.values():
+            selected = selection.get(facet) == value
+            if selected:
+                target = {**others, **({facet: DEFAULTS[facet]} if facet in DEFAULTS else {})}
+            else:
+                target = {**others, facet: value}
+            group['options'].append({
+                'label': label,
+                'count': counts[value],
+                'selected': selected,
+                'query': selection_query(target),
+            })
+        groups.append(group)
+    total = sum(count for _, count in matching(selection))
+    return groups, total
@@ -50,15 +50,16 @@ class CustomerLoginForm(AuthenticationForm):
 
 from django import forms
 from .models import ProductImport
+from .import_readers import SUPPORTED_EXTENSIONS
 
 
 class ProductImportForm(forms.ModelForm):
     class Meta:
         model = ProductImport
-        fields = ['file']
+        fields = ['file', 'mode', 'deactivate_missing']
 
     def clean_file(self):
         file = self.cleaned_data['file']
-        if not file.name.endswith(('.xlsx', '.xls')):
-            raise forms.ValidationError('Поддерживаются только Excel файлы (.xlsx, .xls)')
+        if not file.name.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise forms.ValidationError('Поддерживаются только файлы Excel (.xlsx, .xls) и CSV')
         return file
\ No newline at end of file
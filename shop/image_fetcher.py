@@ -0,0 +1,106 @@
+"""Параллельная загрузка изображений для импорта товаров.
+
+Картинки качаются пулом потоков через одну ``requests.Session``
+с keep-alive соединениями. Число одновременных запросов к одному
+хосту ограничено, каждый URL скачивается один раз за импорт,
+временные ошибки повторяются с экспоненциальной задержкой.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    pass
+
+
+class ImageFetcher:
+    """Пул загрузки изображений, один экземпляр на импорт"""
+    max_workers = 16
+    per_host = 4
+    retries = 3
+    backoff = 0.5
+    timeout = 10
+
+    def __init__(self, max_workers=None, per_host=None, retries=None, backoff=None, timeout=None):
+        for name, value in [('max_workers', max_workers), ('per_host', per_host),
+                            ('retries', retries), ('backoff', backoff), ('timeout', timeout)]:
+            if value is not None:
+                setattr(self, name, value)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._seen = set()
+        self.requests_made = 0
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[host]
+
+    def fetch(self, url):
+        """Скачивает один URL с повторами, возвращает байты или бросает FetchError"""
+        limit = self._host_limit(url)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with limit:
+                    with self._lock:
+                        self.requests_made += 1
+                    response = self.session.get(url, timeout=self.timeout)
+                    content = response.content
+            except requests.RequestException as e:
+                last_error = e
+                continue
+
+            if response.status_code == 200:
+                return content
+            last_error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUSES:
+                break
+
+        raise FetchError(f"{url}: {last_error}")
+
+    def fetch_many(self, urls):
+        """Скачивает ещё не запрошенные URL параллельно.
+
+        Возвращает ``{url: bytes}`` для успешных загрузок и ``{url: str}``
+        с текстом ошибки для неудачных. URL, уже запрошенные этим
+        экземпляром раньше, повторно не качаются и в ответ не попадают.
+        """
+        with self._lock:
+            new_urls = [url for url in dict.fromkeys(urls) if url not in self._seen]
+            self._seen.update(new_urls)
+
+        contents, errors = {}, {}
+        if not new_urls:
+            return contents, errors
+
+        def task(url):
+            try:
+                contents[url] = self.fetch(url)
+            except FetchError as e:
+                errors[url] = str(e)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(new_urls))) as pool:
+            list(pool.map(task, new_urls))
+        return contents, errors
+
+    def close(self):
+        self.session.close()
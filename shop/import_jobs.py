@@ -0,0 +1,170 @@
+"""Фоновое выполнение импортов товаров.
+
+Загрузка файла только ставит ``ProductImport`` в очередь (статус
+``pending``), а обрабатывает его отдельный процесс —
+``python manage.py run_import_worker``. Прогресс сохраняется в той же
+транзакции, что и очередная пачка товаров, поэтому после падения
+воркера импорт продолжается с последней записанной пачки.
+
+Пока импорт выполняется, отдельный поток раз в ``HEARTBEAT_INTERVAL``
+обновляет ``heartbeat_at``. Брошенным считается импорт, у которого эта
+отметка старше ``STALE_AFTER``, — медленная пачка (картинки, большой
+xlsx) не отдаёт импорт второму воркеру.
+"""
+import threading
+import time
+from datetime import timedelta
+from itertools import takewhile
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .import_readers import get_chunk_reader
+from .importer import ProductImporter
+from .models import ProductImport
+
+# Через сколько секунд без отметки воркера выполняющийся импорт считается брошенным
+STALE_AFTER = 300
+HEARTBEAT_INTERVAL = 60
+
+PROGRESS_FIELDS = ['processed_rows', 'imported_count', 'updated_count', 'unchanged_count',
+                   'error_count', 'errors', 'rows_per_second', 'stats', 'updated_at']
+
+
+def merge_stats(base, stats):
+    """Складывает статистику прошлых запусков импорта с текущим"""
+    merged = {}
+    for section in base.keys() | stats.keys():
+        values = dict(base.get(section, {}))
+        for name, value in stats.get(section, {}).items():
+            values[name] = round(values.get(name, 0) + value, 3)
+        merged[section] = values
+    return merged
+
+
+class Heartbeat:
+    """Отмечает ``heartbeat_at`` импорта из отдельного потока, пока открыт блок ``with``"""
+
+    def __init__(self, import_task, interval=HEARTBEAT_INTERVAL):
+        self.import_task = import_task
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def beat(self):
+        # И в памяти: иначе следующий import_task.save() затрёт отметку старой
+        self.import_task.heartbeat_at = timezone.now()
+        ProductImport.objects.filter(pk=self.import_task.pk).update(heartbeat_at=self.import_task.heartbeat_at)
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    self.beat()
+                except OperationalError:
+                    # База занята (SQLite) — отметимся в следующий раз
+                    pass
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.beat()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+def process_excel_import(import_task):
+    """Выполняет импорт, продолжая с последней записанной пачки.
+
+    Возвращает ImportResult этого запуска (None, если импорт упал).
+    """
+    start_row = import_task.processed_rows
+    base_imported = import_task.imported_count
+    base_updated = import_task.updated_count
+    base_unchanged = import_task.unchanged_count
+    base_errors = import_task.errors.splitlines()
+    base_stats = import_task.stats or {}
+    started = time.monotonic()
+
+    def save_progress(result, rows_done):
+        elapsed = time.monotonic() - started
+        import_task.processed_rows = rows_done
+        import_task.imported_count = base_imported + result.created
+        import_task.updated_count = base_updated + result.updated
+        import_task.unchanged_count = base_unchanged + result.unchanged
+        import_task.error_count = len(base_errors) + result.error_count
+        import_task.errors = '\n'.join(base_errors + result.errors)
+        import_task.rows_per_second = (rows_done - start_row) / elapsed if elapsed else 0
+        import_task.stats = merge_stats(base_stats, result.stats())
+        import_task.save(update_fields=PROGRESS_FIELDS)
+
+    try:
+        # Файл читается потоково, пачка сразу уходит в базу
+        reader = get_chunk_reader(import_task.file.path)
+        import_task.status = 'running'
+        import_task.total_rows = reader.count_rows()
+        import_task.started_at = import_task.started_at or timezone.now()
+        import_task.save()
+
+        importer = ProductImporter(
+            on_chunk=save_progress,
+            mode=import_task.mode,
+            deactivate_missing=import_task.deactivate_missing,
+        )
+        if start_row and importer.deactivate_missing:
+            # Товары из уже записанных строк не должны попасть под скрытие
+            importer.mark_seen(takewhile(lambda chunk: chunk[0] <= start_row,
+                                         reader.chunks(importer.chunk_size)))
+        with Heartbeat(import_task):
+            result = importer.run_chunks(reader.chunks(importer.chunk_size, start_row))
+
+        import_task.status = 'success'
+        import_task.deactivated_count = result.deactivated
+        import_task.stats = merge_stats(base_stats, result.stats())
+        import_task.total_rows = import_task.processed_rows = max(import_task.total_rows,
+                                                                  import_task.processed_rows)
+        import_task.finished_at = timezone.now()
+        import_task.save()
+        return result
+
+    except Exception as e:
+        # В памяти могут остаться значения из откатившейся пачки
+        import_task.refresh_from_db()
+        import_task.status = 'error'
+        import_task.errors = '\n'.join(filter(None, [import_task.errors, str(e)]))
+        import_task.finished_at = timezone.now()
+        import_task.save()
+
+
+def claim_next_import(stale_after=STALE_AFTER):
+    """Забирает из очереди следующий импорт или брошенный упавшим воркером.
+
+    Захват — условный UPDATE, поэтому несколько воркеров не возьмут
+    один и тот же импорт.
+    """
+    stale = timezone.now() - timedelta(seconds=stale_after)
+    # Импорты, начатые до появления heartbeat_at, проверяются по updated_at
+    claimable = Q(status='pending') | Q(status='running') & (
+        Q(heartbeat_at__lt=stale) | Q(heartbeat_at__isnull=True, updated_at__lt=stale)
+    )
+    candidates = ProductImport.objects.filter(claimable).order_by('created_at')
+
+    for import_task in candidates[:10]:
+        with transaction.atomic():
+            now = timezone.now()
+            # Условие повторяется в UPDATE: импорт, за который только что
+            # отметился его воркер или который забрал другой, не захватится
+            claimed = ProductImport.objects.filter(
+                claimable,
+                pk=import_task.pk,
+                updated_at=import_task.updated_at,
+            ).update(status='running', updated_at=now, heartbeat_at=now)
+        if claimed:
+            import_task.refresh_from_db()
+            return import_task
+    return None
@@ -0,0 +1,149 @@
+"""Потоковое чтение прайс-листов пачками фиксированного размера.
+
+``pd.read_excel`` держит в памяти весь лист в object-столбцах, поэтому
+xlsx читается через openpyxl в режиме read-only, а CSV — через
+``pd.read_csv(chunksize=...)``. Каждая пачка — обычный DataFrame с теми же
+столбцами (``Название``, ``Цена``, ``Категория``, ...), индекс которого —
+номер строки данных в файле (с нуля, без заголовка). Пиковая память
+определяется размером пачки, а не файла.
+"""
+import csv
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+CSV_EXTENSIONS = ('.csv',)
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+SUPPORTED_EXTENSIONS = EXCEL_EXTENSIONS + CSV_EXTENSIONS
+
+
+def _chunk_frame(rows, columns, start):
+    width = len(columns)
+    rows = [values[:width] + (None,) * (width - len(values)) for values in rows]
+    return pd.DataFrame.from_records(rows, columns=columns, index=range(start, start + len(rows)))
+
+
+def _header(values):
+    return [str(value).strip() if value is not None else f'Столбец {i + 1}' for i, value in enumerate(values)]
+
+
+class XlsxChunkReader:
+    """Чтение .xlsx через openpyxl read-only без загрузки всего листа"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def count_rows(self):
+        """Число строк данных по размерам листа (без заголовка)"""
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        return max(0, (max_row or 1) - 1)
+
+    def chunks(self, chunk_size, start_row=0):
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = _header(header)
+
+            position, batch = 0, []
+            for values in rows:
+                if position >= start_row:
+                    batch.append(values)
+                position += 1
+                if len(batch) == chunk_size:
+                    yield position, _chunk_frame(batch, columns, position - len(batch))
+                    batch = []
+            if batch:
+                yield position, _chunk_frame(batch, columns, position - len(batch))
+        finally:
+            workbook.close()
+
+
+class CsvChunkReader:
+    """Чтение CSV пачками; кодировка (utf-8 / cp1251) и разделитель определяются по началу файла"""
+
+    sample_size = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            sample = f.read(self.sample_size)
+        try:
+            text = sample.decode('utf-8-sig')
+            self.encoding = 'utf-8-sig'
+        except UnicodeDecodeError as e:
+            if e.start >= len(sample) - 3:
+                # Многобайтовый символ обрезан на границе образца
+                text = sample[:e.start].decode('utf-8-sig')
+                self.encoding = 'utf-8-sig'
+            else:
+                text = sample.decode('cp1251')
+                self.encoding = 'cp1251'
+        try:
+            self.delimiter = csv.Sniffer().sniff(text.split('\n', 1)[0], delimiters=';,\t').delimiter
+        except csv.Error:
+            self.delimiter = ','
+
+    def count_rows(self):
+        with open(self.path, 'rb') as f:
+            lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+            f.seek(max(0, f.tell() - 1))
+            if f.read(1) not in (b'\n', b''):
+                lines += 1
+        return max(0, lines - 1)
+
+    def chunks(self, chunk_size, start_row=0):
+        reader = pd.read_csv(
+            self.path,
+            sep=self.delimiter,
+            encoding=self.encoding,
+            dtype=str,
+            chunksize=chunk_size,
+            skiprows=range(1, start_row + 1),
+            skip_blank_lines=False,
+        )
+        with reader:
+            for chunk in reader:
+                chunk.columns = [str(column).strip() for column in chunk.columns]
+                chunk.index = chunk.index + start_row
+                yield chunk.index[-1] + 1, chunk
+
+
+class DataFrameChunkReader:
+    """Чтение целиком через pandas — для старого .xls, который openpyxl не понимает"""
+
+    def __init__(self, path):
+        self.df = pd.read_excel(path)
+
+    def count_rows(self):
+        return len(self.df)
+
+    def chunks(self, chunk_size, start_row=0):
+        return iter_frame_chunks(self.df, chunk_size, start_row)
+
+
+def iter_frame_chunks(df, chunk_size, start_row=0):
+    """Нарезает готовый DataFrame на пачки в том же формате, что и читатели файлов"""
+    df = df.reset_index(drop=True)
+    for start in range(start_row, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        yield start + len(chunk), chunk
+
+
+def get_chunk_reader(path):
+    """Читатель пачек по расширению файла"""
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension == '.xlsx':
+        return XlsxChunkReader(path)
+    if extension in CSV_EXTENSIONS:
+        return CsvChunkReader(path)
+    if extension == '.xls':
+        return DataFrameChunkReader(path)
+    raise ValueError(f"Неподдерживаемый формат файла: {extension or 'без расширения'}")
@@ -0,0 +1,583 @@
+"""Пакетный импорт товаров из прайс-листов поставщиков.
+
+Вместо построчного ``get_or_create`` + ``save()`` лист обрабатывается
+целыми столбцами: pandas проверяет и приводит типы, категории
+загружаются одним запросом и досоздаются одним ``bulk_create``,
+а товары пишутся пачками внутри транзакций.
+"""
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import catalog_cache, facets, search
+from .image_fetcher import ImageFetcher
+from .import_readers import get_chunk_reader, iter_frame_chunks
+from .models import Category, ImageSource, Product
+from .thumbnails import schedule_derivatives
+
+# Столбцы прайс-листа
+COL_NAME = 'Название'
+COL_SKU = 'Артикул'
+COL_DESCRIPTION = 'Описание'
+COL_SHORT_DESCRIPTION = 'Краткое описание'
+COL_PRICE = 'Цена'
+COL_OLD_PRICE = 'Старая цена'
+COL_QUANTITY = 'Количество'
+COL_CATEGORY = 'Категория'
+COL_IMAGE = 'Изображение'
+
+REQUIRED_COLUMNS = [COL_NAME, COL_PRICE]
+DEFAULT_CATEGORY = 'Разное'
+
+
+IMAGE_STATS = ('cache_hits', 'downloaded', 'failed', 'bytes')
+
+
+@dataclass
+class ImportResult:
+    """Итог импорта: счётчики по товарам и построчные ошибки"""
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deactivated: int = 0
+    errors: list = field(default_factory=list)
+    # Этап -> секунды: read, validate, categories, diff, images, write, deactivate
+    timings: dict = field(default_factory=dict)
+    # Этап -> число SQL-запросов
+    queries: dict = field(default_factory=dict)
+    # Картинки по уникальным URL: взяты из кэша / скачаны / не скачались, байт скачано
+    images: dict = field(default_factory=lambda: dict.fromkeys(IMAGE_STATS, 0))
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+    @contextmanager
+    def stage(self, name):
+        """Прибавляет время и SQL-запросы блока к этапу ``name``"""
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_queries):
+                yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - started
+            self.queries[name] = self.queries.get(name, 0) + queries
+
+    def stats(self):
+        """Статистика для ProductImport.stats"""
+        return {
+            'timings': {name: round(seconds, 3) for name, seconds in self.timings.items()},
+            'queries': dict(self.queries),
+            'images': dict(self.images),
+        }
+
+
+def _column(df, name, default=np.nan):
+    """Столбец листа или столбец значений по умолчанию, если его нет"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _text(series, max_length=None):
+    """Приводит столбец к строкам без NaN ('nan' в описаниях нам не нужен)"""
+    result = series.astype(object).where(series.notna(), '').astype(str).str.strip()
+    if max_length:
+        result = result.str.slice(0, max_length)
+    return result
+
+
+def _number(series):
+    """Столбец чисел; строки из русского Excel («1 299,90») тоже понимаются"""
+    if not pd.api.types.is_numeric_dtype(series):
+        cleaned = (series.str.replace(r'[\s\xa0]', '', regex=True)
+                   .str.replace(',', '.', regex=False))
+        # .str даёт NaN для нестроковых ячеек — там остаются исходные числа
+        series = cleaned.where(cleaned.notna(), series)
+    return pd.to_numeric(series, errors='coerce')
+
+
+def check_columns(columns):
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"В файле нет обязательных столбцов: {', '.join(missing)}")
+
+
+def prepare_frame(df):
+    """Проверяет и приводит типы всей пачки разом.
+
+    Индекс ``df`` — номер строки данных в файле, считая с нуля.
+    Возвращает DataFrame только с корректными строками (колонки
+    ``row, sku, name, description, short_description, price, old_price,
+    quantity, category, image_url``) и список ошибок в формате
+    ``ProductImport.errors``: ``"Строка N: причина"``.
+    """
+    check_columns(df.columns)
+
+    # +2: заголовок и нумерация строк Excel с единицы
+    rows = pd.Series(df.index.to_numpy() + 2)
+    df = df.reset_index(drop=True)
+
+    names = _text(df[COL_NAME])
+    raw_price = df[COL_PRICE]
+    price = _number(raw_price)
+    old_price = _number(_column(df, COL_OLD_PRICE))
+    raw_quantity = _column(df, COL_QUANTITY)
+    quantity = _number(raw_quantity)
+    categories = _text(_column(df, COL_CATEGORY), max_length=100)
+    categories = categories.where(categories != '', DEFAULT_CATEGORY)
+    images = _text(_column(df, COL_IMAGE))
+
+    checks = [
+        (names == '', lambda i: 'не указано название'),
+        (names.str.len() > 200, lambda i: 'название длиннее 200 символов'),
+        (price.isna(), lambda i: f"некорректная цена '{raw_price.iat[i]}'"),
+        (price < 0, lambda i: 'цена не может быть отрицательной'),
+        (raw_quantity.notna() & quantity.isna(),
+         lambda i: f"некорректное количество '{raw_quantity.iat[i]}'"),
+        (quantity < 0, lambda i: 'количество не может быть отрицательным'),
+    ]
+
+    invalid = pd.Series(False, index=df.index)
+    reasons = {}
+    for mask, message in checks:
+        mask = mask.fillna(False).to_numpy(dtype=bool)
+        invalid |= mask
+        # Python-цикл только по плохим строкам, их обычно единицы
+        for i in np.flatnonzero(mask):
+            reasons.setdefault(i, []).append(message(i))
+
+    errors = [f"Строка {rows.iat[i]}: {'; '.join(reasons[i])}" for i in sorted(reasons)]
+
+    valid = ~invalid
+    frame = pd.DataFrame({
+        'row': rows[valid],
+        'sku': _text(_column(df, COL_SKU), max_length=64)[valid],
+        'name': names[valid],
+        'description': _text(_column(df, COL_DESCRIPTION))[valid],
+        'short_description': _text(_column(df, COL_SHORT_DESCRIPTION), max_length=255)[valid],
+        'price': price[valid].round(2),
+        'old_price': old_price[valid].round(2),
+        'quantity': quantity[valid].fillna(0).astype(int),
+        'category': categories[valid],
+        'image_url': images[valid].where(images[valid].str.startswith('http'), ''),
+    })
+    return frame.reset_index(drop=True), errors
+
+
+def _unique_slug(name, taken):
+    """Slug для категории, не совпадающий с уже занятыми"""
+    base = slugify(name) or 'category'
+    slug, suffix = base, 2
+    while slug in taken:
+        slug = f"{base}-{suffix}"
+        suffix += 1
+    taken.add(slug)
+    return slug
+
+
+class CategoryResolver:
+    """Сопоставляет названия категорий с id.
+
+    Все категории читаются одним запросом при первом обращении,
+    недостающие досоздаются одним ``bulk_create`` на пачку.
+    """
+
+    def __init__(self):
+        self.known = None
+        self.taken_slugs = set()
+
+    def preload(self):
+        self.known = {}
+        for category_id, name, slug in Category.objects.order_by().values_list('id', 'name', 'slug'):
+            self.known.setdefault(name, category_id)
+            self.taken_slugs.add(slug)
+
+    def resolve(self, names):
+        """Возвращает {название: id} для всех категорий из ``names``"""
+        if self.known is None:
+            self.preload()
+
+        names = set(names)
+        missing = sorted(names - self.known.keys())
+        if missing:
+            new_categories = [
+                Category(name=name, slug=_unique_slug(name, self.taken_slugs), is_active=True)
+                for name in missing
+            ]
+            Category.objects.bulk_create(new_categories)
+            if any(category.pk is None for category in new_categories):
+                # Бэкенд без RETURNING — дочитываем id отдельным запросом
+                self.known.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+            else:
+                self.known.update((category.name, category.pk) for category in new_categories)
+
+        return {name: self.known[name] for name in names}
+
+
+def resolve_categories(names):
+    """Возвращает {название: id}, создавая недостающие категории"""
+    return CategoryResolver().resolve(names)
+
+
+def _image_filename(url):
+    """Имя файла для картинки по её URL"""
+    name, extension = os.path.splitext(os.path.basename(urlsplit(url).path))
+    extension = extension.lstrip('.').lower()
+    if extension not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
+        extension = 'jpg'
+    return f"{slugify(name) or 'image'}.{extension}"
+
+
+def _decimal(value):
+    if pd.isna(value):
+        return None
+    return Decimal(f"{value:.2f}")
+
+
+def _name_key(name, category_id):
+    return f"{name.casefold()}|{category_id}"
+
+
+class CatalogIndex:
+    """Текущий каталог в памяти: поиск товара по артикулу или названию и категории.
+
+    Хранит только поля, которые сравниваются при обновлении, и id товаров,
+    встреченных в файле (для скрытия отсутствующих).
+    """
+    fields = ['sku', 'price', 'old_price', 'quantity', 'description', 'is_active']
+
+    def __init__(self):
+        self.by_sku = {}
+        self.by_name = {}
+        self.values = {}
+        self.seen = set()
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        rows = Product.objects.order_by('id').values_list('id', 'name', 'category_id', *cls.fields)
+        for pk, name, category_id, *values in rows.iterator(chunk_size=5000):
+            index.add(pk, name, category_id, dict(zip(cls.fields, values)))
+        return index
+
+    def add(self, pk, name, category_id, values):
+        self.values[pk] = values
+        if values['sku']:
+            self.by_sku[values['sku']] = pk
+        # При совпадающих названиях в категории побеждает последний (самый новый) товар
+        self.by_name[_name_key(name, category_id)] = pk
+
+    def find(self, sku, name, category_id):
+        if sku and sku in self.by_sku:
+            return self.by_sku[sku]
+        pk = self.by_name.get(_name_key(name, category_id))
+        if pk is not None and sku and self.values[pk]['sku'] not in ('', sku):
+            # Тот же товар по названию, но с другим артикулом — это другой товар
+            return None
+        return pk
+
+
+class ProductImporter:
+    """Пакетный импорт товаров из DataFrame прайс-листа"""
+    chunk_size = 1000
+
+    def __init__(self, chunk_size=None, download_images=True, fetcher=None, on_chunk=None,
+                 mode='create', deactivate_missing=False):
+        if chunk_size:
+            self.chunk_size = chunk_size
+        self.download_images = download_images
+        self.fetcher = fetcher
+        # create — всегда новые товары, upsert — обновление существующих по ключу
+        self.mode = mode
+        self.deactivate_missing = deactivate_missing and mode == 'upsert'
+        self.index = None
+        # Вызывается внутри транзакции пачки после записи: on_chunk(result, rows_done)
+        self.on_chunk = on_chunk
+        self.categories = CategoryResolver()
+        # url -> имя сохранённого файла: каждая картинка качается один раз за импорт
+        self.image_names = {}
+        # url -> текст ошибки для картинок, которые не удалось скачать
+        self.image_errors = {}
+
+    def run(self, df, start_row=0):
+        """Импортирует лист, начиная со строки ``start_row``, и возвращает ImportResult"""
+        check_columns(df.columns)
+        return self.run_chunks(iter_frame_chunks(df, self.chunk_size, start_row))
+
+    def run_file(self, path, start_row=0):
+        """Потоково импортирует xlsx/csv-файл пачками по ``chunk_size`` строк"""
+        return self.run_chunks(get_chunk_reader(path).chunks(self.chunk_size, start_row))
+
+    def run_chunks(self, chunks):
+        """Импортирует пачки ``(номер строки после пачки, DataFrame)`` из import_readers"""
+        result = ImportResult()
+        if self.mode == 'upsert' and self.index is None:
+            with result.stage('diff'):
+                self.index = CatalogIndex.load()
+        own_fetcher = self.download_images and self.fetcher is None
+        if own_fetcher:
+            self.fetcher = ImageFetcher()
+        chunks = iter(chunks)
+        try:
+            while True:
+                with result.stage('read'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                rows_done, raw = chunk
+                self.import_chunk(raw, rows_done, result)
+        finally:
+            if own_fetcher:
+                self.fetcher.close()
+                self.fetcher = None
+        if self.deactivate_missing:
+            with result.stage('deactivate'):
+                result.deactivated = self.deactivate_unseen()
+        return result
+
+    def mark_seen(self, chunks):
+        """Отмечает товары уже импортированных строк (при продолжении импорта)"""
+        if self.mode != 'upsert':
+            return
+        if self.index is None:
+            self.index = CatalogIndex.load()
+        for _, raw in chunks:
+            raw = raw.dropna(how='all')
+            frame, _ = prepare_frame(raw)
+            self.keep_rejected(raw, frame)
+            if frame.empty:
+                continue
+            category_ids = self.categories.resolve(frame['category'].unique())
+            for sku, name, category in frame[['sku', 'name', 'category']].itertuples(index=False):
+                pk = self.index.find(sku, name, category_ids[category])
+                if pk is not None:
+                    self.index.seen.add(pk)
+
+    def keep_rejected(self, raw, frame):
+        """Отмечает товары строк, не прошедших проверку: опечатка в цене — не повод скрывать товар.
+
+        Категории не создаются: товар ищется по артикулу или в уже существующей категории.
+        """
+        if not self.deactivate_missing:
+            return
+        rejected = raw[~pd.Series(raw.index.to_numpy() + 2, index=raw.index).isin(frame['row'])]
+        if rejected.empty:
+            return
+        if self.categories.known is None:
+            self.categories.preload()
+        categories = _text(_column(rejected, COL_CATEGORY), max_length=100)
+        categories = categories.where(categories != '', DEFAULT_CATEGORY)
+        skus = _text(_column(rejected, COL_SKU), max_length=64)
+        for sku, name, category in zip(skus, _text(_column(rejected, COL_NAME)), categories):
+            pk = self.index.find(sku, name, self.categories.known.get(category))
+            if pk is not None:
+                self.index.seen.add(pk)
+
+    def deactivate_unseen(self):
+        """Скрывает активные товары каталога, которых не было в файле"""
+        unseen = [pk for pk, values in self.index.values.items()
+                  if values['is_active'] and pk not in self.index.seen]
+        for start in range(0, len(unseen), 500):
+            Product.objects.filter(pk__in=unseen[start:start + 500]).update(is_active=False)
+        search.remove_products(unseen)
+        for pk in unseen:
+            self.index.values[pk]['is_active'] = False
+        if unseen:
+            # Раз за импорт: один GROUP BY по всему каталогу
+            facets.refresh_facets()
+            catalog_cache.bump()
+        return len(unseen)
+
+    def import_chunk(self, raw, rows_done, result):
+        """Проверяет, дополняет и записывает одну пачку строк"""
+        with result.stage('validate'):
+            # Пустые строки в прайс-листах встречаются часто, ошибкой их не считаем
+            raw = raw.dropna(how='all')
+            frame, errors = prepare_frame(raw)
+            self.keep_rejected(raw, frame)
+        changed, fields, category_ids = [], [], {}
+        if not frame.empty:
+            with result.stage('categories'):
+                category_ids = self.categories.resolve(frame['category'].unique())
+                frame['category_id'] = frame['category'].map(category_ids)
+            if self.mode == 'upsert':
+                with result.stage('diff'):
+                    frame, changed, fields, unchanged = self.diff_chunk(frame, raw.columns)
+                result.unchanged += unchanged
+            if self.download_images:
+                with result.stage('images'):
+                    self.fetch_images(frame, result)
+
+        with transaction.atomic():
+            with result.stage('write'):
+                products = self.build_products(frame)
+                Product.objects.bulk_create(products, batch_size=self.chunk_size)
+                if changed:
+                    Product.objects.bulk_update(changed, fields, batch_size=self.chunk_size)
+                if self.index is not None:
+                    self.register_created(products)
+                result.created += len(products)
+                result.updated += len(changed)
+                result.errors.extend(errors)
+                reindexed = [product.pk for product in products]
+                if {'description', 'is_active'} & set(fields):
+                    reindexed += [product.pk for product in changed]
+                if products or changed:
+                    # Bulk-операции не шлют сигналов — сбрасываем кэш витрины
+                    # и обновляем поисковый индекс и счётчики фильтров сами
+                    transaction.on_commit(catalog_cache.bump)
+                    facets.refresh_facets(category_ids.values())
+                if self.on_chunk:
+                    self.on_chunk(result, rows_done)
+            if reindexed:
+                # Отдельный этап: стемминг текстов — заметная часть времени импорта
+                with result.stage('index'):
+                    search.index_products(reindexed)
+
+    def diff_chunk(self, frame, columns):
+        """Сравнивает пачку с каталогом.
+
+        Возвращает строки новых товаров, изменённые товары для
+        ``bulk_update``, список обновляемых полей и число строк без изменений.
+        Сравниваются только поля, для которых в файле есть столбец.
+        """
+        compared = [name for name, column in [('price', COL_PRICE), ('old_price', COL_OLD_PRICE),
+                                              ('quantity', COL_QUANTITY), ('description', COL_DESCRIPTION)]
+                    if column in columns]
+        # Повторы ключа в пачке: действует последняя строка
+        keys = frame['sku'].where(frame['sku'] != '', frame['name'].str.casefold() + '|'
+                                  + frame['category_id'].astype(str))
+        frame = frame[~keys.duplicated(keep='last')]
+
+        now = timezone.now()
+        new_rows, changed, fields, unchanged = [], [], set(), 0
+        for position, row in enumerate(frame.itertuples(index=False)):
+            pk = self.index.find(row.sku, row.name, row.category_id)
+            if pk is None:
+                new_rows.append(position)
+                continue
+            self.index.seen.add(pk)
+
+            current = self.index.values[pk]
+            incoming = {
+                'price': _decimal(row.price),
+                'old_price': _decimal(row.old_price),
+                'quantity': int(row.quantity),
+                'description': row.description,
+            }
+            diff = {name: incoming[name] for name in compared if current[name] != incoming[name]}
+            if not current['is_active']:
+                diff['is_active'] = True
+            if row.sku and current['sku'] != row.sku:
+                diff['sku'] = row.sku
+            if not diff:
+                unchanged += 1
+                continue
+
+            current.update(diff)
+            fields.update(diff)
+            changed.append(Product(pk=pk, updated_at=now, **current))
+
+        if changed:
+            fields.add('updated_at')
+        return frame.iloc[new_rows], changed, sorted(fields), unchanged
+
+    def fetch_images(self, chunk, result=None):
+        """Параллельно скачивает новые картинки пачки и сохраняет их в хранилище.
+
+        URL, которые уже скачивались прошлыми импортами (ImageSource),
+        не качаются повторно, если файл ещё лежит в хранилище.
+        """
+        result = result or ImportResult()
+        unique_urls = [url for url in chunk['image_url'].unique() if url]
+        urls = [url for url in unique_urls if url not in self.image_names]
+        # Картинки, уже сохранённые этим импортом в прошлых пачках
+        result.images['cache_hits'] += len(unique_urls) - len(urls)
+        if not urls:
+            return
+        known = self.known_images(urls)
+        self.image_names.update(known)
+
+        contents, errors = self.fetcher.fetch_many([url for url in urls if url not in known])
+        result.images['cache_hits'] += len(known)
+        result.images['downloaded'] += len(contents)
+        result.images['failed'] += len(errors)
+        self.image_errors.update(errors)
+        # Товар создаётся и без картинки, но строка попадает в ошибки импорта —
+        # в том числе в следующих пачках, где тот же URL уже не качается
+        failed = chunk[chunk['image_url'].isin(self.image_errors)]
+        result.errors.extend(f"Строка {row}: картинка не загружена ({self.image_errors[url]})"
+                             for row, url in zip(failed['row'], failed['image_url']))
+        result.images['bytes'] += sum(len(content) for content in contents.values())
+        sources = []
+        for url, content in contents.items():
+            name = self.save_image(url, content)
+            self.image_names[url] = name
+            schedule_derivatives(name)
+            sources.append(ImageSource(url_hash=ImageSource.hash_url(url), url=url, name=name,
+                                       size=len(content)))
+        if sources:
+            ImageSource.objects.bulk_create(sources, update_conflicts=True, unique_fields=['url_hash'],
+                                            update_fields=['name', 'size', 'fetched_at'])
+
+    def known_images(self, urls):
+        """{url: имя файла} для картинок, уже лежащих в хранилище"""
+        storage = Product._meta.get_field('image').storage
+        hashes = {ImageSource.hash_url(url): url for url in urls}
+        return {
+            hashes[url_hash]: name
+            for url_hash, name in ImageSource.objects.filter(url_hash__in=hashes).values_list('url_hash', 'name')
+            if storage.exists(name)
+        }
+
+    def save_image(self, url, content):
+        image_field = Product._meta.get_field('image')
+        name = image_field.generate_filename(None, _image_filename(url))
+        return image_field.storage.save(name, ContentFile(content))
+
+    def build_products(self, chunk):
+        if chunk.empty:
+            return []
+        return [
+            Product(
+                name=name,
+                sku=sku,
+                description=description,
+                short_description=short_description,
+                price=_decimal(price),
+                old_price=_decimal(old_price),
+                quantity=quantity,
+                category_id=category_id,
+                image=self.image_names.get(image_url, ''),
+                is_active=True,
+            )
+            for name, sku, description, short_description, price, old_price, quantity, category_id, image_url
+            in chunk[['name', 'sku', 'description', 'short_description', 'price',
+                      'old_price', 'quantity', 'category_id', 'image_url']].itertuples(index=False)
+        ]
+
+    def register_created(self, products):
+        """Добавляет созданные товары в индекс, чтобы следующие пачки их обновляли"""
+        for product in products:
+            if product.pk is not None:
+                self.index.add(product.pk, product.name, product.category_id,
+                               {name: getattr(product, name) for name in CatalogIndex.fields})
+                self.index.seen.add(product.pk)
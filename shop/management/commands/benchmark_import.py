@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarks import (DEFAULT_SIZES, PATHS, compare_results, run_scenario, run_suite,
+                             stage_share_violations)
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость, число запросов и память импорта товаров на синтетических файлах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                            help='Размеры файлов в строках')
+        parser.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS),
+                            help='job — process_excel_import напрямую, admin — загрузка через админку')
+        parser.add_argument('--no-images', action='store_true',
+                            help='Только файлы без картинок')
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Задержка ответа заглушки картинок, сек.')
+        parser.add_argument('--output', help='Куда записать JSON с результатами')
+        parser.add_argument('--compare', help='JSON предыдущего запуска для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Допустимое ухудшение метрики при сравнении (доля)')
+        parser.add_argument('--single', help='Служебный: прогнать один файл в этом процессе')
+        parser.add_argument('--path', choices=PATHS, default='job', help='Служебный: путь для --single')
+
+    def handle(self, *args, **options):
+        if options['single']:
+            # Дочерний процесс run_suite: одна строка JSON в stdout
+            self.stdout.write(json.dumps(run_scenario(options['single'], options['path'])))
+            return
+
+        report = run_suite(
+            sizes=options['sizes'],
+            paths=options['paths'],
+            images=(False,) if options['no_images'] else (False, True),
+            latency=options['latency'],
+            log=self.stdout.write,
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+        else:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+
+        violations = stage_share_violations(report)
+        if violations:
+            raise CommandError('Этапы вышли за допустимую долю времени:\n' + '\n'.join(violations))
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_results(baseline, report, options['tolerance'])
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import BATCH_SIZE, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Учитывает новые заказы в рекомендациях «покупают вместе» и пересобирает их для затронутых товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать по всей истории заказов и для всех активных товаров')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Заказов (и товаров) в одной пачке')
+
+    def handle(self, *args, **options):
+        run = build_recommendations(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Новых заказов: {run.orders}, обновлено пар: {run.pairs}, '
+            f'пересчитано товаров: {run.products} (учтены заказы до #{run.last_order_id})'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shop.catalog_cache import reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша фрагментов витрины'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счётчики после вывода')
+
+    def handle(self, *args, **options):
+        for name, counters in stats().items():
+            ratio = '—' if counters['ratio'] is None else f"{counters['ratio']:.1%}"
+            self.stdout.write(f"{name}: попаданий {counters['hits']}, промахов {counters['misses']}, доля {ratio}")
+        if options['reset']:
+            reset_stats()
+            self.stdout.write('Счётчики обнулены')
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.models import ImageSource, Product, ProductImage
+from shop.storage import content_hash, hashed_name, image_storage, is_hashed_name
+from shop.thumbnails import derivative_names, is_derivative, schedule_derivatives, wait_pending
+
+IMAGE_ROOT = 'products'
+# Файлы моложе этого не удаляются: ссылку на них, возможно, ещё не записал идущий импорт
+MIN_AGE_HOURS = 24
+
+
+def walk(storage, path):
+    """Все файлы хранилища в каталоге path (рекурсивно)"""
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield f"{path}/{name}"
+    for directory in directories:
+        yield from walk(storage, f"{path}/{directory}")
+
+
+class Command(BaseCommand):
+    help = 'Переводит изображения товаров на имена по хэшу, удаляет дубли и файлы без ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет сделано')
+        parser.add_argument('--min-age', type=float, default=MIN_AGE_HOURS,
+                            help=f'Не удалять файлы моложе стольких часов (по умолчанию {MIN_AGE_HOURS})')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = image_storage
+        if not storage.exists(IMAGE_ROOT):
+            self.stdout.write('Каталог изображений пуст')
+            return
+
+        referenced = self.referenced_names()
+
+        # 1. Старые имена (и дубли от гонок при сохранении) -> имя по хэшу содержимого
+        migrated = set()
+        for name in sorted(referenced):
+            if is_hashed_name(name) or is_derivative(name) or not storage.exists(name):
+                continue
+            with storage.open(name) as f:
+                canonical = hashed_name(name, content_hash(f))
+                if not dry_run and not storage.exists(canonical):
+                    storage.save(name, f)
+            if not dry_run:
+                Product.objects.filter(image=name).update(image=canonical)
+                ProductImage.objects.filter(image=name).update(image=canonical)
+                ImageSource.objects.filter(name=name).update(name=canonical)
+                schedule_derivatives(canonical)
+            migrated.add(name)
+        wait_pending()
+
+        # После переименования старые файлы остаются без ссылок
+        referenced = referenced - migrated if dry_run else self.referenced_names()
+
+        # Превью живут, пока жив оригинал
+        referenced |= {derivative for name in referenced for derivative in derivative_names(name)}
+
+        # 2. Файлы, на которые не ссылается ни один товар
+        removed, reclaimed, kept = 0, 0, 0
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+        for name in walk(storage, IMAGE_ROOT):
+            if name in referenced:
+                continue
+            if storage.get_modified_time(name) > cutoff:
+                kept += 1
+                continue
+            reclaimed += storage.size(name)
+            removed += 1
+            if not dry_run:
+                storage.delete(name)
+                ImageSource.objects.filter(name=name).delete()
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Переименовано по хэшу: {len(migrated)}, удалено файлов: {removed}, '
+            f'освобождено: {reclaimed / 1024 / 1024:.1f} МБ, оставлено новых без ссылок: {kept}'
+        ))
+
+    def referenced_names(self):
+        names = set(Product.objects.exclude(image='').values_list('image', flat=True))
+        names.update(ProductImage.objects.exclude(image='').values_list('image', flat=True))
+        return names
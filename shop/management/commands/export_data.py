@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from shop.exports import EXPORTS, FORMATS, iter_csv, write_xlsx
+
+
+class Command(BaseCommand):
+    help = 'Выгружает каталог или заказы в CSV/XLSX без загрузки всей таблицы в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=EXPORTS, help='products — каталог, orders — позиции заказов')
+        parser.add_argument('--format', choices=FORMATS, default='csv', dest='file_format')
+        parser.add_argument('--output', help='Файл выгрузки (CSV без него пишется в stdout)')
+        parser.add_argument('--date-from', type=parse_date, help='Заказы начиная с даты (ГГГГ-ММ-ДД)')
+        parser.add_argument('--date-to', type=parse_date, help='Заказы по дату включительно')
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['kind'] == 'orders':
+            filters = {'date_from': options['date_from'], 'date_to': options['date_to']}
+        header, rows = EXPORTS[options['kind']](**filters)
+
+        if options['file_format'] == 'xlsx':
+            output = options['output'] or f"{options['kind']}.xlsx"
+            write_xlsx(header, rows, output)
+            self.stderr.write(f'Выгрузка записана в {output}')
+            return
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                f.writelines(iter_csv(header, rows))
+            self.stderr.write(f"Выгрузка записана в {options['output']}")
+        else:
+            for line in iter_csv(header, rows):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import Product, ProductImage
+from shop.thumbnails import schedule_derivatives, wait_pending
+
+BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = 'Строит превью (WebP и JPEG) для уже загруженных изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Перестроить превью, даже если они уже есть')
+
+    def handle(self, *args, **options):
+        names = set(Product.objects.exclude(image='').values_list('image', flat=True))
+        names.update(ProductImage.objects.exclude(image='').values_list('image', flat=True))
+
+        created = 0
+        for i, name in enumerate(sorted(names), start=1):
+            schedule_derivatives(name, force=options['force'])
+            # Не держим в очереди пула весь каталог
+            if i % BATCH_SIZE == 0:
+                created += wait_pending()
+                self.stdout.write(f'Обработано изображений: {i} из {len(names)}')
+        created += wait_pending()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Изображений: {len(names)}, создано файлов превью: {created}'
+        ))
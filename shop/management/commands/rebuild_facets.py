@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.facets import refresh_facets
+from shop.models import ProductFacet
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики фильтров (ProductFacet) по всему каталогу'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            refresh_facets()
+        self.stdout.write(self.style.SUCCESS(f'Строк счётчиков: {ProductFacet.objects.count()}'))
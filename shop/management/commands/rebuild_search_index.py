@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.search import rebuild_index, uses_fts
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс товаров (FTS5 на SQLite)'
+
+    def handle(self, *args, **options):
+        if not uses_fts():
+            self.stdout.write('Индекс FTS5 используется только на SQLite, перестраивать нечего')
+            return
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {count}'))
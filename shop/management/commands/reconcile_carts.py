@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shop.cart_summary import reconcile_carts
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сохранённые итоги корзин (item_count, subtotal) с позициями и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения, ничего не менять')
+
+    def handle(self, *args, **options):
+        drifted = reconcile_carts(dry_run=options['dry_run'])
+        for cart in drifted:
+            self.stdout.write(f'Корзина #{cart.pk}: {cart.item_count} шт., {cart.subtotal} руб.')
+        action = 'Найдено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(f'{action} корзин с расхождениями: {len(drifted)}'))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.import_jobs import STALE_AFTER, claim_next_import, process_excel_import
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь импортов товаров (ProductImport)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать очередь и выйти')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Пауза между проверками очереди, сек.')
+        parser.add_argument('--stale-after', type=int, default=STALE_AFTER,
+                            help='Через сколько секунд без отметки воркера подхватывать брошенный импорт')
+
+    def handle(self, *args, **options):
+        while True:
+            import_task = claim_next_import(options['stale_after'])
+            if import_task is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(f'Импорт #{import_task.pk}: со строки {import_task.processed_rows}')
+            process_excel_import(import_task)
+            self.stdout.write(
+                f'Импорт #{import_task.pk}: {import_task.get_status_display()}, '
+                f'создано {import_task.imported_count}, ошибок {import_task.error_count}'
+            )
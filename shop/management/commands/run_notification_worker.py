@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.notifications import BATCH_SIZE, NotificationWorker
+
+
+class Command(BaseCommand):
+    help = 'Доставляет очередь уведомлений Telegram (TelegramMessage)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Отправить то, что уже подошло, и выйти')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Пауза между проверками очереди, сек.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Число потоков отправки')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Сколько сообщений забирать за один проход')
+
+    def handle(self, *args, **options):
+        worker = NotificationWorker(workers=options['workers'], batch_size=options['batch_size'])
+        while True:
+            result = worker.run_once()
+            if not result.requests:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(
+                f'Отправлено {result.sent} (запросов: {result.requests}), '
+                f'отложено {result.retried}, не доставлено {result.failed}'
+            )
+            for error in result.errors:
+                self.stderr.write(f'Ошибка Telegram: {error}')
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.reservations import BATCH_SIZE, recount, sweep
+
+
+class Command(BaseCommand):
+    help = 'Снимает просроченные резервы товара в корзинах (StockReservation)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Снять то, что уже просрочено, и выйти')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Пауза между проходами, сек.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Сколько резервов снимать одной транзакцией')
+        parser.add_argument('--recount', action='store_true',
+                            help='Сверить счётчики Product.reserved со строками резервов и выйти')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            drifted = recount()
+            for pk, (wrong, right) in drifted.items():
+                self.stdout.write(f'Товар #{pk}: в резерве {wrong} -> {right}')
+            self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {len(drifted)}'))
+            return
+
+        while True:
+            swept = sweep(options['batch_size'])
+            if swept:
+                self.stdout.write(f'Снято просроченных резервов: {swept}')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_productimport'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productimport',
+            options={'ordering': ['-created_at'], 'verbose_name': 'Импорт товаров', 'verbose_name_plural': 'Импорты товаров'},
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Окончание обработки'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='processed_rows',
+            field=models.IntegerField(default=0, verbose_name='Обработано строк'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='rows_per_second',
+            field=models.FloatField(default=0, verbose_name='Строк в секунду'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начало обработки'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='total_rows',
+            field=models.IntegerField(default=0, verbose_name='Строк в файле'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='productimport',
+            name='status',
+            field=models.CharField(choices=[('pending', '⏳ В очереди'), ('running', '🔄 Выполняется'), ('success', '✅ Успешно'), ('error', '❌ Ошибка')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_productimport_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='Артикул'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='deactivate_missing',
+            field=models.BooleanField(default=False, verbose_name='Скрыть товары, которых нет в файле'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='deactivated_count',
+            field=models.IntegerField(default=0, verbose_name='Скрыто товаров'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='mode',
+            field=models.CharField(choices=[('create', 'Только добавить новые товары'), ('upsert', 'Обновить каталог (по артикулу или названию и категории)')], default='create', max_length=20, verbose_name='Режим'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='unchanged_count',
+            field=models.IntegerField(default=0, verbose_name='Без изменений'),
+        ),
+        migrations.AddField(
+            model_name='productimport',
+            name='updated_count',
+            field=models.IntegerField(default=0, verbose_name='Обновлено товаров'),
+        ),
+    ]
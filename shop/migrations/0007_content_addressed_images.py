@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:37
+
+import shop.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_product_sku_import_upsert'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_hash', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 URL')),
+                ('url', models.TextField(verbose_name='URL изображения')),
+                ('name', models.CharField(max_length=255, verbose_name='Файл в хранилище')),
+                ('size', models.IntegerField(default=0, verbose_name='Размер, байт')),
+                ('fetched_at', models.DateTimeField(auto_now=True, verbose_name='Дата загрузки')),
+            ],
+            options={
+                'verbose_name': 'Источник изображения',
+                'verbose_name_plural': 'Источники изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(storage=shop.storage.ContentAddressedStorage(), upload_to='products/', verbose_name='Главное изображение'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=shop.storage.ContentAddressedStorage(), upload_to='products/additional/', verbose_name='Изображение'),
+        ),
+    ]
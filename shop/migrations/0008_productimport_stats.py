@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimport',
+            name='stats',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Статистика по этапам'),
+        ),
+    ]
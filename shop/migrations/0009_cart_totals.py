@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:49
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def fill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('shop', 'Cart')
+    CartItem = apps.get_model('shop', 'CartItem')
+    totals = CartItem.objects.order_by().values('cart').annotate(
+        count=Sum('quantity'), subtotal=Sum(F('quantity') * F('product__price')),
+    )
+    carts = [
+        Cart(pk=row['cart'], item_count=row['count'] or 0,
+             subtotal=Decimal(row['subtotal'] or 0).quantize(Decimal('0.01')))
+        for row in totals
+    ]
+    Cart.objects.bulk_update(carts, ['item_count', 'subtotal'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_productimport_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.IntegerField(default=0, verbose_name='Товаров'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_cart_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('quantity__gt', 0)), fields=['category', 'created_at', 'id'], name='product_category_listing_idx'),
+        ),
+    ]
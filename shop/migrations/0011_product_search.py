@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:12
+
+from django.db import migrations
+
+FTS_TABLE = 'shop_product_search'
+GIN_INDEX = 'product_search_gin_idx'
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5-таблица на SQLite, GIN-индекс по tsvector на PostgreSQL"""
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        from shop.search import normalize
+
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, short_description, description, category, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        Product = apps.get_model('shop', 'Product')
+        rows = Product.objects.filter(is_active=True).values_list(
+            'id', 'name', 'short_description', 'description', 'category__name')
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, short_description, description, category) '
+                'VALUES (%s, %s, %s, %s, %s)',
+                [(pk, *(normalize(value) for value in values)) for pk, *values in rows.iterator()],
+            )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {GIN_INDEX} ON shop_product USING GIN ("
+            "to_tsvector('russian'::regconfig, COALESCE(name, '') || ' ' || "
+            "COALESCE(short_description, '') || ' ' || COALESCE(description, '')))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {GIN_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_category_listing_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_facets(apps, schema_editor):
+    from shop.facets import grouped_counts
+
+    Product = apps.get_model('shop', 'Product')
+    ProductFacet = apps.get_model('shop', 'ProductFacet')
+    # Резервов (Product.reserved) ещё нет — наличие по остатку
+    rows = [ProductFacet(category_id=row.pop('category'), **row)
+            for row in grouped_counts(Product.objects.filter(is_active=True), in_stock=models.Q(quantity__gt=0))]
+    ProductFacet.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField(verbose_name='Ценовой диапазон')),
+                ('on_sale', models.BooleanField(verbose_name='Со скидкой')),
+                ('is_featured', models.BooleanField(verbose_name='Рекомендуемый')),
+                ('in_stock', models.BooleanField(verbose_name='В наличии')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Товаров')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='shop.category')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фильтра',
+                'verbose_name_plural': 'Счётчики фильтров',
+                'constraints': [models.UniqueConstraint(fields=('category', 'price_bucket', 'on_sale', 'is_featured', 'in_stock'), name='product_facet_unique')],
+            },
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
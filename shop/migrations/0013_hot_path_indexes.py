@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_facets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['session_key'], name='cart_guest_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['created_at'], name='chatmessage_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'created_at'], name='order_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('quantity__gt', 0)), fields=['created_at'], name='product_storefront_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', 'created_at'], name='product_category_active_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.PositiveIntegerField(default=0, verbose_name='Последний учтённый заказ')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='Новых заказов')),
+                ('pairs', models.PositiveIntegerField(default=0, verbose_name='Обновлено пар')),
+                ('products', models.PositiveIntegerField(default=0, verbose_name='Пересчитано товаров')),
+                ('full', models.BooleanField(default=False, verbose_name='Полный пересчёт')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата запуска')),
+            ],
+            options={
+                'verbose_name': 'Пересчёт рекомендаций',
+                'verbose_name_plural': 'Пересчёты рекомендаций',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Заказов вместе')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Пара товаров',
+                'verbose_name_plural': 'Пары товаров',
+                'constraints': [models.UniqueConstraint(fields=('product', 'other'), name='product_pair_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRelation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(verbose_name='Позиция')),
+                ('score', models.PositiveIntegerField(default=0, verbose_name='Заказов вместе')),
+                ('source', models.CharField(choices=[('together', 'Покупают вместе'), ('category', 'Из той же категории')], max_length=20, verbose_name='Источник')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='relations', to='shop.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='Рекомендуемый товар')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация',
+                'verbose_name_plural': 'Рекомендации',
+                'ordering': ['product', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'position'), name='product_relation_position_unique')],
+            },
+        ),
+    ]
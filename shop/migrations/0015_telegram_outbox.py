@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=64, verbose_name='Чат')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Не доставлено')], default='pending', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('claim', models.CharField(blank=True, max_length=32, verbose_name='Захвачено воркером')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='Время захвата')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+            ],
+            options={
+                'verbose_name': 'Уведомление Telegram',
+                'verbose_name_plural': 'Уведомления Telegram',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='telegram_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_telegram_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.IntegerField(default=0, verbose_name='В резерве'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Истекает')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('cart', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.cart', verbose_name='Корзина')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.order', verbose_name='Заказ')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+                'indexes': [models.Index(condition=models.Q(('expires_at__isnull', False)), fields=['expires_at'], name='reservation_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cart', 'product'), name='reservation_cart_product_unique'), models.UniqueConstraint(fields=('order', 'product'), name='reservation_order_product_unique'), models.CheckConstraint(condition=models.Q(models.Q(('cart__isnull', False), ('order__isnull', True)), models.Q(('cart__isnull', True), ('order__isnull', False)), _connector='OR'), name='reservation_single_owner')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def refill_facets(apps, schema_editor):
+    """«В наличии» теперь считается по свободному остатку (quantity - reserved)"""
+    from shop.facets import grouped_counts
+
+    Product = apps.get_model('shop', 'Product')
+    ProductFacet = apps.get_model('shop', 'ProductFacet')
+    rows = [ProductFacet(category_id=row.pop('category'), **row)
+            for row in grouped_counts(Product.objects.filter(is_active=True))]
+    ProductFacet.objects.all().delete()
+    ProductFacet.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_productimport_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(refill_facets, migrations.RunPython.noop),
+    ]
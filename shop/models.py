@@ -1,11 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.core.mail import send_mail
 from django.conf import settings
 import json
+import hashlib
+from html import escape
+from decimal import Decimal
 from django.contrib.auth.models import BaseUserManager
+from .storage import image_storage
 
 
 class CustomerManager(BaseUserManager):
@@ -39,11 +43,6 @@ class CustomerManager(BaseUserManager):
 
         return self.create_user(email, phone, first_name, last_name, password, **extra_fields)
 
-try:
-    import requests
-    REQUESTS_AVAILABLE = True
-except ImportError:
-    REQUESTS_AVAILABLE = False
 
 class Customer(AbstractUser):
     objects = CustomerManager()
@@ -145,6 +144,12 @@ class Product(models.Model):
         max_length=200,
         verbose_name='Название товара'
     )
+    sku = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        verbose_name='Артикул'
+    )
     description = models.TextField(
         verbose_name='Описание товара'
     )
@@ -169,6 +174,12 @@ class Product(models.Model):
         default=0,
         verbose_name='Количество на складе'
     )
+    # Сумма активных резервов (StockReservation); меняется только условными
+    # UPDATE в reservations.py, обычное сохранение товара его не перезаписывает
+    reserved = models.IntegerField(
+        default=0,
+        verbose_name='В резерве'
+    )
     category = models.ForeignKey(
         Category,
         on_delete=models.CASCADE,
@@ -177,6 +188,7 @@ class Product(models.Model):
     )
     image = models.ImageField(
         upload_to='products/',
+        storage=image_storage,
         verbose_name='Главное изображение'
     )
     additional_images = models.ManyToManyField(
@@ -202,10 +214,15 @@ class Product(models.Model):
         verbose_name='Дата обновления'
     )
 
+    @property
+    def available_quantity(self):
+        """Сколько ещё можно положить в корзину: остаток без резервов"""
+        return max(self.quantity - self.reserved, 0)
+
     @property
     def available(self):
         """Доступен ли товар для заказа"""
-        return self.is_active and self.quantity > 0
+        return self.is_active and self.available_quantity > 0
 
     @property
     def has_discount(self):
@@ -226,6 +243,13 @@ class Product(models.Model):
         if self.price < 0:
             raise ValidationError('Цена не может быть отрицательной')
 
+    def save(self, *args, **kwargs):
+        # Резерв, загруженный вместе с товаром, мог устареть — не записываем его
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'reserved']
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.quantity} шт.)"
 
@@ -233,6 +257,19 @@ class Product(models.Model):
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['-created_at']
+        indexes = [
+            # Страницы категории: только товары на витрине, по дате и id
+            models.Index(fields=['category', 'created_at', 'id'], name='product_category_listing_idx',
+                         condition=models.Q(is_active=True, quantity__gt=0)),
+            # Главная: товары на витрине, новые сверху
+            models.Index(fields=['created_at'], name='product_storefront_idx',
+                         condition=models.Q(is_active=True, quantity__gt=0)),
+            # Похожие товары и счётчики фильтров: активные товары категории.
+            # is_active — в условии, а не в столбцах: SQLite пишет фильтр по
+            # булеву полю как голый столбец и не ищет по нему в индексе
+            models.Index(fields=['category', 'created_at'], name='product_category_active_idx',
+                         condition=models.Q(is_active=True)),
+        ]
 
 
 class ProductImage(models.Model):
@@ -244,6 +281,7 @@ class ProductImage(models.Model):
     )
     image = models.ImageField(
         upload_to='products/additional/',
+        storage=image_storage,
         verbose_name='Изображение'
     )
     alt_text = models.CharField(
@@ -262,6 +300,78 @@ class ProductImage(models.Model):
         ordering = ['order']
 
 
+class ProductFacet(models.Model):
+    """Число активных товаров категории с данным сочетанием значений фильтров.
+
+    Заполняется и обновляется ``facets.refresh_facets``; ценовые диапазоны —
+    ``facets.PRICE_BUCKETS``.
+    """
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        related_name='facets'
+    )
+    price_bucket = models.PositiveSmallIntegerField(
+        verbose_name='Ценовой диапазон'
+    )
+    on_sale = models.BooleanField(
+        verbose_name='Со скидкой'
+    )
+    is_featured = models.BooleanField(
+        verbose_name='Рекомендуемый'
+    )
+    in_stock = models.BooleanField(
+        verbose_name='В наличии'
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Товаров'
+    )
+
+    class Meta:
+        verbose_name = 'Счётчик фильтра'
+        verbose_name_plural = 'Счётчики фильтров'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'price_bucket', 'on_sale', 'is_featured', 'in_stock'],
+                                    name='product_facet_unique'),
+        ]
+
+
+class ImageSource(models.Model):
+    """Уже скачанная картинка: URL поставщика -> файл в хранилище"""
+    url_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='SHA-256 URL'
+    )
+    url = models.TextField(
+        verbose_name='URL изображения'
+    )
+    name = models.CharField(
+        max_length=255,
+        verbose_name='Файл в хранилище'
+    )
+    size = models.IntegerField(
+        default=0,
+        verbose_name='Размер, байт'
+    )
+    fetched_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата загрузки'
+    )
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def __str__(self):
+        return self.url
+
+    class Meta:
+        verbose_name = 'Источник изображения'
+        verbose_name_plural = 'Источники изображений'
+
+
 class Order(models.Model):
     """Заказы клиентов"""
     STATUS_CHOICES = [
@@ -315,56 +425,106 @@ class Order(models.Model):
     )
 
     def update_status(self, new_status, admin_comment=''):
-        """Безопасное изменение статуса с управлением количеством товаров"""
-        if self.status == new_status:
-            return
+        """Безопасное изменение статуса с управлением количеством товаров.
 
-        old_status = self.status
-
-        # Логика изменения количества товаров
-        if new_status == 'confirmed' and old_status != 'confirmed':
-            # Подтверждаем заказ - списываем товары
-            for item in self.items.all():
-                if item.quantity > item.product.quantity:
-                    raise ValidationError(
-                        f"Недостаточно товара '{item.product.name}'. "
-                        f"На складе: {item.product.quantity}, в заказе: {item.quantity}"
-                    )
+        Всё в одной транзакции: строки заказа и его товаров блокируются
+        (товары — по возрастанию id, чтобы параллельные подтверждения не
+        взаимоблокировались), остатки меняются одним условным UPDATE.
+        Если какой-то позиции не хватает, ничего не меняется и поднимается
+        ValidationError со всеми недостающими позициями.
+        """
+        from . import reservations
 
-                item.product.quantity -= item.quantity
-                item.product.save()
+        if self.status == new_status:
+            return
 
-                # Отправляем уведомление в Telegram
+        with transaction.atomic():
+            # Статус перечитывается под блокировкой: заказ, который параллельно
+            # уже подтвердили, не спишет товар второй раз
+            old_status = Order.objects.select_for_update().values_list('status', flat=True).get(pk=self.pk)
+            if old_status != new_status:
+                lines = dict(self.items.order_by().values('product').annotate(total=models.Sum('quantity'))
+                             .values_list('product', 'total'))
+                if new_status == 'confirmed':
+                    # Резерв заказа (если он оформлен из корзины) превращается в списание
+                    self._change_stock(lines, take=True, held=reservations.held_by_orders([self.pk])[self.pk])
+                    reservations.consume([self.pk])
+                elif old_status == 'confirmed':
+                    # Товар возвращается на склад, только если его списали при подтверждении
+                    self._change_stock(lines, take=False)
+                elif new_status == 'cancelled':
+                    reservations.release_orders([self.pk])
+            self.status = new_status
+            self.admin_comment = admin_comment
+            self.save()
+
+            # Уведомление — строка очереди в той же транзакции: откат убирает и её
+            if old_status != new_status and new_status == 'confirmed':
                 self._send_telegram_notification(f"✅ Заказ #{self.id} подтвержден")
+            elif old_status != new_status and new_status == 'cancelled':
+                self._send_telegram_notification(f"❌ Заказ #{self.id} отменен")
 
-        elif new_status == 'cancelled' and old_status != 'cancelled':
-            # Отменяем заказ - возвращаем товары
-            for item in self.items.all():
-                item.product.quantity += item.quantity
-                item.product.save()
-
-            # Отправляем уведомление в Telegram
-            self._send_telegram_notification(f"❌ Заказ #{self.id} отменен")
+    @staticmethod
+    def _change_stock(lines, take, held=None):
+        """Списывает (``take``) или возвращает остатки: {id товара: количество}.
 
-        self.status = new_status
-        self.admin_comment = admin_comment
-        self.save()
-
-        # Отправляем уведомление о создании нового заказа
-        if old_status == 'new' and new_status == 'new':
-            self._send_new_order_notification()
-
-    def _send_new_order_notification(self):
+        ``held`` — резерв самих списываемых заказов {id товара: количество}:
+        он снимается вместе со списанием. Чужие резервы (корзины, другие
+        заказы) списать нельзя.
+        """
+        if not lines:
+            return
+        held = held or {}
+        products = list(Product.objects.select_for_update().filter(pk__in=lines).order_by('pk')
+                        .values_list('pk', 'name', 'quantity', 'reserved', 'category_id'))
+        fields = {}
+        if take:
+            short = [f"'{name}' (на складе: {max(quantity - reserved + held.get(pk, 0), 0)}, в заказе: {lines[pk]})"
+                     for pk, name, quantity, reserved, _ in products
+                     if quantity - reserved + held.get(pk, 0) < lines[pk]]
+            if short:
+                raise ValidationError(f"Недостаточно товара: {', '.join(short)}")
+            # Условие в самом UPDATE: даже без блокировок строк (SQLite)
+            # остаток не уйдёт ниже зарезервированного другими
+            condition = models.Q()
+            for pk, quantity in lines.items():
+                condition |= models.Q(pk=pk, quantity__gte=models.F('reserved') + quantity - held.get(pk, 0))
+            delta = {pk: -quantity for pk, quantity in lines.items()}
+            if held:
+                fields['reserved'] = models.Case(
+                    *[models.When(pk=pk, then=models.F('reserved') - quantity) for pk, quantity in held.items()],
+                    default=models.F('reserved'), output_field=models.IntegerField(),
+                )
+        else:
+            condition = models.Q(pk__in=lines)
+            delta = lines
+        updated = Product.objects.filter(condition).update(quantity=models.Case(
+            *[models.When(pk=pk, then=models.F('quantity') + change) for pk, change in delta.items()],
+            output_field=models.IntegerField(),
+        ), **fields)
+        if take and updated != len(lines):
+            raise ValidationError('Остатки товаров изменились во время подтверждения заказа, попробуйте ещё раз')
+
+        # UPDATE не шлёт сигналов: кэш витрины и счётчики фильтров обновляем сами
+        from . import catalog_cache, facets
+
+        for pk, _, _, _, category_id in products:
+            transaction.on_commit(lambda pk=pk, category_id=category_id: catalog_cache.bump_product(pk, category_id))
+        facets.refresh_facets({category_id for *_, category_id in products})
+
+    def _send_new_order_notification(self, item_count=None):
         """Отправка уведомления о новом заказе в Telegram"""
+        if item_count is None:
+            item_count = self.items.aggregate(count=models.Sum('quantity'))['count'] or 0
         message = f"""
 🆕 НОВЫЙ ЗАКАЗ #{self.id}
 
-👤 Клиент: {self.customer.get_full_name()}
-📞 Телефон: {self.contact_phone or self.customer.phone}
+👤 Клиент: {escape(self.customer.get_full_name())}
+📞 Телефон: {escape(self.contact_phone or self.customer.phone)}
 💰 Сумма: {self.total_amount} руб.
-📦 Товаров: {self.items.count()} шт.
+📦 Товаров: {item_count} шт.
 
-💬 Комментарий: {self.comment or 'нет'}
+💬 Комментарий: {escape(self.comment) or 'нет'}
 
 🛠 Для управления заказом перейдите в админ-панель:
 {settings.SITE_URL}/admin/shop/order/{self.id}/change/
@@ -377,25 +537,20 @@ class Order(models.Model):
 {status_text}
 
 📦 Заказ #{self.id}
-👤 Клиент: {self.customer.get_full_name()}
+👤 Клиент: {escape(self.customer.get_full_name())}
 💰 Сумма: {self.total_amount} руб.
         """
         self._send_telegram_message(message)
 
-    def _send_telegram_message(self, message):
-        """Отправка сообщения в Telegram"""
-        if hasattr(settings, 'TELEGRAM_BOT_TOKEN') and hasattr(settings, 'TELEGRAM_CHAT_ID'):
-            try:
-                url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
-                payload = {
-                    'chat_id': settings.TELEGRAM_CHAT_ID,
-                    'text': message,
-                    'parse_mode': 'HTML'
-                }
-                requests.post(url, json=payload, timeout=10)
-            except Exception as e:
-                # Логируем ошибку, но не прерываем выполнение
-                print(f"Ошибка отправки в Telegram: {e}")
+    @staticmethod
+    def _send_telegram_message(message):
+        """Постановка сообщения в очередь Telegram (в текущей транзакции).
+
+        Сообщения уходят с ``parse_mode: HTML`` — данные покупателя в них экранируются.
+        """
+        from .notifications import enqueue
+
+        enqueue(message)
 
     def save(self, *args, **kwargs):
         # Пересчет суммы при сохранении
@@ -415,6 +570,10 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-created_at']
+        indexes = [
+            # Заказы клиента в профиле, новые сверху
+            models.Index(fields=['customer', 'created_at'], name='order_customer_created_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -483,16 +642,38 @@ class Cart(models.Model):
         auto_now=True,
         verbose_name='Дата обновления'
     )
+    # Итоги хранятся в самой корзине и меняются вместе с позициями
+    # (cart_summary.change_cart); расхождения чинит manage.py reconcile_carts
+    item_count = models.IntegerField(
+        default=0,
+        verbose_name='Товаров'
+    )
+    subtotal = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name='Сумма'
+    )
 
     @property
     def total_amount(self):
         """Общая сумма корзины"""
-        return sum(item.total_price for item in self.items.all())
+        return self.subtotal
 
     @property
     def total_quantity(self):
         """Общее количество товаров в корзине"""
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
+
+    def recalculate(self):
+        """Пересчитывает сохранённые итоги по позициям корзины"""
+        totals = self.items.aggregate(
+            count=models.Sum('quantity'),
+            subtotal=models.Sum(models.F('quantity') * models.F('product__price')),
+        )
+        self.item_count = totals['count'] or 0
+        self.subtotal = Decimal(totals['subtotal'] or 0).quantize(Decimal('0.01'))
+        Cart.objects.filter(pk=self.pk).update(item_count=self.item_count, subtotal=self.subtotal)
 
     def __str__(self):
         if self.user:
@@ -502,6 +683,11 @@ class Cart(models.Model):
     class Meta:
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
+        indexes = [
+            # Корзина гостя по ключу сессии; корзину пользователя ищет индекс внешнего ключа user
+            models.Index(fields=['session_key'], name='cart_guest_session_idx',
+                         condition=models.Q(user__isnull=True)),
+        ]
 
 
 class CartItem(models.Model):
@@ -532,11 +718,18 @@ class CartItem(models.Model):
         return self.product.price * self.quantity
 
     def clean(self):
-        """Проверка доступности товара"""
-        if self.quantity > self.product.quantity:
+        """Проверка доступности товара: свободный остаток плюс то, что уже держит эта корзина"""
+        if not self.product_id:
+            return
+        held = 0
+        if self.cart_id:
+            held = (StockReservation.objects.filter(cart_id=self.cart_id, product_id=self.product_id)
+                    .values_list('quantity', flat=True).first() or 0)
+        available = self.product.available_quantity + held
+        if self.quantity > available:
             raise ValidationError(
                 f"Недостаточно товара '{self.product.name}'. "
-                f"Доступно: {self.product.quantity}"
+                f"Доступно: {available}"
             )
 
     def __str__(self):
@@ -558,6 +751,9 @@ class ChatMessage(models.Model):
         ordering = ['created_at']
         verbose_name = 'Сообщение чата'
         verbose_name_plural = 'Сообщения чата'
+        indexes = [
+            models.Index(fields=['created_at'], name='chatmessage_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user}: {self.message[:50]}..."
@@ -565,18 +761,292 @@ class ChatMessage(models.Model):
 
 class ProductImport(models.Model):
     STATUS_CHOICES = [
-        ('pending', '⏳ В обработке'),
+        ('pending', '⏳ В очереди'),
+        ('running', '🔄 Выполняется'),
         ('success', '✅ Успешно'),
         ('error', '❌ Ошибка'),
     ]
 
+    MODE_CHOICES = [
+        ('create', 'Только добавить новые товары'),
+        ('upsert', 'Обновить каталог (по артикулу или названию и категории)'),
+    ]
+
     file = models.FileField(upload_to='imports/', verbose_name='Excel файл')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='create', verbose_name='Режим')
+    deactivate_missing = models.BooleanField(
+        default=False,
+        verbose_name='Скрыть товары, которых нет в файле'
+    )
     imported_count = models.IntegerField(default=0, verbose_name='Импортировано товаров')
+    updated_count = models.IntegerField(default=0, verbose_name='Обновлено товаров')
+    unchanged_count = models.IntegerField(default=0, verbose_name='Без изменений')
+    deactivated_count = models.IntegerField(default=0, verbose_name='Скрыто товаров')
     error_count = models.IntegerField(default=0, verbose_name='Ошибок')
     errors = models.TextField(blank=True, verbose_name='Ошибки импорта')
+    total_rows = models.IntegerField(default=0, verbose_name='Строк в файле')
+    processed_rows = models.IntegerField(default=0, verbose_name='Обработано строк')
+    rows_per_second = models.FloatField(default=0, verbose_name='Строк в секунду')
+    # {'timings': {этап: сек}, 'queries': {этап: запросов}, 'images': {...}}
+    stats = models.JSONField(default=dict, blank=True, verbose_name='Статистика по этапам')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начало обработки')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Окончание обработки')
+    # Воркер отмечается здесь раз в HEARTBEAT_INTERVAL, даже посреди долгой пачки
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='Воркер на связи')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(Customer, on_delete=models.CASCADE)
 
+    @property
+    def is_finished(self):
+        return self.status in ('success', 'error')
+
+    @property
+    def progress_percent(self):
+        """Процент обработанных строк"""
+        if not self.total_rows:
+            return 100 if self.is_finished else 0
+        return min(100, int(self.processed_rows * 100 / self.total_rows))
+
+    @property
+    def eta_seconds(self):
+        """Оценка оставшегося времени в секундах"""
+        if self.is_finished or not self.rows_per_second or not self.total_rows:
+            return None
+        return int(max(0, self.total_rows - self.processed_rows) / self.rows_per_second)
+
     def __str__(self):
-        return f"Импорт от {self.created_at.strftime('%d.%m.%Y %H:%M')}"
\ No newline at end of file
+        return f"Импорт от {self.created_at.strftime('%d.%m.%Y %H:%M')}"
+
+    class Meta:
+        verbose_name = 'Импорт товаров'
+        verbose_name_plural = 'Импорты товаров'
+        ordering = ['-created_at']
+
+
+class ProductPair(models.Model):
+    """Сколько заказов содержали оба товара (в обе стороны: A->B и B->A)"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    other = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Заказов вместе'
+    )
+
+    class Meta:
+        verbose_name = 'Пара товаров'
+        verbose_name_plural = 'Пары товаров'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='product_pair_unique'),
+        ]
+
+
+class ProductRelation(models.Model):
+    """Готовые рекомендации для страницы товара (строит recommendations.refresh_relations)"""
+    SOURCE_CHOICES = [
+        ('together', 'Покупают вместе'),
+        ('category', 'Из той же категории'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='relations'
+    )
+    related = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рекомендуемый товар'
+    )
+    position = models.PositiveSmallIntegerField(
+        verbose_name='Позиция'
+    )
+    score = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Заказов вместе'
+    )
+    source = models.CharField(
+        max_length=20,
+        choices=SOURCE_CHOICES,
+        verbose_name='Источник'
+    )
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        ordering = ['product', 'position']
+        constraints = [
+            # Заодно индекс для выборки рекомендаций товара по порядку
+            models.UniqueConstraint(fields=['product', 'position'], name='product_relation_position_unique'),
+        ]
+
+
+class RecommendationRun(models.Model):
+    """Запуск пересчёта рекомендаций; last_order_id — докуда учтены заказы"""
+    last_order_id = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Последний учтённый заказ'
+    )
+    orders = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Новых заказов'
+    )
+    pairs = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Обновлено пар'
+    )
+    products = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Пересчитано товаров'
+    )
+    full = models.BooleanField(
+        default=False,
+        verbose_name='Полный пересчёт'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата запуска'
+    )
+
+    class Meta:
+        verbose_name = 'Пересчёт рекомендаций'
+        verbose_name_plural = 'Пересчёты рекомендаций'
+        ordering = ['-created_at']
+
+
+class TelegramMessage(models.Model):
+    """Исходящее уведомление в Telegram (очередь; доставляет run_notification_worker)"""
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает отправки'),
+        ('sending', 'Отправляется'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Не доставлено'),
+    ]
+
+    chat_id = models.CharField(
+        max_length=64,
+        verbose_name='Чат'
+    )
+    text = models.TextField(
+        verbose_name='Текст'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name='Статус'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попыток'
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Следующая попытка'
+    )
+    claim = models.CharField(
+        max_length=32,
+        blank=True,
+        verbose_name='Захвачено воркером'
+    )
+    claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время захвата'
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Последняя ошибка'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создано'
+    )
+    sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Отправлено'
+    )
+
+    def __str__(self):
+        return f"{self.get_status_display()}: {self.text[:50]}"
+
+    class Meta:
+        verbose_name = 'Уведомление Telegram'
+        verbose_name_plural = 'Уведомления Telegram'
+        ordering = ['-created_at']
+        indexes = [
+            # Выборка очереди воркером: ожидающие, у которых подошло время
+            models.Index(fields=['next_attempt_at'], name='telegram_pending_idx',
+                         condition=models.Q(status='pending')),
+        ]
+
+
+class StockReservation(models.Model):
+    """Резерв товара под корзину (со сроком) или оформленный заказ (до подтверждения или отмены)"""
+    cart = models.ForeignKey(
+        Cart,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservations',
+        verbose_name='Корзина'
+    )
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservations',
+        verbose_name='Заказ'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Товар'
+    )
+    quantity = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+    expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Истекает'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создан'
+    )
+
+    def __str__(self):
+        owner = f"корзина #{self.cart_id}" if self.cart_id else f"заказ #{self.order_id}"
+        return f"{self.product_id} x{self.quantity} ({owner})"
+
+    class Meta:
+        verbose_name = 'Резерв товара'
+        verbose_name_plural = 'Резервы товаров'
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='reservation_cart_product_unique'),
+            models.UniqueConstraint(fields=['order', 'product'], name='reservation_order_product_unique'),
+            models.CheckConstraint(
+                condition=models.Q(cart__isnull=False, order__isnull=True)
+                | models.Q(cart__isnull=True, order__isnull=False),
+                name='reservation_single_owner',
+            ),
+        ]
+        indexes = [
+            # Очистка просроченных: только резервы корзин, самые старые первыми
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx',
+                         condition=models.Q(expires_at__isnull=False)),
+        ]
@@ -0,0 +1,240 @@
+"""Уведомления в Telegram через очередь ``TelegramMessage``.
+
+Сайт и админка не ходят в Telegram сами: ``enqueue`` только добавляет
+строку в очередь в текущей транзакции, поэтому уведомление появляется
+тогда и только тогда, когда закоммичено изменение, о котором оно.
+
+Доставляет ``manage.py run_notification_worker``: забирает пачку
+подошедших сообщений (условным UPDATE, несколько воркеров не возьмут
+одно и то же), склеивает сообщения одного чата в сводки и отправляет их
+пулом потоков через одну ``requests.Session``. Скорость ограничена
+лимитами Telegram (общий и на чат), при ошибке сообщение ждёт повтора
+с экспоненциальной задержкой (или сколько попросил Telegram в
+``retry_after``), после ``MAX_ATTEMPTS`` попыток помечается как
+недоставленное.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import TelegramMessage
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+BACKOFF = 5
+MAX_BACKOFF = 15 * 60
+# «Отправляется» дольше этого — воркер, видимо, упал; сообщение можно забрать снова
+STALE_AFTER = 5 * 60
+# Лимиты Telegram: около 30 сообщений в секунду всего и 1 в секунду в один чат
+GLOBAL_RATE = 30
+CHAT_INTERVAL = 1.0
+MAX_LENGTH = 4096
+DIGEST_SEPARATOR = '\n\n— — —\n\n'
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def enqueue(text, chat_id=None):
+    """Ставит сообщение в очередь; без настроек бота ничего не делает"""
+    chat_id = chat_id or settings.TELEGRAM_CHAT_ID
+    if not (settings.TELEGRAM_BOT_TOKEN and chat_id):
+        return None
+    return TelegramMessage.objects.create(chat_id=str(chat_id), text=text.strip())
+
+
+class TelegramError(Exception):
+    def __init__(self, message, retry=True, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Общий лимит отправок в секунду и минимальный интервал для одного чата"""
+
+    def __init__(self, rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL):
+        self.interval = 1 / rate if rate else 0
+        self.chat_interval = chat_interval
+        self._next = 0
+        self._next_by_chat = {}
+        self._lock = threading.Lock()
+
+    def wait(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next, self._next_by_chat.get(chat_id, 0))
+            self._next = start + self.interval
+            self._next_by_chat[chat_id] = start + self.chat_interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class TelegramClient:
+    """Отправка через Bot API по одной сессии с пулом keep-alive соединений"""
+    timeout = 10
+
+    def __init__(self, token=None, api_url=None, pool_size=4):
+        self.url = f"{(api_url or settings.TELEGRAM_API_URL).rstrip('/')}/bot{token or settings.TELEGRAM_BOT_TOKEN}/sendMessage"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send(self, chat_id, text):
+        try:
+            response = self.session.post(self.url, json={'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'},
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            raise TelegramError(str(e)) from e
+        if response.status_code == 200:
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        raise TelegramError(
+            f"HTTP {response.status_code}: {body.get('description', response.text[:200])}",
+            retry=response.status_code in RETRY_STATUSES,
+            retry_after=body.get('parameters', {}).get('retry_after'),
+        )
+
+
+def digests(messages):
+    """Сообщения одного чата -> [(текст, [сообщения])]; длинные сводки делятся по MAX_LENGTH"""
+    chunks = []
+    for message in messages:
+        text = message.text[:MAX_LENGTH]
+        if chunks and len(chunks[-1][0]) + len(DIGEST_SEPARATOR) + len(text) <= MAX_LENGTH:
+            chunks[-1][0] += DIGEST_SEPARATOR + text
+            chunks[-1][1].append(message)
+        else:
+            chunks.append([text, [message]])
+    return [(text, batch) for text, batch in chunks]
+
+
+@dataclass
+class DeliveryResult:
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    requests: int = 0
+    errors: list = field(default_factory=list)
+
+
+class NotificationWorker:
+    """Один проход по очереди: ``run_once``; воркер держит сессию и лимитер между проходами"""
+
+    def __init__(self, workers=4, batch_size=BATCH_SIZE, client=None, limiter=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.client = client or TelegramClient(pool_size=workers)
+        self.limiter = limiter or RateLimiter()
+
+    def claim(self):
+        """Забирает пачку подошедших сообщений; каждое достанется только одному воркеру"""
+        now = timezone.now()
+        due = (TelegramMessage.objects
+               .filter(Q(status='pending', next_attempt_at__lte=now)
+                       | Q(status='sending', claimed_at__lt=now - timedelta(seconds=STALE_AFTER)))
+               .order_by('next_attempt_at', 'id').values_list('pk', flat=True)[:self.batch_size])
+        due = list(due)
+        token = uuid.uuid4().hex
+        # Условие повторяется в UPDATE: строку, которую между SELECT и UPDATE
+        # забрал другой воркер, этот уже не захватит
+        TelegramMessage.objects.filter(
+            Q(status='pending') | Q(status='sending', claimed_at__lt=now - timedelta(seconds=STALE_AFTER)),
+            pk__in=due,
+        ).update(status='sending', claim=token, claimed_at=now)
+        return list(TelegramMessage.objects.filter(pk__in=due, claim=token).order_by('created_at', 'id'))
+
+    def run_once(self):
+        messages = self.claim()
+        result = DeliveryResult()
+        if not messages:
+            return result
+        by_chat = {}
+        for message in messages:
+            by_chat.setdefault(message.chat_id, []).append(message)
+        # В потоках только HTTP: сводки одного чата уходят по порядку, разные чаты — параллельно.
+        # Статусы пишутся здесь, в основном потоке, несколькими UPDATE на всю пачку
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(by_chat))) as pool:
+            chats = list(pool.map(lambda item: self.deliver_chat(*item), by_chat.items()))
+        outcomes = [outcome for chat, _ in chats for outcome in chat]
+
+        sent = [m.pk for batch, error in outcomes if error is None for m in batch]
+        if sent:
+            TelegramMessage.objects.filter(pk__in=sent).update(
+                status='sent', sent_at=timezone.now(), claim='', last_error='')
+        result.sent = len(sent)
+        result.requests = sum(requests for _, requests in chats)
+        for batch, error in outcomes:
+            if error is not None:
+                self.mark_failed(batch, error, result)
+        return result
+
+    def deliver_chat(self, chat_id, messages):
+        """Отправляет сводки одного чата -> ([(сообщения, ошибка или None)], число запросов)"""
+        outcomes = []
+        requests = 0
+        wait = None
+        for text, batch in digests(messages):
+            if wait is not None:
+                # Telegram попросил подождать — остальное в этот чат тоже откладывается
+                outcomes.append((batch, wait))
+                continue
+            if len(batch) > 1:
+                text = f"📬 Уведомлений: {len(batch)}{DIGEST_SEPARATOR}{text}"[:MAX_LENGTH]
+            self.limiter.wait(chat_id)
+            requests += 1
+            try:
+                self.client.send(chat_id, text)
+            except TelegramError as e:
+                if not e.retry and len(batch) > 1:
+                    # Сводку отклонил один кривой текст — отправляем по одному,
+                    # чтобы недоставленным оказался только он
+                    outcomes.extend(self.deliver_each(chat_id, batch))
+                    requests += len(batch)
+                    continue
+                outcomes.append((batch, e))
+                if e.retry_after:
+                    wait = e
+            else:
+                outcomes.append((batch, None))
+        return outcomes, requests
+
+    def deliver_each(self, chat_id, messages):
+        outcomes = []
+        for message in messages:
+            self.limiter.wait(chat_id)
+            try:
+                self.client.send(chat_id, message.text[:MAX_LENGTH])
+            except TelegramError as e:
+                outcomes.append(([message], e))
+            else:
+                outcomes.append(([message], None))
+        return outcomes
+
+    def mark_failed(self, batch, error, result):
+        attempts = max(m.attempts for m in batch) + 1
+        ids = [m.pk for m in batch]
+        result.errors.append(str(error))
+        if not error.retry or attempts >= MAX_ATTEMPTS:
+            TelegramMessage.objects.filter(pk__in=ids).update(
+                status='failed', attempts=F('attempts') + 1, claim='', last_error=str(error))
+            result.failed += len(batch)
+            return
+        delay = error.retry_after or min(BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+        TelegramMessage.objects.filter(pk__in=ids).update(
+            status='pending', attempts=F('attempts') + 1, claim='', last_error=str(error),
+            next_attempt_at=timezone.now() + timedelta(seconds=delay))
+        result.retried += len(batch)
@@ -0,0 +1,164 @@
+"""Оформление заказа из корзины, массовое подтверждение и отмена заказов.
+
+Оформление (``place_order``) — одна транзакция с числом запросов, не
+зависящим от размера корзины: позиции читаются вместе с товарами одним
+запросом, позиции заказа с ценами на момент заказа вставляются одним
+``bulk_create``, сумма считается один раз по уже загруженным строкам,
+корзина удаляется вместе с позициями. Если что-то упало, не остаётся ни
+полузаполненного заказа, ни потерянной корзины. Резерв товара
+(``reservations``) переходит от корзины к заказу; подтверждение
+превращает его в списание, отмена — снимает.
+
+Массовые действия в админке обрабатывают всю выборку в одной транзакции
+несколькими запросами на все заказы сразу: позиции читаются одним запросом, потребность в
+каждом товаре суммируется, остатки меняются одним условным UPDATE
+(``Order._change_stock``), статусы — одним UPDATE. Заказы, на которые не
+хватает товара, пропускаются (остальные подтверждаются), причина
+пропуска возвращается для каждого. В той же транзакции в очередь Telegram
+ставится одно сводное уведомление вместо сообщения на каждый заказ.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from html import escape
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import reservations
+from .models import Cart, CartItem, Order, OrderItem, Product
+
+
+@dataclass
+class BulkResult:
+    status: str
+    changed: list = field(default_factory=list)
+    # id заказа -> причина пропуска
+    skipped: dict = field(default_factory=dict)
+
+    def summary(self):
+        title = {'confirmed': '✅ Подтверждено заказов', 'cancelled': '❌ Отменено заказов'}[self.status]
+        lines = [f"{title}: {len(self.changed)}"]
+        if self.changed:
+            lines.append(', '.join(f"#{pk}" for pk in self.changed))
+        if self.skipped:
+            lines.append(f"Пропущено: {len(self.skipped)}")
+            # В причинах названия товаров, а сообщение уходит в Telegram как HTML
+            lines.extend(f"#{pk}: {escape(reason)}" for pk, reason in self.skipped.items())
+        return '\n'.join(lines)
+
+
+def place_order(cart, customer, contact_phone='', delivery_address='', comment=''):
+    """Создаёт заказ из корзины ``cart`` и удаляет корзину; пустая корзина — ValidationError"""
+    with transaction.atomic():
+        # Повторная отправка формы ждёт здесь и увидит уже пустую корзину
+        lines = list(CartItem.objects.select_for_update(of=('self',)).filter(cart=cart)
+                     .select_related('product').order_by('id'))
+        if not lines:
+            raise ValidationError('Корзина пуста')
+        # Резерв корзины доводится до её позиций и переходит к заказу;
+        # если товара уже нет, заказ не создаётся
+        reservations.reserve_cart(cart, lines)
+
+        order = Order.objects.create(
+            customer=customer,
+            contact_phone=contact_phone,
+            delivery_address=delivery_address,
+            comment=comment,
+            status='new',
+            total_amount=sum(line.product.price * line.quantity for line in lines),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=line.product, quantity=line.quantity, price=line.product.price)
+            for line in lines
+        ])
+        reservations.assign_to_order(cart, order)
+        Cart.objects.filter(pk=cart.pk).delete()
+        order._send_new_order_notification(sum(line.quantity for line in lines))
+    return order
+
+
+def _lines(order_ids):
+    """{id заказа: {id товара: количество}} одним запросом"""
+    lines = defaultdict(lambda: defaultdict(int))
+    for order_id, product_id, quantity in (OrderItem.objects.filter(order__in=order_ids)
+                                           .values_list('order', 'product', 'quantity')):
+        lines[order_id][product_id] += quantity
+    return lines
+
+
+def _total(lines, order_ids):
+    total = defaultdict(int)
+    for order_id in order_ids:
+        for product_id, quantity in lines[order_id].items():
+            total[product_id] += quantity
+    return total
+
+
+def _skip_other_statuses(orders, allowed, result):
+    for pk, status in orders:
+        if status not in allowed:
+            result.skipped[pk] = f"статус «{dict(Order.STATUS_CHOICES)[status]}»"
+    return [(pk, status) for pk, status in orders if status in allowed]
+
+
+def bulk_confirm(order_ids, admin_comment=''):
+    """Подтверждает новые заказы из ``order_ids``, начиная со старых, пока хватает товара"""
+    result = BulkResult('confirmed')
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk')
+                      .values_list('pk', 'status'))
+        orders = _skip_other_statuses(orders, ('new',), result)
+        lines = _lines([pk for pk, _ in orders])
+        held = reservations.held_by_orders([pk for pk, _ in orders])
+        needed = _total(lines, [pk for pk, _ in orders])
+        products = {pk: (name, quantity - reserved) for pk, name, quantity, reserved in
+                    Product.objects.select_for_update().filter(pk__in=needed).order_by('pk')
+                    .values_list('pk', 'name', 'quantity', 'reserved')}
+
+        # Свободный остаток; свой резерв заказа добавляется к нему при проверке
+        stock = {pk: free for pk, (_, free) in products.items()}
+        for pk, _ in orders:
+            own = held[pk]
+            short = [f"'{products[product_id][0]}' (осталось {max(stock[product_id] + own.get(product_id, 0), 0)}, "
+                     f"нужно {quantity})"
+                     for product_id, quantity in lines[pk].items()
+                     if stock[product_id] + own.get(product_id, 0) < quantity]
+            if short:
+                result.skipped[pk] = f"недостаточно товара: {', '.join(short)}"
+                continue
+            for product_id, quantity in lines[pk].items():
+                stock[product_id] -= quantity - own.get(product_id, 0)
+            result.changed.append(pk)
+
+        _apply(result, lines, admin_comment, take=True, held=held)
+    return result
+
+
+def bulk_cancel(order_ids, admin_comment=''):
+    """Отменяет новые и подтверждённые заказы; товар подтверждённых возвращается на склад"""
+    result = BulkResult('cancelled')
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk')
+                      .values_list('pk', 'status'))
+        orders = _skip_other_statuses(orders, ('new', 'confirmed'), result)
+        result.changed = [pk for pk, _ in orders]
+        confirmed = [pk for pk, status in orders if status == 'confirmed']
+        _apply(result, _lines(confirmed), admin_comment, take=False, stock_orders=confirmed)
+    return result
+
+
+def _apply(result, lines, admin_comment, take, stock_orders=None, held=None):
+    """Меняет остатки, резервы и статусы заказов ``result.changed`` и ставит сводное уведомление"""
+    if not result.changed:
+        return
+    if take:
+        Order._change_stock(_total(lines, result.changed), take=True, held=_total(held, result.changed))
+        reservations.consume(result.changed)
+    else:
+        Order._change_stock(_total(lines, stock_orders), take=False)
+        reservations.release_orders(result.changed)
+    Order.objects.filter(pk__in=result.changed).update(
+        status=result.status, admin_comment=admin_comment, updated_at=timezone.now(),
+    )
+    Order._send_telegram_message(result.summary())
@@ -0,0 +1,75 @@
+"""Keyset-пагинация («следующие после такого-то») для списков товаров.
+
+Страница выбирается условием по ``(created_at, id)`` последнего
+показанного товара, а не OFFSET: по индексу это всегда короткий
+диапазон, и сотая страница стоит столько же, сколько первая. Курсор —
+непрозрачная строка для URL (``?after=…``).
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+PAGE_SIZE = 24
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(product):
+    raw = f"{product.created_at.isoformat()}|{product.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Курсор -> (created_at, id); InvalidCursor для испорченной строки"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        created_at = datetime.fromisoformat(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+    if created_at.tzinfo is None:
+        raise InvalidCursor(cursor)
+    return created_at, pk
+
+
+class KeysetPage:
+    """Страница товаров от новых к старым после курсора ``after``.
+
+    Запрос выполняется лениво — при первом обращении к ``items`` или
+    ``next_cursor``, поэтому закэшированный фрагмент его не делает.
+    """
+
+    def __init__(self, queryset, after=None, size=PAGE_SIZE):
+        self.queryset = queryset.order_by('-created_at', '-id')
+        self.after = after
+        self.size = size
+        if after:
+            created_at, pk = decode_cursor(after)
+            # Отдельное created_at <= … даёт границу диапазона по индексу,
+            # OR-условие само по себе SQLite так не использует
+            self.queryset = self.queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+                created_at__lte=created_at,
+            )
+
+    @cached_property
+    def _rows(self):
+        # Лишняя строка показывает, есть ли следующая страница
+        return list(self.queryset[:self.size + 1])
+
+    @property
+    def items(self):
+        return self._rows[:self.size]
+
+    @property
+    def has_next(self):
+        return len(self._rows) > self.size
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.items[-1]) if self.has_next else None
@@ -0,0 +1,167 @@
+"""Рекомендации на странице товара: «покупают вместе» и товары той же категории.
+
+Пакетное задание (``manage.py build_recommendations``) берёт заказы,
+появившиеся после прошлого запуска (``RecommendationRun.last_order_id``),
+считает совместные покупки одним self-merge в pandas и прибавляет их к
+накопленным счётчикам ``ProductPair``. Затем только для товаров из новых
+заказов пересобирает ``ProductRelation``: сначала самые частые пары,
+свободные места — новинки той же категории. Счётчики каждой пачки
+заказов записываются в одной транзакции с отметкой ``last_order_id``,
+поэтому после падения повторный запуск продолжает с неё и ничего не
+считает дважды.
+
+Заказы, отменённые к моменту запуска, не учитываются. Заказ, отменённый
+позже, из счётчиков не вычитается — их выправит ``--full``.
+
+Страница товара читает готовые строки одним запросом по индексу
+``(product, position)``. Если товар ещё не пересчитывался, показываются
+новинки категории, как раньше.
+"""
+import pandas as pd
+from django.db import transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils.functional import SimpleLazyObject
+
+from . import catalog_cache
+from .models import OrderItem, Product, ProductPair, ProductRelation, RecommendationRun
+
+# Строк на товар: с запасом на товары, скрытые после пересчёта
+RELATION_LIMIT = 8
+SHOWN = 4
+BATCH_SIZE = 1000
+
+
+def count_pairs(lines):
+    """(заказ, товар) -> DataFrame(product, other, count): в скольких заказах были оба"""
+    lines = pd.DataFrame(lines, columns=['order', 'product']).drop_duplicates()
+    pairs = lines.merge(lines, on='order', suffixes=('', '_other'))
+    pairs = pairs[pairs['product'] != pairs['product_other']]
+    return (pairs.groupby(['product', 'product_other']).size()
+            .reset_index(name='count').rename(columns={'product_other': 'other'}))
+
+
+def add_pair_counts(counts):
+    """Прибавляет ``counts`` к сохранённым счётчикам ``ProductPair``"""
+    if counts.empty:
+        return 0
+    existing = pd.DataFrame(
+        ProductPair.objects.filter(product__in=counts['product'].unique().tolist())
+        .values_list('product', 'other', 'count'),
+        columns=['product', 'other', 'stored'],
+    )
+    merged = counts.merge(existing, how='left', on=['product', 'other'])
+    merged['count'] += merged['stored'].fillna(0).astype(int)
+    ProductPair.objects.bulk_create(
+        [ProductPair(product_id=product, other_id=other, count=count)
+         for product, other, count in merged[['product', 'other', 'count']].itertuples(index=False)],
+        update_conflicts=True, unique_fields=['product', 'other'], update_fields=['count'], batch_size=500,
+    )
+    return len(merged)
+
+
+def category_candidates(category_ids):
+    """{категория: [новинки на витрине]} — одним запросом с оконной функцией"""
+    rows = (
+        Product.objects.filter(category__in=category_ids, is_active=True, quantity__gt=0)
+        .annotate(rank=Window(RowNumber(), partition_by=F('category'), order_by=[F('created_at').desc(), F('id').desc()]))
+        .filter(rank__lte=RELATION_LIMIT + 1)
+        .order_by('category', 'rank')
+        .values_list('category', 'id')
+    )
+    candidates = {}
+    for category_id, pk in rows:
+        candidates.setdefault(category_id, []).append(pk)
+    return candidates
+
+
+def refresh_relations(product_ids):
+    """Пересобирает ``ProductRelation`` для товаров ``product_ids``"""
+    product_ids = list(product_ids)
+    categories = dict(Product.objects.filter(pk__in=product_ids).values_list('id', 'category_id'))
+    together = {}
+    pairs = (ProductPair.objects.filter(product__in=categories, other__is_active=True)
+             .order_by('product', '-count', 'other').values_list('product', 'other', 'count'))
+    for product_id, other_id, count in pairs:
+        together.setdefault(product_id, [])
+        if len(together[product_id]) < RELATION_LIMIT:
+            together[product_id].append((other_id, count))
+    fallback = category_candidates(set(categories.values()))
+
+    relations = []
+    for product_id, category_id in categories.items():
+        chosen = [(other_id, count, 'together') for other_id, count in together.get(product_id, [])]
+        taken = {product_id, *(other_id for other_id, _, _ in chosen)}
+        for other_id in fallback.get(category_id, []):
+            if len(chosen) >= RELATION_LIMIT:
+                break
+            if other_id not in taken:
+                chosen.append((other_id, 0, 'category'))
+                taken.add(other_id)
+        relations.extend(
+            ProductRelation(product_id=product_id, related_id=other_id, position=position, score=score,
+                            source=source)
+            for position, (other_id, score, source) in enumerate(chosen)
+        )
+    with transaction.atomic():
+        ProductRelation.objects.filter(product__in=categories).delete()
+        ProductRelation.objects.bulk_create(relations, batch_size=500)
+    for product_id in categories:
+        catalog_cache.bump(f'product:{product_id}')
+    return len(categories)
+
+
+def build_recommendations(full=False, batch_size=BATCH_SIZE):
+    """Учитывает новые заказы и пересобирает рекомендации затронутых товаров.
+
+    ``full`` — пересчитать всё с нуля: счётчики по всей истории и
+    рекомендации для всех активных товаров (в том числе без заказов).
+    """
+    last = RecommendationRun.objects.order_by('-id').values_list('last_order_id', flat=True).first() or 0
+    run = RecommendationRun(last_order_id=last, full=full)
+    with transaction.atomic():
+        if full:
+            ProductPair.objects.all().delete()
+            run.last_order_id = last = 0
+        run.save()
+    upper = OrderItem.objects.aggregate(last=Max('order_id'))['last'] or last
+
+    touched = set()
+    lines = OrderItem.objects.filter(order_id__gt=last, order_id__lte=upper).exclude(order__status='cancelled')
+    for start in range(last, upper, batch_size):
+        end = min(start + batch_size, upper)
+        batch = list(lines.filter(order_id__gt=start, order_id__lte=end).values_list('order_id', 'product_id'))
+        if not batch:
+            continue
+        counts = count_pairs(batch)
+        with transaction.atomic():
+            run.pairs += add_pair_counts(counts)
+            run.orders += len({order_id for order_id, _ in batch})
+            run.last_order_id = end
+            run.save(update_fields=['last_order_id', 'orders', 'pairs'])
+        touched.update(counts['product'].tolist())
+    run.last_order_id = max(last, upper)
+
+    if full:
+        touched = set(Product.objects.filter(is_active=True).values_list('id', flat=True))
+    touched = sorted(touched)
+    for start in range(0, len(touched), batch_size):
+        run.products += refresh_relations(touched[start:start + batch_size])
+    run.save()
+    return run
+
+
+def related_products(product, limit=SHOWN):
+    """Рекомендации для страницы товара; запрос выполняется при первом обращении"""
+    def load():
+        related = [
+            relation.related for relation in
+            ProductRelation.objects.filter(product=product, related__is_active=True)
+            .select_related('related').order_by('position')[:limit]
+        ]
+        if related:
+            return related
+        return list(Product.objects.filter(category_id=product.category_id, is_active=True)
+                    .exclude(id=product.pk)[:limit])
+
+    return SimpleLazyObject(load)
@@ -0,0 +1,225 @@
+"""Резерв товара под корзины и оформленные заказы.
+
+Добавление в корзину и начало оформления резервируют товар: строка
+``StockReservation`` плюс счётчик ``Product.reserved``, который меняется
+условным UPDATE (``quantity >= reserved + N``) в той же транзакции. Два
+покупателя не могут зарезервировать одну и ту же последнюю штуку, а
+доступный остаток (``Product.available_quantity``) читается из строки
+товара без суммирования резервов.
+
+Резерв корзины живёт ``TTL`` секунд с последнего изменения корзины.
+Просроченные снимает пачками ``manage.py sweep_reservations``; если товара
+не хватает из-за просроченных, но ещё не снятых резервов, они снимаются
+сразу. При оформлении резерв переходит к заказу и держится без срока:
+при подтверждении заказа он превращается в списание со склада
+(``Order._change_stock``), при отмене снимается.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, When
+from django.utils import timezone
+
+from . import catalog_cache, facets
+from .models import Product, StockReservation
+
+TTL = 30 * 60
+BATCH_SIZE = 500
+
+
+def _shift(deltas, condition=None):
+    """Меняет ``Product.reserved`` на {id товара: изменение} одним UPDATE; возвращает число строк"""
+    if not deltas:
+        return 0
+    updated = Product.objects.filter(Q(pk__in=deltas) if condition is None else condition).update(
+        reserved=Case(*[When(pk=pk, then=F('reserved') + delta) for pk, delta in deltas.items()],
+                      output_field=IntegerField()),
+    )
+    if updated:
+        # UPDATE не шлёт сигналов: «Осталось N шт.» в кэше витрины и фильтр наличия обновляем сами
+        transaction.on_commit(lambda deltas=dict(deltas): _refresh(deltas))
+    return updated
+
+
+def _refresh(deltas):
+    """После коммита: сбрасывает кэш товаров; если свободный остаток кончился или появился — и фильтр наличия"""
+    crossed = set()
+    rows = Product.objects.filter(pk__in=deltas).values_list('pk', 'category_id', F('quantity') - F('reserved'))
+    for pk, category_id, free in rows:
+        catalog_cache.bump_product(pk, category_id)
+        # До изменения свободно было на delta больше
+        if (free > 0) != (free + deltas[pk] > 0):
+            crossed.add(category_id)
+    if crossed:
+        with transaction.atomic():
+            facets.refresh_facets(crossed)
+
+
+def _take(wanted):
+    """Резервирует {id товара: количество}; если хоть чего-то не хватает — ValidationError и откат"""
+    condition = Q()
+    for pk, quantity in wanted.items():
+        condition |= Q(pk=pk, is_active=True, quantity__gte=F('reserved') + quantity)
+    with transaction.atomic():
+        if _shift(wanted, condition) == len(wanted):
+            return
+        short = [f"'{name}' (доступно: {max(quantity - reserved, 0) if is_active else 0}, нужно {wanted[pk]})"
+                 for pk, name, quantity, reserved, is_active in Product.objects.filter(pk__in=wanted)
+                 .order_by('pk').values_list('pk', 'name', 'quantity', 'reserved', 'is_active')
+                 if not is_active or quantity - reserved < wanted[pk]]
+        raise ValidationError(f"Недостаточно товара: {', '.join(short)}")
+
+
+def _take_or_expire(wanted, cart):
+    """``_take``; при нехватке сначала снимает просроченные резервы других корзин и пробует ещё раз"""
+    try:
+        _take(wanted)
+    except ValidationError:
+        expired = StockReservation.objects.filter(product__in=wanted, expires_at__lt=timezone.now()).exclude(cart=cart)
+        if not _release(expired):
+            raise
+        _take(wanted)
+
+
+def _release(reservations):
+    """Удаляет резервы и возвращает их количество в свободный остаток; возвращает число резервов"""
+    with transaction.atomic():
+        rows = list(reservations.select_for_update().values_list('pk', 'product', 'quantity'))
+        if not rows:
+            return 0
+        deltas = defaultdict(int)
+        for _, product_id, quantity in rows:
+            deltas[product_id] -= quantity
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        _shift(deltas)
+    return len(rows)
+
+
+def _extend(cart):
+    StockReservation.objects.filter(cart=cart).update(expires_at=timezone.now() + timedelta(seconds=TTL))
+
+
+def reserve(cart, product, delta):
+    """Меняет резерв корзины на товар на ``delta`` штук (меньше нуля — снимает); не хватает — ValidationError"""
+    if not delta:
+        return
+    with transaction.atomic():
+        current = StockReservation.objects.select_for_update().filter(cart=cart, product=product).first()
+        if delta > 0:
+            _take_or_expire({product.pk: delta}, cart)
+            if current is None:
+                StockReservation.objects.create(cart=cart, product=product, quantity=delta)
+            else:
+                StockReservation.objects.filter(pk=current.pk).update(quantity=F('quantity') + delta)
+        elif current is not None:
+            # Снять можно не больше, чем было зарезервировано (резерв мог истечь)
+            delta = max(delta, -current.quantity)
+            if current.quantity + delta:
+                StockReservation.objects.filter(pk=current.pk).update(quantity=F('quantity') + delta)
+            else:
+                StockReservation.objects.filter(pk=current.pk).delete()
+            _shift({product.pk: delta})
+        # Корзина жива — продлеваем весь её резерв
+        _extend(cart)
+
+
+def hold(cart, product, quantity):
+    """Доводит резерв корзины на товар до ``quantity`` штук (для правок позиции в обход витрины)"""
+    with transaction.atomic():
+        held = (StockReservation.objects.filter(cart=cart, product=product)
+                .values_list('quantity', flat=True).first() or 0)
+        reserve(cart, product, quantity - held)
+
+
+def reserve_cart(cart, lines):
+    """Доводит резерв корзины до позиций ``lines`` и продлевает его; не хватает — ValidationError по всем позициям.
+
+    Число запросов не зависит от числа позиций.
+    """
+    wanted = defaultdict(int)
+    for line in lines:
+        wanted[line.product_id] += line.quantity
+    with transaction.atomic():
+        held = dict(StockReservation.objects.select_for_update().filter(cart=cart)
+                    .values_list('product', 'quantity'))
+        grow = {pk: quantity - held.get(pk, 0) for pk, quantity in wanted.items() if quantity > held.get(pk, 0)}
+        if grow:
+            _take_or_expire(grow, cart)
+        # Лишний резерв (позицию убрали или уменьшили в обход корзины) возвращаем
+        shrink = {pk: wanted.get(pk, 0) - quantity for pk, quantity in held.items() if quantity > wanted.get(pk, 0)}
+        _shift(shrink)
+        gone = [pk for pk in held if pk not in wanted]
+        if gone:
+            StockReservation.objects.filter(cart=cart, product__in=gone).delete()
+        expires_at = timezone.now() + timedelta(seconds=TTL)
+        StockReservation.objects.bulk_create(
+            [StockReservation(cart=cart, product_id=pk, quantity=quantity, expires_at=expires_at)
+             for pk, quantity in wanted.items()],
+            update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity', 'expires_at'],
+        )
+
+
+def assign_to_order(cart, order):
+    """Передаёт резерв корзины оформленному заказу (без срока) одним UPDATE"""
+    StockReservation.objects.filter(cart=cart).update(cart=None, order=order, expires_at=None)
+
+
+def held_by_orders(order_ids):
+    """{id заказа: {id товара: зарезервировано}} одним запросом"""
+    held = defaultdict(dict)
+    for order_id, product_id, quantity in (StockReservation.objects.filter(order__in=order_ids)
+                                           .values_list('order', 'product', 'quantity')):
+        held[order_id][product_id] = quantity
+    return held
+
+
+def consume(order_ids):
+    """Удаляет резерв подтверждённых заказов: счётчик уже уменьшил ``Order._change_stock``"""
+    StockReservation.objects.filter(order__in=order_ids).delete()
+
+
+def release_cart(cart):
+    return _release(StockReservation.objects.filter(cart=cart))
+
+
+def release_orders(order_ids):
+    return _release(StockReservation.objects.filter(order__in=order_ids))
+
+
+def sweep(batch_size=BATCH_SIZE):
+    """Снимает просроченные резервы корзин пачками по ``batch_size``; возвращает число снятых"""
+    total = 0
+    now = timezone.now()
+    while True:
+        with transaction.atomic():
+            rows = list(StockReservation.objects.select_for_update()
+                        .filter(expires_at__lt=now).order_by('expires_at')
+                        .values_list('pk', 'product', 'quantity')[:batch_size])
+            if not rows:
+                return total
+            # Условие повторяется в DELETE: резерв, который успели продлить, остаётся
+            deleted, _ = StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows], expires_at__lt=now).delete()
+            if deleted != len(rows):
+                transaction.set_rollback(True)
+                continue
+            deltas = defaultdict(int)
+            for _, product_id, quantity in rows:
+                deltas[product_id] -= quantity
+            _shift(deltas)
+        total += len(rows)
+
+
+def recount(dry_run=False):
+    """Сверяет ``Product.reserved`` со строками резервов; возвращает {id товара: (было, стало)}"""
+    real = dict(StockReservation.objects.order_by().values('product').annotate(total=Sum('quantity'))
+                .values_list('product', 'total'))
+    drifted = {
+        pk: (reserved, real.get(pk, 0))
+        for pk, reserved in Product.objects.filter(Q(reserved__gt=0) | Q(pk__in=real)).values_list('pk', 'reserved')
+        if reserved != real.get(pk, 0)
+    }
+    if not dry_run:
+        _shift({pk: right - wrong for pk, (wrong, right) in drifted.items()})
+    return drifted
@@ -0,0 +1,270 @@
+"""Полнотекстовый поиск по товарам.
+
+На SQLite — виртуальная таблица FTS5 ``shop_product_search`` (rowid =
+id товара) с полями названия, краткого описания, описания и категории.
+В неё пишется уже нормализованный текст: слова в нижнем регистре,
+обрезанные русским стеммером Snowball (``stem``), поэтому «томаты»,
+«томатов» и «томат» находят друг друга. Запрос стеммится так же, каждое
+слово ищется как префикс, результаты упорядочены по bm25 с весами полей.
+
+Индекс содержит только активные товары и обновляется сигналами
+(``signals.py``) и импортом после каждой пачки; полностью перестроить —
+``manage.py rebuild_search_index``.
+
+На PostgreSQL вместо FTS5 используется ``tsvector`` с конфигурацией
+``russian`` и GIN-индексом по тому же выражению (миграция 0011);
+синхронизировать ничего не нужно.
+"""
+import re
+from functools import lru_cache
+
+from django.db import connection
+
+from .models import Product
+
+TABLE = 'shop_product_search'
+# Веса bm25: название, краткое описание, описание, категория
+WEIGHTS = (10.0, 4.0, 1.0, 2.0)
+PAGE_SIZE = 20
+BATCH_SIZE = 500
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# --- Стеммер Snowball для русского языка ---------------------------------
+
+VOWELS = set('аеиоуыэюя')
+
+def _by_length(*suffixes):
+    """Окончания от длинных к коротким: ``_longest`` берёт первое подошедшее"""
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+PERFECTIVE_GERUND = (_by_length('в', 'вши', 'вшись'), _by_length('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = _by_length('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+                       'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (_by_length('ем', 'нн', 'вш', 'ющ', 'щ'), _by_length('ивш', 'ывш', 'ующ'))
+REFLEXIVE = _by_length('ся', 'сь')
+VERB = (_by_length('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть',
+                   'ешь', 'нно'),
+        _by_length('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым',
+                   'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую',
+                   'ю'))
+NOUN = _by_length('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой',
+                  'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию',
+                  'ью', 'ю', 'ия', 'ья', 'я')
+SUPERLATIVE = _by_length('ейш', 'ейше')
+DERIVATIONAL = _by_length('ост', 'ость')
+
+
+def _regions(word):
+    """Начала областей RV и R2 по правилам Snowball"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _longest(word, start, suffixes):
+    """Самое длинное окончание из ``suffixes`` (уже по убыванию длины), целиком лежащее после ``start``"""
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= start:
+            return suffix
+    return None
+
+
+def _remove_grouped(word, start, groups):
+    """Окончания первой группы отрезаются только после «а»/«я»"""
+    preceded, plain = groups
+    candidates = []
+    suffix = _longest(word, start + 1, preceded)
+    if suffix and word[-len(suffix) - 1] in 'ая':
+        candidates.append(suffix)
+    suffix = _longest(word, start, plain)
+    if suffix:
+        candidates.append(suffix)
+    if not candidates:
+        return None
+    return word[:-len(max(candidates, key=len))]
+
+
+# Словарь товаров невелик: при импорте одни и те же слова повторяются тысячи раз
+@lru_cache(maxsize=100_000)
+def stem(word):
+    """Основа русского слова (алгоритм Snowball); прочие слова — как есть"""
+    word = word.lower().replace('ё', 'е')
+    if not re.search('[а-я]', word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    stripped = _remove_grouped(word, rv, PERFECTIVE_GERUND)
+    if stripped is not None:
+        word = stripped
+    else:
+        suffix = _longest(word, rv, REFLEXIVE)
+        if suffix:
+            word = word[:-len(suffix)]
+        suffix = _longest(word, rv, ADJECTIVE)
+        if suffix:
+            word = word[:-len(suffix)]
+            stripped = _remove_grouped(word, rv, PARTICIPLE)
+            if stripped is not None:
+                word = stripped
+        else:
+            stripped = _remove_grouped(word, rv, VERB)
+            if stripped is not None:
+                word = stripped
+            else:
+                suffix = _longest(word, rv, NOUN)
+                if suffix:
+                    word = word[:-len(suffix)]
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    suffix = _longest(word, r2, DERIVATIONAL)
+    if suffix:
+        word = word[:-len(suffix)]
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        return word[:-1]
+    suffix = _longest(word, rv, SUPERLATIVE)
+    if suffix:
+        word = word[:-len(suffix)]
+        if word.endswith('нн') and len(word) - 2 >= rv:
+            word = word[:-1]
+        return word
+    if word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def normalize(text):
+    """Текст -> основы слов через пробел (так они лежат в индексе)"""
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def build_match(query):
+    """Строка запроса пользователя -> выражение MATCH для FTS5 (все слова, по префиксу)"""
+    stems = [stem(word) for word in WORD_RE.findall(query)]
+    return ' '.join(f'"{term}" *' for term in stems if term)
+
+
+# --- Синхронизация индекса ----------------------------------------------
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def index_products(ids):
+    """Переписывает строки индекса для товаров ``ids`` (неактивные — удаляет)"""
+    if not uses_fts():
+        return
+    ids = list(ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({placeholders})', batch)
+            rows = Product.objects.filter(pk__in=batch, is_active=True).values_list(
+                'id', 'name', 'short_description', 'description', 'category__name')
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, name, short_description, description, category) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                [(pk, *(normalize(value) for value in values)) for pk, *values in rows],
+            )
+
+
+def remove_products(ids):
+    if not uses_fts():
+        return
+    ids = list(ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def rebuild_index():
+    """Полностью перестраивает индекс; возвращает число проиндексированных товаров"""
+    if not uses_fts():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    ids = list(Product.objects.filter(is_active=True).values_list('id', flat=True).order_by('id'))
+    index_products(ids)
+    return len(ids)
+
+
+# --- Поиск ---------------------------------------------------------------
+
+def _search_ids_fts(query, offset, limit):
+    match = build_match(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s '
+            f'ORDER BY bm25({TABLE}, {", ".join(str(w) for w in WEIGHTS)}) LIMIT %s OFFSET %s',
+            [match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_ids_postgres(query, offset, limit):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    search_query = SearchQuery(query, config='russian', search_type='websearch')
+    # То же выражение, что в GIN-индексе миграции 0011
+    document = SearchVector('name', 'short_description', 'description', config='russian')
+    weighted = (SearchVector('name', weight='A', config='russian')
+                + SearchVector('short_description', weight='B', config='russian')
+                + SearchVector('category__name', weight='B', config='russian')
+                + SearchVector('description', weight='C', config='russian'))
+    return list(
+        Product.objects.annotate(document=document)
+        .filter(document=search_query, is_active=True)
+        .annotate(rank=SearchRank(weighted, search_query))
+        .order_by('-rank', 'id')
+        .values_list('id', flat=True)[offset:offset + limit]
+    )
+
+
+def _search_ids_fallback(query, offset, limit):
+    from django.db.models import Q
+
+    condition = Q()
+    for word in WORD_RE.findall(query):
+        condition &= Q(name__icontains=word) | Q(description__icontains=word)
+    return list(Product.objects.filter(condition, is_active=True)
+                .order_by('-created_at', '-id').values_list('id', flat=True)[offset:offset + limit])
+
+
+def search_products(query, page=1, size=PAGE_SIZE):
+    """Страница результатов: (товары по релевантности, есть ли следующая страница)"""
+    if not WORD_RE.search(query or ''):
+        return [], False
+    offset = (page - 1) * size
+    if uses_fts():
+        ids = _search_ids_fts(query, offset, size + 1)
+    elif connection.vendor == 'postgresql':
+        ids = _search_ids_postgres(query, offset, size + 1)
+    else:
+        ids = _search_ids_fallback(query, offset, size + 1)
+    has_next = len(ids) > size
+    ids = ids[:size]
+    products = Product.objects.select_related('category').in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products], has_next
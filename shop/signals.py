@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import catalog_cache, facets, reservations, search
+from .cart_summary import invalidate_cart_summary
+from .models import Cart, CartItem, Category, Order, Product, ProductImage
+from .thumbnails import schedule_derivatives
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def generate_image_derivatives(sender, instance, **kwargs):
+    """Превью строятся в фоне после коммита, сохранение товара их не ждёт"""
+    if instance.image:
+        name = instance.image.name
+        product_id = instance.pk if sender is Product else instance.product_id
+
+        def refresh_fragments(future):
+            # Кэшированная карточка могла запомнить оригинал вместо превью
+            if future.result():
+                catalog_cache.bump_product(product_id)
+
+        transaction.on_commit(lambda: schedule_derivatives(name).add_done_callback(refresh_fragments))
+
+
+@receiver(pre_save, sender=Product)
+def remember_old_category(sender, instance, **kwargs):
+    """Запоминает прежнюю категорию, чтобы сбросить и её сетку товаров"""
+    if instance.pk:
+        instance._old_category_id = (
+            Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reset_product_fragments(sender, instance, **kwargs):
+    catalog_cache.bump_product(instance.pk, instance.category_id)
+    old_category_id = getattr(instance, '_old_category_id', None)
+    if old_category_id and old_category_id != instance.category_id:
+        catalog_cache.bump(f'category:{old_category_id}')
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Строка поискового индекса пишется в той же транзакции, что и товар"""
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_product_facets(sender, instance, **kwargs):
+    """Счётчики фильтров категории (и прежней категории при переносе)"""
+    facets.refresh_facets({instance.category_id, getattr(instance, '_old_category_id', None)})
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def reset_product_image_fragments(sender, instance, **kwargs):
+    catalog_cache.bump(f'product:{instance.product_id}')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_catalog_fragments(sender, instance, **kwargs):
+    """Название категории выводится почти везде — сбрасываем весь каталог"""
+    catalog_cache.bump()
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    """Название категории есть в индексе каждого её товара"""
+    if not created:
+        search.index_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def reset_cart_summary(sender, instance, origin=None, **kwargs):
+    """Сводка корзины в шапке пересчитается при следующем показе"""
+    if isinstance(origin, Cart) or getattr(origin, 'model', None) is Cart:
+        # Позиция удаляется вместе с корзиной — сводку сбросит обработчик корзины,
+        # без запроса за корзиной на каждую позицию
+        return
+    if CartItem.cart.is_cached(instance):
+        cart = instance.cart
+    else:
+        # При каскадном удалении корзины её может уже не быть — тогда сработает
+        # обработчик удаления самой корзины
+        cart = Cart.objects.filter(pk=instance.cart_id).first()
+    if cart is not None:
+        invalidate_cart_summary(cart)
+
+
+@receiver(post_delete, sender=Cart)
+def reset_deleted_cart_summary(sender, instance, **kwargs):
+    invalidate_cart_summary(instance)
+
+
+@receiver(pre_delete, sender=Cart)
+def release_cart_reservations(sender, instance, **kwargs):
+    """Резерв удаляемой корзины возвращается в свободный остаток (каскад сам счётчик не трогает)"""
+    reservations.release_cart(instance)
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_reservations(sender, instance, **kwargs):
+    reservations.release_orders([instance.pk])
@@ -0,0 +1,76 @@
+"""Хранилище изображений товаров с адресацией по содержимому.
+
+Имя файла — SHA-256 его байтов: ``products/ab/abcdef….jpg``. Одинаковая
+картинка хранится один раз, сколько бы товаров и импортов на неё
+ни ссылалось; повторное сохранение тех же байтов ничего не пишет на диск.
+"""
+import hashlib
+import os
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+
+
+def content_hash(content):
+    """SHA-256 содержимого файла (позиция чтения возвращается в начало)"""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """``products/фото.JPG`` + хэш -> ``products/ab/<хэш>.jpg``"""
+    directory = os.path.dirname(name)
+    if os.path.basename(name)[:2] == os.path.basename(directory):
+        # Файл уже лежит в каталоге по префиксу хэша (например, дубль с суффиксом)
+        directory = os.path.dirname(directory)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, digest[:2], f"{digest}{extension}").replace('\\', '/')
+
+
+def is_hashed_name(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    parent = os.path.basename(os.path.dirname(name))
+    return len(stem) == 64 and parent == stem[:2] and all(c in '0123456789abcdef' for c in stem)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который называет файлы хэшем содержимого"""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = hashed_name(name, content_hash(content))
+        validate_file_name(name, allow_relative_path=True)
+        if max_length is not None and len(name) > max_length:
+            # Имя по хэшу не укоротить, как это делает get_available_name
+            raise SuspiciousFileOperation(
+                f'Имя файла "{name}" длиннее {max_length} символов, допустимых в поле модели'
+            )
+        if self.exists(name):
+            # Те же байты уже лежат в хранилище
+            return name
+        # При гонке двух потоков второй получит имя с суффиксом — такой дубль
+        # найдёт и уберёт manage.py cleanup_images
+        return super()._save(name, content)
+
+    def save_as(self, name, content):
+        """Сохраняет файл ровно под именем ``name`` (для производных файлов вроде превью)"""
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+image_storage = ContentAddressedStorage()
@@ -0,0 +1,44 @@
+from django import template
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+from ..catalog_cache import FRAGMENT_TIMEOUT, record
+
+register = template.Library()
+
+# Вместо CSRF-токена в кэш кладётся заглушка, при выдаче — токен текущего посетителя
+CSRF_PLACEHOLDER = '__catalog_csrf_token__'
+
+
+class CatalogFragmentNode(template.Node):
+    def __init__(self, nodelist, key):
+        self.nodelist = nodelist
+        self.key = key
+
+    def render(self, context):
+        fragment = self.key.resolve(context)
+        token = context.get('csrf_token')
+        content = cache.get(fragment.key)
+        record(fragment.name, hit=content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            if token:
+                content = content.replace(str(token), CSRF_PLACEHOLDER)
+            cache.set(fragment.key, content, FRAGMENT_TIMEOUT)
+        if token and CSRF_PLACEHOLDER in content:
+            content = content.replace(CSRF_PLACEHOLDER, str(token))
+        return mark_safe(content)
+
+
+@register.tag
+def catalog_fragment(parser, token):
+    """Кэширует содержимое по ключу из ``catalog_cache.fragment_key``.
+
+    Пример: {% catalog_fragment grid_key %}…{% endcatalog_fragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' ожидает один аргумент — ключ фрагмента")
+    nodelist = parser.parse(('endcatalog_fragment',))
+    parser.delete_first_token()
+    return CatalogFragmentNode(nodelist, parser.compile_filter(bits[1]))
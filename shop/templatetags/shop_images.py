@@ -0,0 +1,46 @@
+from django import template
+from django.utils.html import format_html
+
+from ..thumbnails import image_urls
+
+register = template.Library()
+
+# Размер для экранов с двойной плотностью пикселей
+RETINA = {'thumb': 'card', 'card': 'detail'}
+
+
+@register.filter
+def image_url(image, size=None):
+    """URL картинки нужного размера (JPEG), пока превью нет — оригинал"""
+    if not image:
+        return ''
+    urls = image_urls(image, size) if size else None
+    return urls['jpg'] if urls else image.url
+
+
+@register.simple_tag
+def picture(image, size, alt='', css_class='', style=''):
+    """<picture> с WebP-источником и JPEG-запасным вариантом, srcset 1x/2x.
+
+    Пример: {% picture product.image 'card' product.name 'card-img-top' %}
+    """
+    if not image:
+        return format_html('<div class="{} bg-light" style="{}" role="img" aria-label="{}"></div>',
+                           css_class, style, alt)
+
+    urls = image_urls(image, size)
+    if urls is None:
+        return format_html('<img src="{}" class="{}" style="{}" alt="{}" loading="lazy">',
+                           image.url, css_class, style, alt)
+
+    retina = image_urls(image, RETINA[size]) if size in RETINA else None
+    srcset = dict(urls)
+    if retina:
+        srcset = {extension: f"{url} 1x, {retina[extension]} 2x" for extension, url in urls.items()}
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}" class="{}" style="{}" alt="{}" loading="lazy">'
+        '</picture>',
+        srcset['webp'], urls['jpg'], srcset['jpg'], css_class, style, alt,
+    )
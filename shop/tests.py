@@ -1,3 +1,1735 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from datetime import timedelta
+from decimal import Decimal
+
+import pandas as pd
+from openpyxl import load_workbook
+from PIL import Image
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import recommendations
+from .benchmarks import compare_results, run_in_subprocess, stage_share_violations, write_workbook
+from .cart_summary import get_cart_summary
+from .catalog_cache import check_shared_cache, stats as catalog_cache_stats
+from .image_fetcher import ImageFetcher
+from .import_jobs import claim_next_import, process_excel_import
+from .import_readers import CsvChunkReader, XlsxChunkReader
+from .importer import ProductImporter
+from .orders import bulk_cancel, bulk_confirm
+from .recommendations import build_recommendations
+from .reservations import recount, reserve, sweep
+from .search import normalize, search_products, stem
+from .models import (Cart, CartItem, Category, ChatMessage, Customer, ImageSource, Order, OrderItem, Product,
+                     ProductFacet, ProductImage, ProductImport, ProductPair, ProductRelation, StockReservation,
+                     TelegramMessage)
+from .notifications import MAX_ATTEMPTS, NotificationWorker, RateLimiter, TelegramClient
+from .storage import image_storage
+from .thumbnails import derivative_name, derivative_names, wait_pending
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    """Заглушка поставщика картинок: /ok.jpg, /missing.jpg, /flaky.jpg"""
+    hits = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            hits = self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        if self.path == '/missing.jpg' or (self.path == '/flaky.jpg' and hits == 1):
+            self.send_response(404 if self.path == '/missing.jpg' else 503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.body(self.path)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def body(path):
+        """Маленький PNG, свой для каждого пути"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (2, 2), tuple(hashlib.md5(path.encode()).digest()[:3])).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    """Заглушка Bot API: запоминает запросы, отвечает из очереди ``replies`` (по умолчанию 200)"""
+    hits = {}
+    sent = []
+    replies = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.lock:
+            self.sent.append((self.path, payload))
+            status, body = self.replies.pop(0) if self.replies else (200, {'ok': True})
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerMixin:
+    handler = StubImageHandler
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), cls.handler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.handler.hits = {}
+
+
+class ProductImporterTests(TestCase):
+    def make_frame(self, rows):
+        return pd.DataFrame(rows)
+
+    def test_bulk_import_creates_products_and_categories(self):
+        Category.objects.create(name='Семена', slug='seeds')
+        df = self.make_frame([
+            {'Название': 'Томат', 'Цена': 50, 'Категория': 'Семена', 'Количество': 10},
+            {'Название': 'Огурец', 'Цена': '45.5', 'Категория': 'Семена'},
+            {'Название': 'Лопата', 'Цена': 900, 'Старая цена': 1000, 'Категория': 'Инструмент'},
+        ])
+
+        # чтение категорий, вставка новых категорий, вставка товаров,
+        # поисковый индекс: удаление, чтение, вставка; счётчики фильтров:
+        # подсчёт, удаление, вставка (+ savepoint в тесте)
+        with self.assertNumQueries(11):
+            result = ProductImporter(download_images=False).run(df)
+
+        self.assertEqual(result.created, 3)
+        self.assertEqual(result.errors, [])
+        self.assertEqual(Category.objects.count(), 2)
+        shovel = Product.objects.get(name='Лопата')
+        self.assertEqual(shovel.category.name, 'Инструмент')
+        self.assertEqual(str(shovel.old_price), '1000.00')
+        self.assertEqual(Product.objects.get(name='Огурец').quantity, 0)
+
+    def test_invalid_rows_are_reported_with_sheet_row_numbers(self):
+        df = self.make_frame([
+            {'Название': 'Томат', 'Цена': 50},
+            {'Название': None, 'Цена': 10},
+            {'Название': 'Грабли', 'Цена': 'дорого'},
+            {'Название': 'Тяпка', 'Цена': 300, 'Количество': -1},
+        ])
+
+        result = ProductImporter(download_images=False).run(df)
+
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors, [
+            'Строка 3: не указано название',
+            "Строка 4: некорректная цена 'дорого'",
+            'Строка 5: количество не может быть отрицательным',
+        ])
+        self.assertEqual(Product.objects.get().category.name, 'Разное')
+
+    def test_missing_required_column_fails_whole_file(self):
+        with self.assertRaises(ValueError):
+            ProductImporter(download_images=False).run(self.make_frame([{'Название': 'Томат'}]))
+
+
+class UpsertImportTests(TestCase):
+    def setUp(self):
+        self.seeds = Category.objects.create(name='Семена', slug='seeds')
+        self.tomato = Product.objects.create(name='Томат', sku='T-1', price=50, quantity=5,
+                                             description='Красный', category=self.seeds)
+        self.cucumber = Product.objects.create(name='Огурец', price=40, quantity=3,
+                                               description='', category=self.seeds)
+        self.pepper = Product.objects.create(name='Перец', price=70, quantity=1,
+                                             description='', category=self.seeds)
+
+    def test_only_changed_products_are_updated(self):
+        df = pd.DataFrame([
+            {'Артикул': 'T-1', 'Название': 'Томат (новый)', 'Цена': 55, 'Количество': 5, 'Категория': 'Семена'},
+            {'Артикул': '', 'Название': 'огурец', 'Цена': 40, 'Количество': 3, 'Категория': 'Семена'},
+            {'Артикул': 'K-1', 'Название': 'Капуста', 'Цена': 30, 'Количество': 9, 'Категория': 'Семена'},
+            {'Артикул': 'K-1', 'Название': 'Капуста', 'Цена': 35, 'Количество': 9, 'Категория': 'Семена'},
+        ])
+
+        result = ProductImporter(download_images=False, mode='upsert', deactivate_missing=True).run(df)
+
+        self.assertEqual((result.created, result.updated, result.unchanged, result.deactivated), (1, 1, 1, 1))
+        self.tomato.refresh_from_db()
+        self.assertEqual((self.tomato.name, str(self.tomato.price)), ('Томат', '55.00'))
+        self.assertEqual(self.tomato.description, 'Красный')
+        self.assertEqual(str(Product.objects.get(sku='K-1').price), '35.00')
+        self.pepper.refresh_from_db()
+        self.assertFalse(self.pepper.is_active)
+
+    def test_product_with_rejected_row_is_not_deactivated(self):
+        df = pd.DataFrame([
+            {'Артикул': 'T-1', 'Название': 'Томат', 'Цена': '5О', 'Количество': 5, 'Категория': 'Семена'},
+            {'Артикул': '', 'Название': 'Огурец', 'Цена': 40, 'Количество': -3, 'Категория': 'Семена'},
+        ])
+
+        result = ProductImporter(download_images=False, mode='upsert', deactivate_missing=True).run(df)
+
+        self.assertEqual(len(result.errors), 2)
+        self.assertEqual(result.deactivated, 1)
+        self.assertEqual(set(Product.objects.filter(is_active=True).values_list('name', flat=True)),
+                         {'Томат', 'Огурец'})
+
+    def test_unchanged_catalog_costs_no_writes(self):
+        df = pd.DataFrame([
+            {'Артикул': 'T-1', 'Название': 'Томат', 'Цена': 50, 'Количество': 5, 'Категория': 'Семена'},
+        ])
+        importer = ProductImporter(download_images=False, mode='upsert')
+
+        # загрузка категорий и каталога, затем пустая транзакция пачки
+        with self.assertNumQueries(4):
+            result = importer.run(df)
+
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 1))
+
+
+class ImageFetcherTests(StubServerMixin, SimpleTestCase):
+    def test_each_url_is_fetched_once(self):
+        fetcher = ImageFetcher(backoff=0)
+        url = f"{self.base_url}/ok.jpg"
+
+        contents, errors = fetcher.fetch_many([url, url, url])
+        again, _ = fetcher.fetch_many([url])
+
+        self.assertEqual(contents, {url: StubImageHandler.body('/ok.jpg')})
+        self.assertEqual(errors, {})
+        self.assertEqual(again, {})
+        self.assertEqual(StubImageHandler.hits, {'/ok.jpg': 1})
+
+    def test_retries_temporary_errors_only(self):
+        fetcher = ImageFetcher(backoff=0)
+        flaky, missing = f"{self.base_url}/flaky.jpg", f"{self.base_url}/missing.jpg"
+
+        contents, errors = fetcher.fetch_many([flaky, missing])
+
+        self.assertEqual(contents, {flaky: StubImageHandler.body('/flaky.jpg')})
+        self.assertIn('HTTP 404', errors[missing])
+        self.assertEqual(StubImageHandler.hits, {'/flaky.jpg': 2, '/missing.jpg': 1})
+
+
+class TempMediaMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Превью строятся в фоне — дожидаемся их до удаления каталога
+        self.addCleanup(wait_pending)
+
+
+class ProductImporterImageTests(StubServerMixin, TempMediaMixin, TestCase):
+    def test_shared_image_is_downloaded_and_stored_once(self):
+        url = f"{self.base_url}/ok.jpg"
+        df = pd.DataFrame([
+            {'Название': 'Томат', 'Цена': 50, 'Изображение': url},
+            {'Название': 'Томат черри', 'Цена': 60, 'Изображение': url},
+            {'Название': 'Перец', 'Цена': 70, 'Изображение': f"{self.base_url}/missing.jpg"},
+        ])
+
+        result = ProductImporter(chunk_size=1, fetcher=ImageFetcher(backoff=0)).run(df)
+
+        self.assertEqual(result.created, 3)
+        images = dict(Product.objects.values_list('name', 'image'))
+        digest = hashlib.sha256(StubImageHandler.body('/ok.jpg')).hexdigest()
+        self.assertEqual(images['Томат'], f'products/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(images['Томат черри'], images['Томат'])
+        self.assertEqual(images['Перец'], '')
+        self.assertEqual(StubImageHandler.hits['/ok.jpg'], 1)
+
+    def test_failed_images_are_reported_per_row(self):
+        missing = f"{self.base_url}/missing.jpg"
+        df = pd.DataFrame([
+            {'Название': 'Перец', 'Цена': 70, 'Изображение': missing},
+            {'Название': 'Томат', 'Цена': 50, 'Изображение': f"{self.base_url}/ok.jpg"},
+            {'Название': 'Перец острый', 'Цена': 80, 'Изображение': missing},
+        ])
+
+        result = ProductImporter(chunk_size=1, fetcher=ImageFetcher(backoff=0)).run(df)
+
+        self.assertEqual(result.created, 3)
+        self.assertEqual([error.split(':')[0] for error in result.errors], ['Строка 2', 'Строка 4'])
+        self.assertIn(f'картинка не загружена ({missing}', result.errors[1])
+        self.assertEqual(StubImageHandler.hits['/missing.jpg'], 1)
+
+    def test_known_url_is_not_downloaded_again(self):
+        url = f"{self.base_url}/ok.jpg"
+        df = pd.DataFrame([{'Название': 'Томат', 'Цена': 50, 'Изображение': url}])
+
+        ProductImporter(fetcher=ImageFetcher(backoff=0)).run(df)
+        ProductImporter(fetcher=ImageFetcher(backoff=0)).run(df)
+
+        self.assertEqual(StubImageHandler.hits['/ok.jpg'], 1)
+        self.assertEqual(ImageSource.objects.get().url, url)
+        self.assertEqual(len(set(Product.objects.values_list('image', flat=True))), 1)
+
+    def test_image_cache_stats(self):
+        df = pd.DataFrame([
+            {'Название': 'Томат', 'Цена': 50, 'Изображение': f"{self.base_url}/ok.jpg"},
+            {'Название': 'Томат черри', 'Цена': 60, 'Изображение': f"{self.base_url}/ok.jpg"},
+            {'Название': 'Перец', 'Цена': 70, 'Изображение': f"{self.base_url}/missing.jpg"},
+        ])
+
+        first = ProductImporter(chunk_size=1, fetcher=ImageFetcher(backoff=0)).run(df)
+        second = ProductImporter(fetcher=ImageFetcher(backoff=0)).run(df.iloc[:1])
+
+        self.assertEqual(first.images, {'cache_hits': 1, 'downloaded': 1, 'failed': 1,
+                                        'bytes': len(StubImageHandler.body('/ok.jpg'))})
+        self.assertEqual(second.images['cache_hits'], 1)
+        self.assertEqual(second.images['downloaded'], 0)
+
+
+def make_png(width=800, height=600):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (width, height), (40, 160, 60, 255)).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='photo.png')
+
+
+class ThumbnailTests(TempMediaMixin, TestCase):
+    def test_saving_product_builds_derivatives_in_background(self):
+        category = Category.objects.create(name='Семена', slug='seeds')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Томат', price=1, description='', category=category,
+                                             image=make_png())
+        wait_pending()
+
+        for name in derivative_names(product.image.name):
+            self.assertTrue(image_storage.exists(name), name)
+        with image_storage.open(derivative_name(product.image.name, 'card', 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (400, 300))
+
+        html = Template("{% load shop_images %}{% picture product.image 'card' product.name %}").render(
+            Context({'product': product}))
+        self.assertIn('.card.webp 1x', html)
+        self.assertIn('.detail.webp 2x', html)
+        self.assertIn('src="/media/' + derivative_name(product.image.name, 'card', 'jpg'), html)
+
+    def test_picture_falls_back_to_original(self):
+        name = image_storage.save('products/photo.png', make_png())
+        product = Product(name='Томат', image=name)
+
+        html = Template("{% load shop_images %}{% picture product.image 'thumb' %}").render(
+            Context({'product': product}))
+
+        self.assertIn(f'src="/media/{name}"', html)
+
+
+class ImageStorageTests(TempMediaMixin, TestCase):
+    def test_identical_bytes_are_stored_once(self):
+        first = image_storage.save('products/a.JPG', ContentFile(b'same'))
+        second = image_storage.save('products/b.jpg', ContentFile(b'same'))
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith('.jpg'))
+        self.assertEqual(image_storage.listdir(f'products/{first.split("/")[1]}')[1], [first.split('/')[-1]])
+
+    def test_cleanup_merges_duplicates_and_removes_orphans(self):
+        category = Category.objects.create(name='Семена', slug='seeds')
+        legacy = [image_storage._save(f'products/legacy{i}.png', make_png()) for i in range(2)]
+        orphan = image_storage.save('products/orphan.jpg', ContentFile(b'unused'))
+        for i, name in enumerate(legacy):
+            Product.objects.create(name=f'Товар {i}', price=1, description='', category=category, image=name)
+
+        call_command('cleanup_images', min_age=0, stdout=io.StringIO())
+
+        names = set(Product.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        canonical = names.pop()
+        self.assertTrue(image_storage.exists(canonical))
+        for name in legacy + [orphan]:
+            self.assertFalse(image_storage.exists(name))
+
+
+    def test_cleanup_keeps_recent_unreferenced_files(self):
+        fresh = image_storage.save('products/importing.jpg', ContentFile(b'fresh'))
+        stale = image_storage.save('products/stale.jpg', ContentFile(b'stale'))
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(image_storage.path(stale), (old, old))
+
+        call_command('cleanup_images', stdout=io.StringIO())
+
+        self.assertTrue(image_storage.exists(fresh))
+        self.assertFalse(image_storage.exists(stale))
+
+    def test_hashed_name_is_checked_against_max_length(self):
+        with self.assertRaises(SuspiciousFileOperation):
+            image_storage.save('products/photo.jpg', ContentFile(b'bytes'), max_length=50)
+
+
+class ChunkReaderTests(SimpleTestCase):
+    def write_file(self, suffix, content):
+        f = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        self.addCleanup(os.remove, f.name)
+        f.write(content)
+        f.close()
+        return f.name
+
+    def test_csv_in_cp1251_with_semicolons(self):
+        path = self.write_file('.csv', 'Название;Цена\nТомат;10\nОгурец;20\nПерец;30\n'.encode('cp1251'))
+        reader = CsvChunkReader(path)
+
+        chunks = list(reader.chunks(chunk_size=2, start_row=1))
+
+        self.assertEqual((reader.encoding, reader.delimiter, reader.count_rows()), ('cp1251', ';', 3))
+        self.assertEqual([rows_done for rows_done, _ in chunks], [3])
+        self.assertEqual(list(chunks[0][1].index), [1, 2])
+        self.assertEqual(list(chunks[0][1]['Название']), ['Огурец', 'Перец'])
+
+    def test_xlsx_is_read_in_fixed_size_chunks(self):
+        buffer = tempfile.SpooledTemporaryFile()
+        pd.DataFrame({'Название': list('abcde'), 'Цена': range(5)}).to_excel(buffer, index=False)
+        buffer.seek(0)
+        reader = XlsxChunkReader(self.write_file('.xlsx', buffer.read()))
+
+        chunks = list(reader.chunks(chunk_size=2))
+
+        self.assertEqual(reader.count_rows(), 5)
+        self.assertEqual([rows_done for rows_done, _ in chunks], [2, 4, 5])
+        self.assertEqual([list(chunk.index) for _, chunk in chunks], [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunks[2][1]['Название']), ['e'])
+
+
+class ImportJobTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = Customer.objects.create_superuser(
+            'admin@example.com', '+70000000000', 'Иван', 'Петров', password='secret'
+        )
+
+    def make_import(self, rows, **fields):
+        buffer = tempfile.SpooledTemporaryFile()
+        pd.DataFrame(rows).to_excel(buffer, index=False)
+        buffer.seek(0)
+        import_task = ProductImport(created_by=self.admin, **fields)
+        import_task.file.save('price.xlsx', ContentFile(buffer.read()), save=False)
+        import_task.save()
+        return import_task
+
+    def test_progress_is_recorded(self):
+        import_task = self.make_import([{'Название': f'Товар {i}', 'Цена': i} for i in range(5)])
+
+        process_excel_import(import_task)
+
+        import_task.refresh_from_db()
+        self.assertEqual(import_task.status, 'success')
+        self.assertEqual((import_task.total_rows, import_task.processed_rows), (5, 5))
+        self.assertEqual(import_task.imported_count, 5)
+        self.assertEqual(import_task.progress_percent, 100)
+        self.assertIsNotNone(import_task.finished_at)
+
+    def test_stage_stats_are_recorded_and_shown(self):
+        import_task = self.make_import([{'Название': f'Товар {i}', 'Цена': i} for i in range(5)])
+
+        process_excel_import(import_task)
+        import_task.refresh_from_db()
+        self.client.force_login(self.admin)
+        page = self.client.get(reverse('admin:shop_productimport_change', args=[import_task.pk]))
+
+        self.assertTrue({'read', 'validate', 'categories', 'write'} <= set(import_task.stats['timings']))
+        # Категория, товары и сохранение прогресса
+        self.assertGreaterEqual(import_task.stats['queries']['write'], 3)
+        self.assertContains(page, 'Запись в базу')
+
+    def test_crashed_import_resumes_from_last_chunk(self):
+        rows = [{'Название': f'Товар {i}', 'Цена': i} for i in range(5)]
+        rows[1]['Цена'] = 'нет'
+        stale = timezone.now() - timedelta(hours=1)
+        # Воркер упал после записи первых трёх строк
+        import_task = self.make_import(rows, status='running', processed_rows=3, imported_count=2,
+                                       error_count=1, errors="Строка 3: некорректная цена 'нет'")
+        ProductImport.objects.filter(pk=import_task.pk).update(updated_at=stale)
+
+        claimed = claim_next_import()
+        self.assertEqual(claimed.pk, import_task.pk)
+        self.assertIsNone(claim_next_import())
+        process_excel_import(claimed)
+
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, 'success')
+        self.assertEqual(list(Product.objects.order_by('name').values_list('name', flat=True)),
+                         ['Товар 3', 'Товар 4'])
+        self.assertEqual((claimed.imported_count, claimed.error_count), (4, 1))
+
+    def test_running_import_with_fresh_heartbeat_is_not_reclaimed(self):
+        import_task = self.make_import([{'Название': 'Томат', 'Цена': 10}], status='running')
+        # Пачка идёт дольше STALE_AFTER, но поток воркера отмечается
+        ProductImport.objects.filter(pk=import_task.pk).update(
+            updated_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now())
+        self.assertIsNone(claim_next_import())
+
+        ProductImport.objects.filter(pk=import_task.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_next_import().pk, import_task.pk)
+
+    def test_heartbeat_is_recorded_while_import_runs(self):
+        import_task = self.make_import([{'Название': 'Томат', 'Цена': 10}])
+        process_excel_import(import_task)
+        import_task.refresh_from_db()
+        self.assertIsNotNone(import_task.heartbeat_at)
+
+    def test_csv_file_is_streamed(self):
+        import_task = ProductImport(created_by=self.admin)
+        csv_content = 'Название,Цена,Категория\nТомат,10,Семена\n,5,Семена\n\nЛопата,900,Инструмент\n'
+        import_task.file.save('price.csv', ContentFile(csv_content.encode()), save=True)
+
+        process_excel_import(import_task)
+
+        import_task.refresh_from_db()
+        self.assertEqual(import_task.status, 'success')
+        self.assertEqual(import_task.imported_count, 2)
+        self.assertEqual(import_task.errors, 'Строка 3: не указано название')
+
+    def test_russian_excel_csv_with_decimal_comma(self):
+        import_task = ProductImport(created_by=self.admin)
+        csv_content = ('Название;Цена;Старая цена;Количество\n'
+                       'Томат;199,90;249,90;5\n'
+                       'Лопата;1\xa0299,50;;2\n'
+                       'Грабли;дорого;;1\n')
+        import_task.file.save('price.csv', ContentFile(csv_content.encode('cp1251')), save=True)
+
+        process_excel_import(import_task)
+
+        import_task.refresh_from_db()
+        self.assertEqual(import_task.imported_count, 2)
+        self.assertEqual(import_task.errors, "Строка 4: некорректная цена 'дорого'")
+        self.assertEqual(dict(Product.objects.values_list('name', 'price')),
+                         {'Томат': Decimal('199.90'), 'Лопата': Decimal('1299.50')})
+        self.assertEqual(Product.objects.get(name='Томат').old_price, Decimal('249.90'))
+
+    def test_admin_progress_endpoint(self):
+        import_task = self.make_import([{'Название': 'Томат', 'Цена': 1}])
+        self.client.force_login(self.admin)
+
+        response = self.client.get(reverse('admin:shop_productimport_progress_json', args=[import_task.pk]))
+        page = self.client.get(reverse('admin:shop_productimport_progress', args=[import_task.pk]))
+
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertContains(page, 'progress.json')
+
+
+class BenchmarkTests(TestCase):
+    def test_synthetic_workbook_imports_with_stage_timings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = write_workbook(os.path.join(directory, 'bench.xlsx'), 30)
+        importer = ProductImporter(chunk_size=10, download_images=False)
+
+        result = importer.run_file(path)
+
+        self.assertEqual((result.created, result.error_count), (30, 0))
+        self.assertTrue({'read', 'validate', 'categories', 'write'} <= set(result.timings))
+
+    def test_search_indexing_stays_a_minor_share_of_import(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = write_workbook(os.path.join(directory, 'bench.xlsx'), 2000)
+
+        result = ProductImporter(chunk_size=500, download_images=False).run_file(path)
+
+        self.assertIn('index', result.timings)
+        report = {'results': [{'scenario': '2000-plain', 'stages': result.timings}]}
+        self.assertEqual(stage_share_violations(report), [])
+
+    def test_scenario_process_gets_temporary_database(self):
+        completed = mock.Mock(returncode=0, stdout='{"rows": 1}\n')
+        with mock.patch('shop.benchmarks.subprocess.run', return_value=completed) as run:
+            self.assertEqual(run_in_subprocess('bench.xlsx', 'job'), {'rows': 1})
+
+        database = run.call_args.kwargs['env']['SQLITE_PATH']
+        self.assertTrue(database.startswith(tempfile.gettempdir()))
+        self.assertFalse(os.path.exists(os.path.dirname(database)))
+
+    def test_compare_reports_regressions_beyond_tolerance(self):
+        baseline = {'results': [{'scenario': '1000-plain-job', 'rows_per_second': 1000,
+                                 'queries': 20, 'peak_rss_mb': 100}]}
+        current = {'results': [{'scenario': '1000-plain-job', 'rows_per_second': 950,
+                                'queries': 40, 'peak_rss_mb': 105}]}
+
+        regressions = compare_results(baseline, current, tolerance=0.1)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('queries', regressions[0])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.admin = Customer.objects.create_superuser(
+            'admin@example.com', '+70000000000', 'Иван', 'Петров', password='secret'
+        )
+        category = Category.objects.create(name='Семена', slug='semena')
+        self.products = [
+            Product.objects.create(name=f'Томат {i}', sku=f'T-{i}', description='', price=10 + i,
+                                   quantity=5, category=category)
+            for i in range(3)
+        ]
+        self.order = Order.objects.create(customer=self.admin, delivery_address='Москва')
+        for product in self.products:
+            OrderItem.objects.create(order=self.order, product=product, quantity=2)
+        self.client.force_login(self.admin)
+
+    def test_orders_csv_is_streamed_in_one_query(self):
+        # Сессия, пользователь и один запрос выгрузки
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('shop:export_data', args=['orders', 'csv']))
+            content = b''.join(response.streaming_content).decode('utf-8-sig')
+
+        lines = content.splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('Заказ,Дата,Статус'))
+        self.assertIn('Петров Иван', lines[1])
+        self.assertTrue(lines[1].endswith('T-0,Томат 0,2,10.00,20.00'))
+
+    def test_products_xlsx(self):
+        response = self.client.get(reverse('shop:export_data', args=['products', 'xlsx']))
+
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        rows = list(sheet.values)
+        self.assertEqual(rows[0][:3], ('ID', 'Артикул', 'Название'))
+        self.assertEqual([row[1] for row in rows[1:]], ['T-0', 'T-1', 'T-2'])
+        self.assertEqual(rows[1][4:8], (10, None, 5, True))
+        self.assertEqual(rows[1][9].date(), timezone.localdate())
+
+    def test_invalid_date_filter_is_bad_request(self):
+        url = reverse('shop:export_data', args=['orders', 'csv'])
+
+        self.assertEqual(self.client.get(url, {'date_from': '2024-13-45'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'date_to': 'вчера'}).status_code, 400)
+
+    def test_export_requires_staff_and_known_kind(self):
+        self.assertEqual(self.client.get('/export/users.csv').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('shop:export_data', args=['orders', 'csv'])).status_code, 302)
+
+    def test_command_filters_orders_by_date(self):
+        output = io.StringIO()
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+
+        call_command('export_data', 'orders', '--date-from', tomorrow, stdout=output)
+
+        self.assertEqual(len(output.getvalue().splitlines()), 1)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = Customer.objects.create_user('user@example.com', '+70000000001', 'Анна', 'Иванова',
+                                                 password='secret')
+        category = Category.objects.create(name='Семена', slug='semena')
+        self.tomato = Product.objects.create(name='Томат', description='', price=50, quantity=10,
+                                             category=category)
+        self.pepper = Product.objects.create(name='Перец', description='', price=70, quantity=10,
+                                             category=category)
+        self.client.force_login(self.user)
+
+    def cart_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in queries if 'shop_cart' in q['sql']]
+
+    def test_header_badge_is_cached_until_cart_changes(self):
+        self.client.get(reverse('shop:add_to_cart', args=[self.tomato.pk]))
+        self.client.get(reverse('shop:add_to_cart', args=[self.tomato.pk]))
+        self.client.get(reverse('shop:add_to_cart', args=[self.pepper.pk]))
+
+        response, first = self.cart_queries(reverse('shop:catalog'))
+        _, second = self.cart_queries(reverse('shop:catalog'))
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        self.assertRegex(response.content.decode(), r'bg-danger">\s*3\s*</span>')
+
+        item = CartItem.objects.get(product=self.pepper)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.get(reverse('shop:remove_from_cart', args=[item.pk]))
+            # До коммита в кэше остаётся прежняя сводка
+            _, cached = self.cart_queries(reverse('shop:catalog'))
+        self.assertTrue(callbacks)
+        self.assertEqual(cached, [])
+        response, queries = self.cart_queries(reverse('shop:catalog'))
+        self.assertEqual(len(queries), 1)
+        self.assertRegex(response.content.decode(), r'bg-danger">\s*2\s*</span>')
+
+    def test_summary_is_a_single_row_lookup(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.tomato, quantity=2)
+        CartItem.objects.create(cart=cart, product=self.pepper, quantity=1)
+        cart.recalculate()
+        request = self.client.get(reverse('shop:catalog')).wsgi_request
+        del request._cart_summary
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            summary = get_cart_summary(request)
+            get_cart_summary(request)
+
+        self.assertEqual(summary, (3, Decimal('170.00')))
+
+    def test_anonymous_visitor_without_session_costs_nothing(self):
+        self.client.logout()
+        _, queries = self.cart_queries(reverse('shop:catalog'))
+        self.assertEqual(queries, [])
+
+
+class CartPageQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = Customer.objects.create_user('user@example.com', '+70000000001', 'Анна', 'Иванова',
+                                                 password='secret')
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        self.cart = Cart.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f'Товар {i}', description='', price=10 + i, quantity=10,
+                                             category=self.category)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+        self.cart.recalculate()
+
+    def test_cart_page_query_count_does_not_depend_on_cart_size(self):
+        # Сессия, пользователь, корзина, позиции с товарами
+        self.fill_cart(1)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('shop:cart'))
+
+        self.fill_cart(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('shop:cart'))
+
+        self.assertEqual(response.context['cart_summary'], (22, Decimal('310.00')))
+        self.assertContains(response, 'Общая сумма: 310,00 руб.')
+
+    def test_checkout_page_query_count_does_not_depend_on_cart_size(self):
+        # Сессия, пользователь, корзина, позиции с товарами; резерв: чтение,
+        # резервирование одним UPDATE, запись строк одним INSERT (+ две точки
+        # сохранения: SAVEPOINT и RELEASE)
+        self.fill_cart(10)
+        with self.assertNumQueries(11):
+            response = self.client.get(reverse('shop:checkout'))
+
+        self.assertEqual(len(response.context['cart_items']), 10)
+        self.assertContains(response, '<strong>290,00 руб.</strong>')
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = Customer.objects.create_user('buyer@example.com', '+70000000007', 'Анна', 'Иванова',
+                                                 password='secret')
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count):
+        cart = Cart.objects.create(user=self.user)
+        for i in range(count):
+            product = Product.objects.create(name=f'Товар {i}', description='', price=10 + i, quantity=10,
+                                             category=self.category)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        return cart
+
+    def checkout(self):
+        return self.client.post(reverse('shop:checkout'), {'address': 'Тула', 'comment': 'после обеда'})
+
+    def test_order_is_built_from_cart_with_price_snapshots(self):
+        self.fill_cart(3)
+        response = self.checkout()
+        self.assertRedirects(response, reverse('shop:profile'), fetch_redirect_response=False)
+
+        order = Order.objects.get()
+        self.assertEqual((order.total_amount, order.contact_phone, order.delivery_address),
+                         (Decimal('66.00'), '+70000000007', 'Тула'))
+        self.assertEqual(sorted(order.items.values_list('price', 'quantity')),
+                         [(Decimal('10.00'), 2), (Decimal('11.00'), 2), (Decimal('12.00'), 2)])
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+        # Изменение цены потом заказ не трогает
+        Product.objects.update(price=1)
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, Decimal('66.00'))
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.fill_cart(1)
+        with CaptureQueriesContext(connection) as small:
+            self.checkout()
+        self.fill_cart(20)
+        with CaptureQueriesContext(connection) as large:
+            self.checkout()
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failure_leaves_no_half_built_order(self):
+        self.fill_cart(2)
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_empty_cart_is_not_ordered(self):
+        response = self.checkout()
+        self.assertRedirects(response, reverse('shop:cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(TELEGRAM_BOT_TOKEN='token', TELEGRAM_CHAT_ID='42')
+    def test_new_order_notification_is_queued(self):
+        self.fill_cart(2)
+        self.checkout()
+        order = Order.objects.get()
+        self.assertIn(f'НОВЫЙ ЗАКАЗ #{order.pk}', TelegramMessage.objects.get().text)
+        self.assertIn('Товаров: 4 шт.', TelegramMessage.objects.get().text)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = Customer.objects.create_user('user@example.com', '+70000000001', 'Анна', 'Иванова',
+                                                 password='secret')
+        category = Category.objects.create(name='Семена', slug='semena')
+        self.tomato = Product.objects.create(name='Томат', description='', price=50, quantity=10,
+                                             category=category)
+        self.pepper = Product.objects.create(name='Перец', description='', price=70, quantity=10,
+                                             category=category)
+        self.client.force_login(self.user)
+
+    def totals(self):
+        cart = Cart.objects.get(user=self.user)
+        return cart.item_count, cart.subtotal
+
+    def test_cart_views_keep_stored_totals_in_sync(self):
+        self.client.get(reverse('shop:add_to_cart', args=[self.tomato.pk]))
+        self.client.get(reverse('shop:add_to_cart', args=[self.tomato.pk]))
+        self.client.get(reverse('shop:add_to_cart', args=[self.pepper.pk]))
+        self.assertEqual(self.totals(), (3, Decimal('170.00')))
+
+        tomato = CartItem.objects.get(product=self.tomato)
+        self.client.post(reverse('shop:update_cart_item', args=[tomato.pk]), {'quantity': 5})
+        self.assertEqual(self.totals(), (6, Decimal('320.00')))
+
+        pepper = CartItem.objects.get(product=self.pepper)
+        self.client.get(reverse('shop:remove_from_cart', args=[pepper.pk]))
+        self.assertEqual(self.totals(), (5, Decimal('250.00')))
+
+        self.client.post(reverse('shop:update_cart_item', args=[tomato.pk]), {'quantity': 0})
+        self.assertEqual(self.totals(), (0, Decimal('0.00')))
+
+    def test_reconcile_command_fixes_drift(self):
+        cart = Cart.objects.create(user=self.user, item_count=7, subtotal=1)
+        CartItem.objects.create(cart=cart, product=self.pepper, quantity=2)
+        Cart.objects.create(session_key='abc')
+        output = io.StringIO()
+
+        call_command('reconcile_carts', '--dry-run', stdout=output)
+        self.assertEqual(self.totals(), (7, Decimal('1.00')))
+
+        call_command('reconcile_carts', stdout=output)
+        self.assertEqual(self.totals(), (2, Decimal('140.00')))
+        self.assertIn('Исправлено корзин с расхождениями: 1', output.getvalue())
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        self.tomato = Product.objects.create(name='Томат', description='', price=50, quantity=10,
+                                             category=self.category)
+        self.url = reverse('shop:category_products', args=[self.category.slug])
+
+    def product_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in queries if 'FROM "shop_product"' in q['sql']]
+
+    def test_category_grid_is_served_from_cache_until_product_changes(self):
+        _, first = self.product_queries(self.url)
+        response, second = self.product_queries(self.url)
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        self.assertContains(response, 'Томат')
+        self.assertEqual(catalog_cache_stats()['category_grid'], {'hits': 1, 'misses': 1, 'ratio': 0.5})
+
+        self.tomato.name = 'Томат бычье сердце'
+        self.tomato.save()
+        response, queries = self.product_queries(self.url)
+        self.assertEqual(len(queries), 1)
+        self.assertContains(response, 'Томат бычье сердце')
+
+    def test_bump_from_another_process_reaches_the_site(self):
+        self.client.get(self.url)
+        code = f"from shop import catalog_cache; catalog_cache.bump_product({self.tomato.pk}, {self.category.pk})"
+
+        # Как воркер импорта или sweep_reservations: отдельный процесс со своими настройками
+        subprocess.run([sys.executable, 'manage.py', 'shell', '-c', code], check=True, capture_output=True,
+                       cwd=settings.BASE_DIR)
+
+        _, queries = self.product_queries(self.url)
+        self.assertEqual(len(queries), 1)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_rejected(self):
+        self.assertEqual([error.id for error in check_shared_cache()], ['shop.E001'])
+
+    def test_moving_product_resets_old_category(self):
+        other = Category.objects.create(name='Инструмент', slug='instrument')
+        self.client.get(self.url)
+
+        self.tomato.category = other
+        self.tomato.save()
+
+        self.assertNotContains(self.client.get(self.url), 'Томат')
+
+    def test_bulk_import_resets_catalog(self):
+        self.client.get(reverse('shop:catalog'))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImporter(download_images=False).run(
+                pd.DataFrame([{'Название': 'Перец', 'Цена': 70, 'Количество': 5}]))
+
+        self.assertContains(self.client.get(reverse('shop:catalog')), 'Перец')
+
+    def test_csrf_token_is_not_shared_between_visitors(self):
+        url = reverse('shop:product_detail', args=[self.tomato.pk])
+        first = self.client.get(url)
+        second = self.client_class().get(url)
+
+        token = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+        self.assertEqual(catalog_cache_stats()['product_info']['hits'], 1)
+        self.assertNotEqual(token.search(first.content.decode()).group(1),
+                            token.search(second.content.decode()).group(1))
+        self.assertNotIn(b'__catalog_csrf_token__', second.content)
+
+
+class CategoryPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        now = timezone.now()
+        for i in range(30):
+            product = Product.objects.create(name=f'Семена {i:02d}', description='', price=10, quantity=5,
+                                             category=self.category)
+            # Несколько товаров с одинаковой датой — порядок держится на id
+            Product.objects.filter(pk=product.pk).update(created_at=now - timedelta(minutes=i // 3))
+        self.url = reverse('shop:category_products', args=[self.category.slug])
+
+    def names(self, response):
+        return re.findall(r'<h5 class="card-title">(Семена \d+)</h5>', response.content.decode())
+
+    def test_pages_follow_cursor_without_offset(self):
+        # Новые сверху, при равной дате — больший id сверху
+        expected = [f'Семена {i:02d}' for i in sorted(range(30), key=lambda i: (i // 3, -i))]
+        first = self.client.get(self.url)
+        page = first.context['page']
+
+        self.assertEqual(self.names(first), expected[:24])
+        self.assertIsNotNone(page.next_cursor)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url, {'after': page.next_cursor, 'fragment': 1})
+        self.assertTemplateNotUsed(second, 'shop/base.html')
+        self.assertEqual(self.names(second), expected[24:])
+        self.assertNotContains(second, 'data-load-more')
+        self.assertFalse(any('OFFSET' in q['sql'] for q in queries))
+
+    def test_broken_cursor_is_404(self):
+        self.assertEqual(self.client.get(self.url, {'after': 'мусор'}).status_code, 404)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.seeds = Category.objects.create(name='Семена овощей', slug='seeds')
+        self.tools = Category.objects.create(name='Инструмент', slug='tools')
+        self.tomato = Product.objects.create(name='Семена томатов «Бычье сердце»', price=50, quantity=5,
+                                             description='Крупноплодный сорт', category=self.seeds)
+        self.shovel = Product.objects.create(name='Лопата штыковая', price=900, quantity=2,
+                                             description='Для посадки томатов', category=self.tools)
+
+    def found(self, query):
+        return [product.name for product in search_products(query)[0]]
+
+    def test_stemmer_joins_word_forms(self):
+        self.assertEqual({stem('томаты'), stem('томатов'), stem('томат')}, {'томат'})
+        self.assertEqual(stem('садовые'), stem('Садовая'))
+        self.assertEqual(normalize('Семена, 10 шт.'), 'сем 10 шт')
+
+    def test_ranked_by_field_weight(self):
+        # Совпадение в названии весит больше, чем в описании
+        self.assertEqual(self.found('томат'), [self.tomato.name, self.shovel.name])
+        self.assertEqual(self.found('ОВОЩИ'), [self.tomato.name])
+        self.assertEqual(self.found('лопат штык'), [self.shovel.name])
+        self.assertEqual(self.found('"); DROP'), [])
+
+    def test_index_follows_saves_and_category_renames(self):
+        self.shovel.is_active = False
+        self.shovel.save()
+        self.assertEqual(self.found('томат'), [self.tomato.name])
+
+        self.tools.name = 'Садовый инвентарь'
+        self.tools.save()
+        self.shovel.is_active = True
+        self.shovel.save()
+        self.assertEqual(self.found('инвентарь'), [self.shovel.name])
+
+        self.tomato.delete()
+        self.assertEqual(self.found('сердце'), [])
+
+    def test_import_indexes_created_and_deactivated_products(self):
+        df = pd.DataFrame([
+            {'Название': 'Грабли веерные', 'Цена': 300, 'Категория': 'Инструмент', 'Количество': 1},
+        ])
+        ProductImporter(download_images=False, mode='upsert', deactivate_missing=True).run(df)
+
+        self.assertEqual(self.found('грабл'), ['Грабли веерные'])
+        self.assertEqual(self.found('лопата'), [])
+
+    def test_search_page_paginates(self):
+        for i in range(25):
+            Product.objects.create(name=f'Томат {i}', price=10, quantity=1, description='', category=self.seeds)
+        url = reverse('shop:search')
+
+        first = self.client.get(url, {'q': 'томаты'})
+        self.assertEqual(len(first.context['products']), 20)
+        self.assertTrue(first.context['has_next'])
+        second = self.client.get(url, {'q': 'томаты', 'page': 2})
+        self.assertEqual(len(second.context['products']), 7)
+        self.assertFalse(second.context['has_next'])
+        self.assertContains(self.client.get(url, {'q': 'кабачок'}), 'ничего не нашлось')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        make = lambda name, price, **kwargs: Product.objects.create(
+            name=name, price=price, description='', category=self.category, **{'quantity': 5, **kwargs})
+        make('Томат', 50)
+        make('Огурец', 80, old_price=100)
+        make('Перец', 300, is_featured=True)
+        make('Баклажан', 700, old_price=900, is_featured=True)
+        make('Кабачок', 60, quantity=0)
+        make('Тыква', 2000, is_active=False)
+        self.url = reverse('shop:category_products', args=[self.category.slug])
+
+    def names(self, response):
+        return sorted(re.findall(r'<h5 class="card-title">(\w+)</h5>', response.content.decode()))
+
+    def counts(self, response):
+        return {group['title']: {option['label']: option['count'] for option in group['options']}
+                for group in response.context['facet_groups']}
+
+    def test_counts_follow_other_selected_facets(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'sale': 1})
+        self.assertEqual(self.names(response), ['Баклажан', 'Огурец'])
+        self.assertEqual(response.context['facet_total'], 2)
+        counts = self.counts(response)
+        self.assertEqual(counts['Цена'], {'до 100 руб.': 1, '100–500 руб.': 0, '500–1000 руб.': 1,
+                                          '1000–5000 руб.': 0, 'от 5000 руб.': 0})
+        # Своя группа не сужает свой счётчик
+        self.assertEqual(counts['Скидка'], {'Со скидкой': 2})
+        self.assertEqual(counts['Наличие'], {'В наличии': 2, 'Нет в наличии': 0})
+        self.assertEqual(sum('shop_productfacet' in q['sql'] for q in queries), 1)
+
+        response = self.client.get(self.url, {'stock': 'out'})
+        self.assertEqual(self.names(response), ['Кабачок'])
+        self.assertEqual(self.counts(response)['Наличие'], {'В наличии': 4, 'Нет в наличии': 1})
+
+        response = self.client.get(self.url, {'price': 0, 'featured': 1})
+        self.assertEqual(self.names(response), [])
+        self.assertContains(response, 'Под выбранные фильтры товаров нет')
+
+    def test_facet_table_follows_product_changes(self):
+        tomato = Product.objects.get(name='Томат')
+        tomato.old_price = 70
+        tomato.save()
+        self.assertEqual(self.counts(self.client.get(self.url))['Скидка'], {'Со скидкой': 3})
+
+        other = Category.objects.create(name='Инструмент', slug='tools')
+        tomato.category = other
+        tomato.save()
+        self.assertEqual(self.client.get(self.url).context['facet_total'], 3)
+        self.assertEqual(ProductFacet.objects.get(category=other).count, 1)
+
+        df = pd.DataFrame([{'Название': 'Редис', 'Цена': 40, 'Категория': 'Семена', 'Количество': 2}])
+        ProductImporter(download_images=False).run(df)
+        self.assertEqual(self.client.get(self.url).context['facet_total'], 4)
+
+    def test_fully_reserved_product_is_out_of_stock(self):
+        tomato = Product.objects.get(name='Томат')
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve(Cart.objects.create(session_key='facets'), tomato, 5)
+
+        response = self.client.get(self.url)
+        self.assertNotIn('Томат', self.names(response))
+        self.assertEqual(self.counts(response)['Наличие'], {'В наличии': 3, 'Нет в наличии': 2})
+        self.assertIn('Томат', self.names(self.client.get(self.url, {'stock': 'out'})))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve(Cart.objects.get(session_key='facets'), tomato, -1)
+        self.assertEqual(self.counts(self.client.get(self.url))['Наличие'], {'В наличии': 4, 'Нет в наличии': 1})
+
+    def test_load_more_keeps_filters(self):
+        for i in range(30):
+            Product.objects.create(name=f'Лук{i}', price=20, old_price=30, quantity=1, description='',
+                                   category=self.category)
+        response = self.client.get(self.url, {'sale': 1})
+        self.assertContains(response, '?sale=1&amp;after=')
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN запросов горячих страниц: ни полных сканирований, ни сортировок во временном дереве"""
+    TABLES = {'shop_product', 'shop_cart', 'shop_cartitem', 'shop_order', 'shop_chatmessage', 'shop_productfacet',
+              'shop_productrelation'}
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        self.product = Product.objects.create(name='Томат', price=50, quantity=5, description='',
+                                              category=self.category)
+        self.user = Customer.objects.create_user('plan@example.com', '+70000000001', 'Иван', 'Иванов', 'pass')
+
+    def view_queries(self, url):
+        """SELECT-запросы страницы вместе с параметрами"""
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return statements
+
+    def assertIndexed(self, url, *indexes):
+        """Запросы страницы к горячим таблицам идут по индексам, среди них — ``indexes``.
+
+        Вместо имени можно передать кортеж равноценных индексов — подойдёт любой.
+        """
+        used = set()
+        for sql, params in self.view_queries(url):
+            if re.search(r'FROM "(\w+)"', sql).group(1) not in self.TABLES:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for line in plan:
+                scanned = re.match(r'SCAN (\w+)$', line)
+                self.assertFalse(scanned and scanned.group(1) in self.TABLES,
+                                 f'Полное сканирование на {url}:\n{sql}\n{plan}')
+                self.assertNotIn('TEMP B-TREE FOR ORDER BY', line, f'Сортировка без индекса на {url}:\n{sql}\n{plan}')
+                used.update(re.findall(r'USING (?:COVERING )?INDEX (\w+)', line))
+        # Поиск по неподходящему индексу (например, user_id IS NULL для гостей) тоже регрессия
+        for expected in indexes:
+            alternatives = {expected} if isinstance(expected, str) else set(expected)
+            self.assertTrue(alternatives & used, f'На {url} нет {expected}, использованы: {sorted(used)}')
+
+    def test_storefront_pages(self):
+        self.assertIndexed(reverse('shop:catalog'), 'product_storefront_idx')
+        # Выборке «в наличии» подходят оба частичных индекса категории
+        self.assertIndexed(reverse('shop:category_products', args=[self.category.slug]),
+                           ('product_category_listing_idx', 'product_category_active_idx'))
+        self.assertIndexed(reverse('shop:product_detail', args=[self.product.pk]),
+                           'sqlite_autoindex_shop_productrelation_1', 'product_category_active_idx')
+
+    def test_guest_and_user_carts(self):
+        self.client.get(reverse('shop:add_to_cart', args=[self.product.pk]))
+        cache.clear()
+        self.assertIndexed(reverse('shop:cart'), 'cart_guest_session_idx')
+
+        self.client.force_login(self.user)
+        cache.clear()
+        self.assertIndexed(reverse('shop:cart'), 'shop_cart_user_id_27925ac6')
+
+    def test_profile_orders_and_chat(self):
+        Order.objects.create(customer=self.user, total_amount=50)
+        ChatMessage.objects.create(user=self.user, message='Привет')
+        self.client.force_login(self.user)
+        self.assertIndexed(reverse('shop:profile'), 'order_customer_created_idx')
+        self.assertIndexed(reverse('shop:chat_room'), 'chatmessage_created_idx')
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seeds = Category.objects.create(name='Семена', slug='semena')
+        self.tools = Category.objects.create(name='Инструмент', slug='tools')
+        make = lambda name, category: Product.objects.create(name=name, price=10, quantity=5, description='',
+                                                             category=category)
+        self.tomato, self.cucumber, self.pepper = (make(name, self.seeds) for name in ('Томат', 'Огурец', 'Перец'))
+        self.shovel, self.rake = make('Лопата', self.tools), make('Грабли', self.tools)
+        self.user = Customer.objects.create_user('rec@example.com', '+70000000002', 'Иван', 'Иванов', 'pass')
+
+    def order(self, *products, status='new'):
+        order = Order.objects.create(customer=self.user, status=status)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=p, price=p.price) for p in products])
+        return order
+
+    def related(self, product):
+        return list(ProductRelation.objects.filter(product=product).values_list('related__name', 'source'))
+
+    def test_pairs_are_counted_incrementally(self):
+        self.order(self.tomato, self.shovel)
+        self.order(self.tomato, self.shovel, self.rake)
+        self.order(self.tomato, self.rake, status='cancelled')
+        run = build_recommendations()
+        self.assertEqual((run.orders, run.products), (2, 3))
+        self.assertEqual(self.related(self.tomato), [('Лопата', 'together'), ('Грабли', 'together'),
+                                                     ('Перец', 'category'), ('Огурец', 'category')])
+
+        # Второй запуск видит только новый заказ
+        self.order(self.rake, self.tomato)
+        self.order(self.rake, self.tomato)
+        run = build_recommendations()
+        self.assertEqual((run.orders, run.products), (2, 2))
+        self.assertEqual(ProductPair.objects.get(product=self.tomato, other=self.rake).count, 3)
+        self.assertEqual(self.related(self.tomato)[:2], [('Грабли', 'together'), ('Лопата', 'together')])
+        self.assertEqual(build_recommendations().orders, 0)
+
+        # Полный пересчёт даёт те же счётчики
+        build_recommendations(full=True)
+        self.assertEqual(ProductPair.objects.get(product=self.tomato, other=self.rake).count, 3)
+        self.assertEqual(self.related(self.cucumber), [('Перец', 'category'), ('Томат', 'category')])
+
+    def test_rerun_after_crash_does_not_count_twice(self):
+        self.order(self.tomato, self.shovel)
+        self.order(self.tomato, self.shovel)
+        real_add = recommendations.add_pair_counts
+        calls = []
+
+        def crash_on_second(counts):
+            calls.append(counts)
+            if len(calls) == 2:
+                raise RuntimeError('упал посреди прохода')
+            return real_add(counts)
+
+        with mock.patch.object(recommendations, 'add_pair_counts', crash_on_second):
+            with self.assertRaises(RuntimeError):
+                build_recommendations(batch_size=1)
+        run = build_recommendations(batch_size=1)
+
+        self.assertEqual(run.orders, 1)
+        self.assertEqual(ProductPair.objects.get(product=self.tomato, other=self.shovel).count, 2)
+
+    def test_detail_page_reads_relations_in_one_query(self):
+        self.order(self.tomato, self.shovel)
+        build_recommendations()
+        self.shovel.is_active = False
+        self.shovel.save()
+        url = reverse('shop:product_detail', args=[self.tomato.pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual([p.name for p in response.context['related_products']], ['Перец', 'Огурец'])
+        self.assertEqual(sum('shop_productrelation' in q['sql'] for q in queries), 1)
+
+        # Товар без пересчёта — новинки категории
+        response = self.client.get(reverse('shop:product_detail', args=[self.cucumber.pk]))
+        self.assertEqual([p.name for p in response.context['related_products']], ['Перец', 'Томат'])
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Число запросов списка в админке не зависит от числа строк"""
+
+    def setUp(self):
+        self.admin = Customer.objects.create_superuser('admin@example.com', '+70000000009', 'Админ', 'Админов',
+                                                       'pass')
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            i = self.rows = self.rows + 1
+            category = Category.objects.create(name=f'Категория {i}', slug=f'category-{i}')
+            product = Product.objects.create(name=f'Товар {i}', price=10 * i, quantity=5, description='',
+                                             category=category, image=f'products/{i}.jpg')
+            ProductImage.objects.create(product=product, image=f'products/additional/{i}.jpg')
+            customer = Customer.objects.create_user(f'c{i}@example.com', f'+7100000000{i}', 'Иван', f'Иванов{i}')
+            order = Order.objects.create(customer=customer, total_amount=10 * i)
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+            cart = Cart.objects.create(user=customer)
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            ChatMessage.objects.create(user=customer, message=f'Сообщение {i}')
+            ProductImport.objects.create(file=f'imports/{i}.xlsx', created_by=customer)
+
+    def changelist_queries(self, model, params=None):
+        url = reverse(f'admin:shop_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_query_count_is_constant_for_every_changelist(self):
+        from django.contrib import admin
+
+        models = [model for model in admin.site._registry if model._meta.app_label == 'shop']
+        self.add_rows(2)
+        before = {model: self.changelist_queries(model) for model in models}
+        self.add_rows(4)
+        after = {model: self.changelist_queries(model) for model in models}
+        self.assertEqual(after, before)
+
+    def test_annotated_columns_are_sortable(self):
+        self.add_rows(3)
+        Product.objects.create(name='Ещё товар', price=1, quantity=1, description='',
+                               category=Category.objects.get(slug='category-2'))
+        response = self.client.get(reverse('admin:shop_category_changelist'), {'o': '-2'})
+        self.assertEqual([c.product_count for c in response.context['cl'].result_list][:1], [2])
+
+        response = self.client.get(reverse('admin:shop_orderitem_changelist'), {'o': '-5'})
+        self.assertEqual([item.total_price for item in response.context['cl'].result_list],
+                         [Decimal('60.00'), Decimal('40.00'), Decimal('20.00')])
+        self.assertEqual(self.client.get(reverse('admin:shop_customer_changelist'), {'o': '5'}).status_code, 200)
+
+
+class OrderStockTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Семена', slug='semena')
+        self.tomato = Product.objects.create(name='Томат', price=50, quantity=5, description='', category=self.category)
+        self.shovel = Product.objects.create(name='Лопата', price=900, quantity=1, description='',
+                                             category=self.category)
+        self.user = Customer.objects.create_user('stock@example.com', '+70000000003', 'Иван', 'Иванов', 'pass')
+
+    def order(self, *lines):
+        order = Order.objects.create(customer=self.user)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+                                       for product, quantity in lines])
+        return order
+
+    def stock(self):
+        return dict(Product.objects.values_list('name', 'quantity'))
+
+    def test_confirm_and_cancel_move_stock_once(self):
+        order = self.order((self.tomato, 2), (self.shovel, 1), (self.tomato, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            order.update_status('confirmed')
+        self.assertEqual(self.stock(), {'Томат': 2, 'Лопата': 0})
+        self.assertEqual(self.client.get(reverse('shop:category_products', args=[self.category.slug]))
+                         .context['facet_total'], 1)
+
+        order.update_status('cancelled')
+        self.assertEqual(self.stock(), {'Томат': 5, 'Лопата': 1})
+
+        # Отмена неподтверждённого заказа остатки не трогает
+        self.order((self.tomato, 3)).update_status('cancelled')
+        self.assertEqual(self.stock(), {'Томат': 5, 'Лопата': 1})
+
+    def test_short_line_fails_without_changes(self):
+        order = self.order((self.tomato, 2), (self.shovel, 2))
+        with self.assertRaisesMessage(ValidationError, "'Лопата' (на складе: 1, в заказе: 2)"):
+            order.update_status('confirmed')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'new')
+        self.assertEqual(self.stock(), {'Томат': 5, 'Лопата': 1})
+
+    def test_query_count_does_not_depend_on_lines(self):
+        small = self.order((self.tomato, 1))
+        products = [Product.objects.create(name=f'Семена {i}', price=10, quantity=5, description='',
+                                           category=self.category) for i in range(10)]
+        large = self.order(*[(product, 1) for product in products])
+        with CaptureQueriesContext(connection) as first:
+            small.update_status('confirmed')
+        with CaptureQueriesContext(connection) as second:
+            large.update_status('confirmed')
+        self.assertEqual(len(first), len(second))
+
+
+@mock.patch.object(Order, '_send_telegram_message')
+class OrderStockConcurrencyTests(TransactionTestCase):
+    def test_parallel_confirmations_never_oversell(self, send):
+        category = Category.objects.create(name='Семена', slug='semena')
+        product = Product.objects.create(name='Томат', price=50, quantity=5, description='', category=category)
+        user = Customer.objects.create_user('race@example.com', '+70000000004', 'Иван', 'Иванов', 'pass')
+        orders = []
+        for _ in range(12):
+            order = Order.objects.create(customer=user)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+            orders.append(order.pk)
+
+        results = []
+        barrier = threading.Barrier(len(orders))
+
+        def confirm(order_id):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        Order.objects.get(pk=order_id).update_status('confirmed')
+                        results.append('confirmed')
+                        break
+                    except ValidationError:
+                        results.append('short')
+                        break
+                    except OperationalError:
+                        # SQLite не даёт писать двум транзакциям сразу — повторяем
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=confirm, args=(pk,)) for pk in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+        self.assertEqual(results.count('confirmed'), 5)
+        self.assertEqual(results.count('short'), 7)
+        self.assertEqual(Order.objects.filter(status='confirmed').count(), 5)
+
+
+@mock.patch.object(Order, '_send_telegram_message')
+class BulkOrderActionTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Семена', slug='semena')
+        self.tomato = Product.objects.create(name='Томат', price=50, quantity=5, description='', category=category)
+        self.shovel = Product.objects.create(name='Лопата', price=900, quantity=1, description='', category=category)
+        self.admin = Customer.objects.create_superuser('boss@example.com', '+70000000005', 'Админ', 'Админов', 'pass')
+
+    def order(self, *lines, status='new'):
+        order = Order.objects.create(customer=self.admin, status=status)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+                                       for product, quantity in lines])
+        return order
+
+    def stock(self):
+        return dict(Product.objects.values_list('name', 'quantity'))
+
+    def test_confirm_skips_orders_without_stock(self, send):
+        first = self.order((self.tomato, 2), (self.shovel, 1))
+        second = self.order((self.tomato, 1), (self.shovel, 1))
+        third = self.order((self.tomato, 3))
+        done = self.order((self.tomato, 1), status='confirmed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = bulk_confirm([first.pk, second.pk, third.pk, done.pk])
+
+        self.assertEqual(result.changed, [first.pk, third.pk])
+        self.assertEqual(result.skipped, {
+            second.pk: "недостаточно товара: 'Лопата' (осталось 0, нужно 1)",
+            done.pk: 'статус «✅ Подтвержден»',
+        })
+        self.assertEqual(self.stock(), {'Томат': 0, 'Лопата': 0})
+        self.assertEqual(dict(Order.objects.values_list('pk', 'status'))[second.pk], 'new')
+        send.assert_called_once()
+        self.assertIn(f'#{second.pk}: недостаточно товара', send.call_args.args[0])
+
+    def test_cancel_returns_only_confirmed_stock(self, send):
+        confirmed = self.order((self.tomato, 2), status='confirmed')
+        Product.objects.filter(pk=self.tomato.pk).update(quantity=3)
+        fresh = self.order((self.tomato, 4))
+        result = bulk_cancel([confirmed.pk, fresh.pk])
+        self.assertEqual(result.changed, [confirmed.pk, fresh.pk])
+        self.assertEqual(self.stock()['Томат'], 5)
+
+    def test_query_count_does_not_depend_on_selection(self, send):
+        small = [self.order((self.tomato, 1)).pk]
+        large = [self.order((self.tomato, 1), (self.shovel, 1)).pk] + [self.order((self.tomato, 1)).pk
+                                                                        for _ in range(3)]
+        with CaptureQueriesContext(connection) as first:
+            bulk_confirm(small)
+        with CaptureQueriesContext(connection) as second:
+            bulk_confirm(large)
+        self.assertEqual(len(first), len(second))
+
+    def test_admin_action_reports_skipped_orders(self, send):
+        ok = self.order((self.shovel, 1))
+        short = self.order((self.shovel, 1))
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'confirm_orders', '_selected_action': [ok.pk, short.pk],
+        }, follow=True)
+        texts = [str(message) for message in response.context['messages']]
+        self.assertEqual(texts[0], '1 заказов подтверждено')
+        self.assertIn(f'#{short.pk}: недостаточно товара: &#x27;Лопата&#x27;', texts[1])
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='token', TELEGRAM_CHAT_ID='42')
+class TelegramOutboxTests(StubServerMixin, TestCase):
+    handler = StubTelegramHandler
+
+    def setUp(self):
+        super().setUp()
+        StubTelegramHandler.sent = []
+        StubTelegramHandler.replies = []
+        category = Category.objects.create(name='Семена', slug='semena')
+        self.shovel = Product.objects.create(name='Лопата', price=900, quantity=1, description='', category=category)
+        self.user = Customer.objects.create_user('tg@example.com', '+70000000006', 'Иван', 'Иванов', 'pass')
+
+    def order(self, quantity=1):
+        order = Order.objects.create(customer=self.user)
+        OrderItem.objects.create(order=order, product=self.shovel, quantity=quantity, price=self.shovel.price)
+        return order
+
+    def worker(self):
+        client = TelegramClient(api_url=self.base_url)
+        return NotificationWorker(workers=2, client=client, limiter=RateLimiter(rate=0, chat_interval=0))
+
+    def test_message_is_queued_with_the_status_change(self):
+        order = self.order()
+        order.update_status('confirmed')
+        self.assertIn(f'Заказ #{order.pk} подтвержден', TelegramMessage.objects.get().text)
+
+        with self.assertRaises(ValidationError):
+            self.order(quantity=5).update_status('confirmed')
+        # Неудачное подтверждение откатило и уведомление
+        self.assertEqual(TelegramMessage.objects.count(), 1)
+
+    def test_burst_is_sent_as_one_digest(self):
+        for text in ['первое', 'второе', 'третье']:
+            TelegramMessage.objects.create(chat_id='42', text=text)
+        TelegramMessage.objects.create(chat_id='7', text='другой чат')
+
+        result = self.worker().run_once()
+
+        self.assertEqual((result.sent, result.requests), (4, 2))
+        self.assertEqual(set(TelegramMessage.objects.values_list('status', flat=True)), {'sent'})
+        payloads = {payload['chat_id']: payload['text'] for path, payload in StubTelegramHandler.sent}
+        self.assertEqual(StubTelegramHandler.sent[0][0], '/bottoken/sendMessage')
+        self.assertTrue(payloads['42'].startswith('📬 Уведомлений: 3'))
+        self.assertLess(payloads['42'].index('первое'), payloads['42'].index('третье'))
+        self.assertEqual(payloads['7'], 'другой чат')
+        self.assertEqual(self.worker().run_once().requests, 0)
+
+    def test_rate_limit_and_server_errors_are_retried_later(self):
+        message = TelegramMessage.objects.create(chat_id='42', text='привет')
+        StubTelegramHandler.replies = [
+            (429, {'ok': False, 'description': 'Too Many Requests', 'parameters': {'retry_after': 30}}),
+        ]
+        self.assertEqual(self.worker().run_once().retried, 1)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('pending', 1))
+        self.assertIn('Too Many Requests', message.last_error)
+        self.assertAlmostEqual((message.next_attempt_at - timezone.now()).total_seconds(), 30, delta=5)
+        # Время ещё не пришло — воркер сообщение не берёт
+        self.assertEqual(self.worker().run_once().requests, 0)
+
+        StubTelegramHandler.replies = [(500, {'ok': False})] * (MAX_ATTEMPTS - 1)
+        for _ in range(MAX_ATTEMPTS - 1):
+            TelegramMessage.objects.update(next_attempt_at=timezone.now())
+            self.worker().run_once()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('failed', MAX_ATTEMPTS))
+
+    def test_client_error_is_not_retried(self):
+        TelegramMessage.objects.create(chat_id='42', text='<b>')
+        StubTelegramHandler.replies = [(400, {'ok': False, 'description': "Bad Request: can't parse entities"})]
+        result = self.worker().run_once()
+        self.assertEqual((result.failed, result.retried), (1, 0))
+        self.assertEqual(TelegramMessage.objects.get().status, 'failed')
+
+    def test_customer_text_is_escaped_for_html(self):
+        order = Order.objects.create(customer=self.user, comment='Позвонить <после 18:00> & не раньше')
+        order._send_new_order_notification()
+
+        self.assertIn('Позвонить &lt;после 18:00&gt; &amp; не раньше', TelegramMessage.objects.get().text)
+
+    def test_rejected_digest_is_resent_one_by_one(self):
+        for text in ['первое', '<сломанное', 'третье']:
+            TelegramMessage.objects.create(chat_id='42', text=text)
+        bad_request = (400, {'ok': False, 'description': "Bad Request: can't parse entities"})
+        StubTelegramHandler.replies = [bad_request, (200, {'ok': True}), bad_request]
+
+        result = self.worker().run_once()
+
+        self.assertEqual((result.sent, result.failed, result.requests), (2, 1, 4))
+        self.assertEqual(dict(TelegramMessage.objects.values_list('text', 'status')),
+                         {'первое': 'sent', '<сломанное': 'failed', 'третье': 'sent'})
+
+    def test_claimed_messages_are_not_taken_twice(self):
+        TelegramMessage.objects.create(chat_id='42', text='привет')
+        first, second = self.worker(), self.worker()
+        self.assertEqual(len(first.claim()), 1)
+        self.assertEqual(second.claim(), [])
+        # Воркер, взявший сообщение, пропал — через STALE_AFTER его заберёт другой
+        TelegramMessage.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(len(second.claim()), 1)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Семена', slug='semena')
+        self.tomato = Product.objects.create(name='Томат', price=50, quantity=2, description='', category=category)
+        self.first = Customer.objects.create_user('first@example.com', '+70000000008', 'Анна', 'Иванова', 'pass')
+        self.second = Customer.objects.create_user('second@example.com', '+70000000009', 'Пётр', 'Петров', 'pass')
+
+    def add(self, user, product=None):
+        self.client.force_login(user)
+        return self.client.get(reverse('shop:add_to_cart', args=[(product or self.tomato).pk]), follow=True)
+
+    def reserved(self):
+        self.tomato.refresh_from_db()
+        return self.tomato.reserved
+
+    def test_last_units_cannot_be_put_in_two_carts(self):
+        self.add(self.first)
+        self.add(self.first)
+        response = self.add(self.second)
+
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(self.tomato.available_quantity, 0)
+        self.assertIn("Недостаточно товара: 'Томат' (доступно: 0, нужно 1)",
+                      [str(message) for message in response.context['messages']])
+        self.assertFalse(CartItem.objects.filter(cart__user=self.second).exists())
+        self.assertEqual(Cart.objects.get(user=self.second).item_count, 0)
+
+    def test_reservation_updates_cached_product_page(self):
+        url = reverse('shop:product_detail', args=[self.tomato.pk])
+        self.assertContains(self.client.get(url), 'Осталось: 2 шт.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add(self.first)
+
+        self.assertContains(self.client.get(url), 'Осталось: 1 шт.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+            sweep()
+        self.assertContains(self.client.get(url), 'Осталось: 2 шт.')
+
+    def test_cart_changes_move_the_reservation(self):
+        self.add(self.first)
+        item = CartItem.objects.get()
+        self.client.post(reverse('shop:update_cart_item', args=[item.pk]), {'quantity': 5})
+        item.refresh_from_db()
+        self.assertEqual((item.quantity, self.reserved()), (1, 1))
+
+        self.client.post(reverse('shop:update_cart_item', args=[item.pk]), {'quantity': 2})
+        self.assertEqual(self.reserved(), 2)
+        self.client.get(reverse('shop:remove_from_cart', args=[item.pk]))
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_admin_cart_item_edits_move_the_reservation(self):
+        self.tomato.quantity = 5
+        self.tomato.save()
+        self.add(self.first)
+        item = CartItem.objects.get()
+        admin_user = Customer.objects.create_superuser('admin@example.com', '+70000000010', 'Админ', 'Админов',
+                                                       password='secret')
+        self.client.force_login(admin_user)
+        url = reverse('admin:shop_cartitem_change', args=[item.pk])
+        data = {'cart': item.cart_id, 'product': self.tomato.pk}
+
+        self.client.post(url, {**data, 'quantity': 3})
+        self.assertEqual((self.reserved(), StockReservation.objects.get().quantity), (3, 3))
+
+        # Больше свободного остатка (5 - 3 + свои 3) не поставить
+        response = self.client.post(url, {**data, 'quantity': 6})
+        self.assertContains(response, 'Доступно: 5')
+        self.assertEqual(self.reserved(), 3)
+
+        self.client.post(reverse('admin:shop_cartitem_delete', args=[item.pk]), {'post': 'yes'})
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Cart.objects.get(user=self.first).item_count, 0)
+
+    def test_order_keeps_reservation_until_confirmed_or_cancelled(self):
+        self.add(self.first)
+        self.client.post(reverse('shop:checkout'), {'address': 'Тула'})
+        order = Order.objects.get()
+        self.assertEqual(StockReservation.objects.get().order, order)
+        self.assertEqual(self.reserved(), 1)
+
+        # Свободная штука уходит во вторую корзину, но заказ первой всё равно подтверждается
+        self.add(self.second)
+        order.update_status('confirmed')
+        self.tomato.refresh_from_db()
+        self.assertEqual((self.tomato.quantity, self.tomato.reserved), (1, 1))
+        self.assertEqual(StockReservation.objects.get().cart.user, self.second)
+
+        # Заказ без резерва не может забрать товар из чужой корзины
+        unreserved = Order.objects.create(customer=self.first)
+        OrderItem.objects.create(order=unreserved, product=self.tomato, quantity=1, price=50)
+        with self.assertRaisesMessage(ValidationError, "'Томат' (на складе: 0, в заказе: 1)"):
+            unreserved.update_status('confirmed')
+        self.assertEqual(bulk_confirm([unreserved.pk]).changed, [])
+        unreserved.update_status('cancelled')
+        self.assertEqual(self.reserved(), 1)
+
+    def test_cancelling_new_order_releases_reservation(self):
+        self.add(self.first)
+        self.add(self.first)
+        self.client.post(reverse('shop:checkout'), {'address': 'Тула'})
+        bulk_cancel([Order.objects.get().pk])
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_reservations_are_swept_in_batches(self):
+        peppers = [Product.objects.create(name=f'Перец {i}', price=10, quantity=5, description='',
+                                          category=self.tomato.category) for i in range(5)]
+        for product in peppers:
+            self.add(self.first, product)
+        self.add(self.second)
+        StockReservation.objects.filter(cart__user=self.first).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(sweep(batch_size=2), 5)
+        self.assertEqual(list(StockReservation.objects.values_list('product', flat=True)), [self.tomato.pk])
+        self.assertEqual(sum(Product.objects.values_list('reserved', flat=True)), 1)
+        call_command('sweep_reservations', '--once', stdout=io.StringIO())
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_expired_reservation_does_not_block_other_carts(self):
+        self.add(self.first)
+        self.add(self.first)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.add(self.second)
+        self.assertEqual(self.reserved(), 1)
+        self.assertEqual(StockReservation.objects.get().cart.user, self.second)
+
+    def test_saving_product_keeps_reserved_counter(self):
+        stale = Product.objects.get(pk=self.tomato.pk)
+        reserve(Cart.objects.create(user=self.first), self.tomato, 2)
+        stale.price = 55
+        stale.save()
+        self.assertEqual(self.reserved(), 2)
+
+        Product.objects.filter(pk=self.tomato.pk).update(reserved=7)
+        self.assertEqual(recount(), {self.tomato.pk: (7, 2)})
+        self.assertEqual(self.reserved(), 2)
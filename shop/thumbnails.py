@@ -0,0 +1,129 @@
+"""Уменьшенные копии изображений товаров (WebP + JPEG).
+
+Для каждой картинки один раз строятся размеры из ``SIZES`` в WebP и JPEG
+и кладутся рядом с оригиналом: ``products/ab/<хэш>.card.webp``,
+``products/ab/<хэш>.card.jpg``. Генерация идёт в пуле потоков и не
+задерживает сохранение товара в админке; шаблоны берут готовые файлы
+через теги из ``shop_images``.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .storage import image_storage
+
+# Имя размера -> максимальные ширина и высота
+SIZES = {
+    'thumb': (100, 100),
+    'card': (400, 400),
+    'detail': (1000, 1000),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def derivative_name(name, size, extension):
+    """``products/ab/<хэш>.jpg`` -> ``products/ab/<хэш>.card.webp``"""
+    stem = os.path.splitext(name)[0]
+    return f"{stem}.{size}.{extension}"
+
+
+def derivative_names(name):
+    return [derivative_name(name, size, extension) for size in SIZES for extension in FORMATS]
+
+
+def is_derivative(name):
+    parts = os.path.basename(name).rsplit('.', 2)
+    return len(parts) == 3 and parts[1] in SIZES and parts[2] in FORMATS
+
+
+def generate_derivatives(name, storage=image_storage, force=False):
+    """Строит все размеры для картинки ``name``; возвращает число созданных файлов"""
+    if not name or is_derivative(name) or not storage.exists(name):
+        return 0
+    targets = [
+        (size, extension, derivative_name(name, size, extension))
+        for size in SIZES for extension in FORMATS
+    ]
+    if not force:
+        targets = [target for target in targets if not storage.exists(target[2])]
+    if not targets:
+        return 0
+
+    with storage.open(name) as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+
+    created = 0
+    for size in SIZES:
+        size_targets = [target for target in targets if target[0] == size]
+        if not size_targets:
+            continue
+        image = original.copy()
+        image.thumbnail(SIZES[size], Image.LANCZOS)
+        for _, extension, target in size_targets:
+            image_format, options = FORMATS[extension]
+            converted = image
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                converted = image.convert('RGB')
+            buffer = BytesIO()
+            converted.save(buffer, image_format, **options)
+            if force and storage.exists(target):
+                storage.delete(target)
+            storage.save_as(target, ContentFile(buffer.getvalue()))
+            created += 1
+    return created
+
+
+def _run(name, force):
+    try:
+        return generate_derivatives(name, force=force)
+    except Exception:
+        # Битая картинка не должна ронять пул
+        logger.exception("Ошибка генерации превью %s", name)
+        return 0
+
+
+def schedule_derivatives(name, force=False):
+    """Ставит генерацию размеров в пул потоков и сразу возвращает Future"""
+    future = executor.submit(_run, str(name), force)
+    with _pending_lock:
+        _pending.add(future)
+    future.add_done_callback(_forget)
+    return future
+
+
+def _forget(future):
+    with _pending_lock:
+        _pending.discard(future)
+
+
+def wait_pending():
+    """Дожидается всех поставленных в пул задач (для команд и тестов)"""
+    with _pending_lock:
+        futures = list(_pending)
+    return sum(future.result() for future in futures)
+
+
+def image_urls(image, size):
+    """URL уменьшенных копий ``{'webp': ..., 'jpg': ...}`` или None, если их ещё нет"""
+    if not image:
+        return None
+    storage = image.storage
+    names = {extension: derivative_name(image.name, size, extension) for extension in FORMATS}
+    if not storage.exists(names['jpg']):
+        return None
+    return {extension: storage.url(name) for extension, name in names.items()}
@@ -15,6 +15,7 @@ urlpatterns = [
     # Товары и категории
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
     path('category/<slug:category_slug>/', views.category_products, name='category_products'),
+    path('search/', views.search, name='search'),
 
     # Корзина
     path('cart/', views.cart_view, name='cart'),
@@ -26,4 +27,7 @@ urlpatterns = [
     # Импорт
     path('import/products/', views.product_import, name='product_import'),
     # path('import/history/', views.import_history, name='import_history'),
+
+    # Выгрузка: /export/products.csv, /export/orders.xlsx?date_from=2024-01-01
+    path('export/<str:kind>.<str:file_format>', views.export_data, name='export_data'),
 ]
\ No newline at end of file
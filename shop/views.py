@@ -6,6 +6,18 @@ from .models import Product, Category
 from django.utils.text import slugify  # ← добавила slugify
 from django.shortcuts import render, redirect, get_object_or_404
 from .models import Product, Category, Cart, CartItem, Order
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from .cart_summary import cart_lines, change_cart, remember_summary
+from .catalog_cache import fragment_key
+from .pagination import InvalidCursor, KeysetPage
+from .search import search_products
+from .recommendations import related_products
+from .facets import facet_counts, filter_products, parse_selection, selection_query
+from . import reservations
+from .orders import place_order
+from django.http import Http404, HttpResponseBadRequest
 
 
 def register(request):
@@ -27,9 +39,11 @@ def catalog(request):
         is_active=True,
         quantity__gt=0
     )[:8]
+    # Запросы ленивые: при попадании в кэш фрагмента они не выполняются
     return render(request, 'shop/catalog.html', {
         'categories': categories,
-        'products': featured_products
+        'products': featured_products,
+        'catalog_key': fragment_key('catalog', ['home']),
     })
 
 
@@ -82,9 +96,6 @@ def send_message(request):
     return redirect('shop:chat_room')
 
 
-import pandas as pd
-import requests
-from django.core.files.base import ContentFile
 from django.contrib.auth.decorators import login_required, user_passes_test
 from .models import ProductImport
 from .forms import ProductImportForm
@@ -103,114 +114,91 @@ def product_import(request):
             import_task = form.save(commit=False)
             import_task.created_by = request.user
             import_task.save()
-            process_excel_import(import_task)
-            messages.success(request,
-                             f'Импорт завершен! Успешно: {import_task.imported_count}, Ошибок: {import_task.error_count}')
-            return redirect('shop:import_history')
+            # Импорт выполняет воркер: python manage.py run_import_worker
+            messages.success(request, f'Импорт #{import_task.id} поставлен в очередь')
+            return redirect('admin:shop_productimport_progress', import_task.id)
     else:
         form = ProductImportForm()
     return render(request, 'shop/product_import.html', {'form': form})
 
 
-def process_excel_import(import_task):
-    try:
-        df = pd.read_excel(import_task.file.path)
-        success_count = 0
-        error_count = 0
-        errors = []
-
-        for index, row in df.iterrows():
+@login_required
+@user_passes_test(is_admin)
+def export_data(request, kind, file_format):
+    """Выгрузка каталога или заказов в CSV/XLSX (для бухгалтерии и поставщиков)"""
+    from django.utils.dateparse import parse_date
+    from .exports import EXPORTS, FORMATS, export_response
+
+    if kind not in EXPORTS or file_format not in FORMATS:
+        raise Http404
+    filters = {}
+    if kind == 'orders':
+        # ?date_from=2024-01-01&date_to=2024-12-31
+        for name in ('date_from', 'date_to'):
             try:
-                product = Product(
-                    name=row['Название'],
-                    description=row.get('Описание', ''),
-                    short_description=row.get('Краткое описание', ''),
-                    price=row['Цена'],
-                    old_price=row.get('Старая цена'),
-                    quantity=row.get('Количество', 0),
-                    category=get_or_create_category(row.get('Категория', 'Разное')),
-                    is_active=True
-                )
-
-                image_url = row.get('Изображение')
-                if image_url and pd.notna(image_url):
-                    product.image = download_image(image_url, product.name)
-
-                product.save()
-                success_count += 1
-
-            except Exception as e:
-                error_count += 1
-                errors.append(f"Строка {index + 2}: {str(e)}")
-
-        import_task.status = 'success'
-        import_task.imported_count = success_count
-        import_task.error_count = error_count
-        import_task.errors = '\n'.join(errors)
-        import_task.save()
-
-    except Exception as e:
-        import_task.status = 'error'
-        import_task.errors = str(e)
-        import_task.save()
-
-
-def get_or_create_category(name):
-    category, created = Category.objects.get_or_create(
-        name=name,
-        defaults={'slug': slugify(name), 'is_active': True}
-    )
-    return category
-
-
-def download_image(url, product_name):
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-
-        file_extension = url.split('.')[-1].lower()
-        if file_extension not in ['jpg', 'jpeg', 'png', 'gif']:
-            file_extension = 'jpg'
-
-        filename = f"{slugify(product_name)}.{file_extension}"
-
-        from io import BytesIO
-        from django.core.files import File
-
-        image_content = ContentFile(response.content)
-        return File(image_content, name=filename)
-
-    except Exception as e:
-        print(f"Ошибка загрузки изображения: {e}")
-        return None
+                value = parse_date(request.GET.get(name, ''))
+            except ValueError:
+                # Формат верный, а даты нет: 2024-13-45
+                value = None
+            if value is None and request.GET.get(name):
+                return HttpResponseBadRequest(f'Некорректная дата {name}: ожидается ГГГГ-ММ-ДД')
+            if value:
+                filters[name] = value
+    return export_response(kind, file_format, **filters)
 
 
 def product_detail(request, product_id):
     """Детальная страница товара"""
-    product = get_object_or_404(Product, id=product_id, is_active=True)
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).exclude(id=product_id)[:4]
-
+    product = get_object_or_404(Product.objects.select_related('category'), id=product_id, is_active=True)
     return render(request, 'shop/product_detail.html', {
         'product': product,
-        'related_products': related_products
+        'related_products': related_products(product),
+        'info_key': fragment_key('product_info', [f'product:{product.pk}']),
+        'related_key': fragment_key('related_products', [f'category:{product.category_id}', f'product:{product.pk}']),
     })
 
 
 def category_products(request, category_slug):
-    """Товары в категории"""
+    """Товары в категории, по странице за раз (keyset-пагинация).
+
+    ``?after=<курсор>`` — следующая страница, ``&fragment=1`` — только
+    карточки без обвязки страницы, для подгрузки при прокрутке. Фильтры
+    (``price``, ``sale``, ``featured``, ``stock``) и их счётчики — ``facets.py``.
+    """
     category = get_object_or_404(Category, slug=category_slug, is_active=True)
-    products = Product.objects.filter(
-        category=category,
-        is_active=True,
-        quantity__gt=0
-    )
+    selection = parse_selection(request.GET)
+    filter_query = selection_query(selection)
+    products = filter_products(Product.objects.filter(category=category, is_active=True), selection)
+    try:
+        page = KeysetPage(products, request.GET.get('after'))
+    except InvalidCursor:
+        raise Http404('Некорректный курсор страницы')
 
-    return render(request, 'shop/category_products.html', {
+    context = {
         'category': category,
-        'products': products
+        'page': page,
+        'filter_query': filter_query,
+        'grid_key': fragment_key('category_grid', [f'category:{category.pk}'], filter_query, page.after or ''),
+    }
+    if request.GET.get('fragment'):
+        return render(request, 'shop/includes/category_page.html', context)
+    context['facet_groups'], context['facet_total'] = facet_counts(category, selection)
+    return render(request, 'shop/category_products.html', context)
+
+
+def search(request):
+    """Поиск товаров: ``?q=…&page=N``, результаты по релевантности"""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    products, has_next = search_products(query, page)
+    return render(request, 'shop/search.html', {
+        'query': query,
+        'products': products,
+        'page': page,
+        'has_next': has_next,
     })
 
 
@@ -231,17 +219,24 @@ def add_to_cart(request, product_id):
     # Получаем или создаем корзину
     cart = get_or_create_cart(request)
 
-    # Проверяем, есть ли товар уже в корзине
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': 1}
-    )
+    try:
+        with transaction.atomic():
+            # Проверяем, есть ли товар уже в корзине
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=cart,
+                product=product,
+                defaults={'quantity': 1}
+            )
 
-    if not created:
-        # Если товар уже есть, увеличиваем количество
-        cart_item.quantity += 1
-        cart_item.save()
+            if not created:
+                # Если товар уже есть, увеличиваем количество
+                CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + 1)
+            # Штука резервируется за корзиной; если свободных нет, добавление откатывается
+            reservations.reserve(cart, product, 1)
+            change_cart(cart, 1, product.price)
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+        return redirect('shop:cart')
 
     messages.success(request, f'Товар "{product.name}" добавлен в корзину!')
     return redirect('shop:cart')
@@ -249,8 +244,11 @@ def add_to_cart(request, product_id):
 
 def remove_from_cart(request, item_id):
     """Удаление товара из корзины"""
-    cart_item = get_object_or_404(CartItem, id=item_id)
-    cart_item.delete()
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart', 'product'), id=item_id)
+    with transaction.atomic():
+        cart_item.delete()
+        reservations.reserve(cart_item.cart, cart_item.product, -cart_item.quantity)
+        change_cart(cart_item.cart, -cart_item.quantity, -cart_item.total_price)
     messages.success(request, 'Товар удален из корзины')
     return redirect('shop:cart')
 
@@ -259,15 +257,25 @@ def update_cart_item(request, item_id):
     """Обновление количества товара в корзине"""
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
-        cart_item = get_object_or_404(CartItem, id=item_id)
-
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-            messages.success(request, 'Количество обновлено')
+        cart_item = get_object_or_404(CartItem.objects.select_related('cart', 'product'), id=item_id)
+
+        try:
+            with transaction.atomic():
+                if quantity > 0:
+                    delta = quantity - cart_item.quantity
+                    cart_item.quantity = quantity
+                    cart_item.save(update_fields=['quantity'])
+                    message = 'Количество обновлено'
+                else:
+                    delta = -cart_item.quantity
+                    cart_item.delete()
+                    message = 'Товар удален из корзины'
+                reservations.reserve(cart_item.cart, cart_item.product, delta)
+                change_cart(cart_item.cart, delta, delta * cart_item.product.price)
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
         else:
-            cart_item.delete()
-            messages.success(request, 'Товар удален из корзины')
+            messages.success(request, message)
 
     return redirect('shop:cart')
 
@@ -275,10 +283,14 @@ def update_cart_item(request, item_id):
 def cart_view(request):
     """Просмотр корзины"""
     cart = get_or_create_cart(request)
+    # Позиции с товарами одним запросом, итоги по ним же
+    cart_items, summary = cart_lines(cart)
+    remember_summary(request, summary)
 
     return render(request, 'shop/cart.html', {
         'cart': cart,
-        'cart_items': cart.items.all()
+        'cart_items': cart_items,
+        'cart_summary': summary,
     })
 
 
@@ -305,32 +317,33 @@ def checkout(request):
     cart = get_or_create_cart(request)
 
     if request.method == 'POST':
-        # Создаем заказ
-        order = Order.objects.create(
-            customer=request.user,
-            contact_phone=request.POST.get('phone', request.user.phone),
-            delivery_address=request.POST.get('address', request.user.address),
-            comment=request.POST.get('comment', ''),
-            status='new'
-        )
-
-        # Переносим товары из корзины в заказ
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
+        try:
+            order = place_order(
+                cart,
+                customer=request.user,
+                contact_phone=request.POST.get('phone') or request.user.phone,
+                delivery_address=request.POST.get('address', request.user.address),
+                comment=request.POST.get('comment', ''),
             )
-
-        # Очищаем корзину
-        cart.items.all().delete()
-        cart.delete()
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
+            return redirect('shop:cart')
 
         messages.success(request, f'Заказ #{order.id} успешно оформлен!')
         return redirect('shop:profile')
 
+    cart_items, summary = cart_lines(cart)
+    if cart_items:
+        # Начало оформления резервирует всю корзину и продлевает резерв
+        try:
+            reservations.reserve_cart(cart, cart_items)
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
+            return redirect('shop:cart')
+    remember_summary(request, summary)
     return render(request, 'shop/checkout.html', {
         'cart': cart,
+        'cart_items': cart_items,
+        'cart_summary': summary,
         'user': request.user
     })
\ No newline at end of file